@@ -1,31 +1,41 @@
 import streamlit as st
 import requests
-import pandas as pd
-import pytz
 import datetime
 import io
-from streamlit_autorefresh import st_autorefresh
-import ftplib
-import io
 import time
-import datetime
 import os
-from free_gift_handler import FreeGiftReceiver, get_streaming_server_info, update_free_gift_master, gift_queue
-
-
-def upload_csv_to_ftp(filename: str, csv_buffer: io.BytesIO):
-    """Secretsに登録されたFTP設定を使ってCSVをアップロード"""
+# 💡 pandas・ftplib・SQLite アーカイブは認証後に読み込む（認証画面の初回表示を軽くするため）
+from free_gift_handler import FreeGiftReceiver, FreeGiftCoalescer, get_streaming_server_info, check_broadcast_session, update_free_gift_master, gift_queue, receivers_health, publish_receiver_metrics
+from save_scheduler import SaveScheduler, SAVE_KINDS
+from stream_lifecycle import get_stream_lifecycle, reset_stream_lifecycle
+from event_log import EventLog
+from room_state import parse_room_ids, new_room_state, bind_room, store_room
+from time_series import MinuteSeries, SERIES_LABELS
+from user_index import UserIndex, EVENT_LABELS
+from comment_search import CommentSearchIndex, SEARCH_RESULT_LIMIT
+from room_feed import get_room_feed, enrich_gift_entry, LOG_TYPES as ROOM_FEED_LOG_TYPES
+from system_messages import KIND_LABELS, VISIT_KINDS, FAN_LEVEL, GAP, classified
+from html_fragments import render_feed
+from auth_registry import get_auth_registry
+from perf_metrics import begin_run, end_run, current_run, stage, timed, count, start_metrics_server, snapshot as perf_snapshot
+
+
+@timed("ftp.upload")
+def upload_csvs_to_ftp(files):
+    """Secretsに登録されたFTP設定を使って、複数のCSV [(ファイル名, CSVのバイト列)] を1回の接続でアップロード。成功したら True"""
+    import ftplib  # アップロード時にだけ必要なため遅延インポート
     ftp_info = st.secrets["ftp"]
     try:
-        ftp = ftplib.FTP(ftp_info["host"])
+        ftp = ftplib.FTP()
+        ftp.connect(ftp_info["host"], int(ftp_info.get("port", 21)))
         ftp.login(ftp_info["user"], ftp_info["password"])
         ftp.cwd("/rokudouji.net/mksoul/showroom_onlives_logs")
 
         # アップロード
-        csv_buffer.seek(0)
-        ftp.storbinary(f"STOR {filename}", csv_buffer)
+        for filename, csv_bytes in files:
+            ftp.storbinary(f"STOR {filename}", io.BytesIO(csv_bytes))
 
-        # --- 古いファイル削除（48時間以上前） ---
+        # --- 古いファイル削除（48時間以上前）。まとめて保存した分につき1回だけ行う ---
         file_list = []
         ftp.retrlines("LIST", file_list.append)
         now = datetime.datetime.now()
@@ -46,9 +56,11 @@ def upload_csv_to_ftp(filename: str, csv_buffer: io.BytesIO):
                 continue
 
         ftp.quit()
-        st.success(f"✅ FTPに保存完了: {filename}")
+        st.success(f"✅ FTPに保存完了: {', '.join(filename for filename, _ in files)}")
+        return True
     except Exception as e:
         st.error(f"FTP保存中にエラー: {e}")
+        return False
 
 
 def auto_backup_if_needed():
@@ -83,80 +95,87 @@ def auto_backup_if_needed():
         upload_to_ftp(content, filename)
 
 
-# --- ▼ 共通FTP保存関数（コメント・ギフトログ用） ▼ ---
-def save_log_to_ftp(log_type: str):
+# --- ▼ 共通FTP保存関数（全4ログ用） ▼ ---
+def save_logs(kinds):
     """
-    コメント or ギフトログをFTPに保存
-    log_type: "comment" または "gift"
+    現在バインドされているルームの kinds（comment / gift / free_gift / system_msg）のログを、それぞれ CSV にして
+    1回の FTP 接続でまとめて保存する。DataFrame の作成と CSV 化はワーカープロセスで行う（export_jobs）。
+    保存できたら（保存対象がなかった場合も）自動保存のスケジューラに保存済みとして記録し、True を返す
+    """
+    scheduler = st.session_state.save_scheduler
+    logs = {kind: st.session_state[f"{kind}_log"] for kind in kinds}
+    saved_state = scheduler.snapshot(logs)
+    scheduler.mark_attempted()
+    timestamp = datetime.datetime.now(JST).strftime("%Y%m%d_%H%M%S")
+    files = []
+    for kind, log in logs.items():
+        with stage(f"export.{kind}_csv"):
+            csv_bytes = export_jobs.run(export_jobs.log_csv, kind, export_jobs.pack(kind, log), SYSTEM_COMMENT_KEYWORDS)
+        if csv_bytes is not None:
+            files.append((f"{kind}_log_{st.session_state.room_id}_{timestamp}.csv", csv_bytes))
+    if files and not upload_csvs_to_ftp(files):
+        return False
+    scheduler.mark_saved(saved_state)
+    return True
+
+def save_log_to_ftp(*log_types):
+    """
+    ログをFTPに保存（複数指定した場合はまとめて保存）
+    log_types: "comment" / "gift" / "free_gift" / "system_msg"
     """
     try:
-        room = st.session_state.room_id
-        if not room:
+        log_types = [log_type for log_type in log_types if log_type in SAVE_KINDS]
+        if not st.session_state.room_id or not log_types:
             return
+        save_logs(log_types)
+    except Exception as e:
+        st.error(f"ログ保存中にエラー: {e}")
 
-        timestamp = datetime.datetime.now(JST).strftime("%Y%m%d_%H%M%S")
 
-        # ===== コメントログ処理 =====
-        if log_type == "comment":
-            filtered_comments = [
-                log for log in st.session_state.comment_log
-                if not any(keyword in log.get('name', '') or keyword in log.get('comment', '')
-                           for keyword in SYSTEM_COMMENT_KEYWORDS)
-            ]
-            if not filtered_comments:
-                return
-
-            comment_df = pd.DataFrame(filtered_comments)
-            comment_df['created_at'] = pd.to_datetime(comment_df['created_at'], unit='s') \
-                .dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-            comment_df['user_id'] = [log.get('user_id', 'N/A') for log in filtered_comments]
-            comment_df = comment_df.rename(columns={
-                'name': 'ユーザー名',
-                'comment': 'コメント内容',
-                'created_at': 'コメント時間',
-                'user_id': 'ユーザーID'
-            })
-            cols = ['コメント時間', 'ユーザー名', 'コメント内容', 'ユーザーID']
-            buf = io.BytesIO()
-            comment_df[cols].to_csv(buf, index=False, encoding='utf-8-sig')
-            buf.seek(0)
-            filename = f"comment_log_{room}_{timestamp}.csv"
-            upload_csv_to_ftp(filename, buf)
-
-        # ===== ギフトログ処理 =====
-        elif log_type == "gift":
-            if not st.session_state.gift_log:
-                return
-            gift_df = pd.DataFrame(st.session_state.gift_log)
-            gift_df['created_at'] = pd.to_datetime(gift_df['created_at'], unit='s') \
-                .dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-
-            if st.session_state.gift_list_map:
-                gift_info_df = pd.DataFrame.from_dict(st.session_state.gift_list_map, orient='index')
-                gift_info_df.index = gift_info_df.index.astype(str)
-                gift_df['gift_id'] = gift_df['gift_id'].astype(str)
-                gift_df = gift_df.set_index('gift_id') \
-                    .join(gift_info_df, on='gift_id', lsuffix='_user_data', rsuffix='_gift_info') \
-                    .reset_index()
-
-            gift_df = gift_df.rename(columns={
-                'name_user_data': 'ユーザー名',
-                'name_gift_info': 'ギフト名',
-                'num': '個数',
-                'point': 'ポイント',
-                'created_at': 'ギフト時間',
-                'user_id': 'ユーザーID'
-            })
-            cols = ['ギフト時間', 'ユーザー名', 'ギフト名', '個数', 'ポイント', 'ユーザーID']
-            buf = io.BytesIO()
-            gift_df[cols].to_csv(buf, index=False, encoding='utf-8-sig')
-            buf.seek(0)
-            filename = f"gift_log_{room}_{timestamp}.csv"
-            upload_csv_to_ftp(filename, buf)
+
+
+# --- ▼ 配信終了時の最終保存（全4ログ＋ローカルアーカイブ） ▼ ---
+def flush_final_logs():
+    """
+    配信終了・トラッキング停止時の最終保存（FTP＋ローカルアーカイブ）。StreamLifecycle.finalize() 経由で一度だけ呼ばれる。
+    どちらかに失敗したら例外を投げ、ライフサイクルを finalized にしない（次の機会に両方をやり直す）
+    """
+    # ギフト名・ポイントが未確定の有償ギフトは、最後に取得したギフトリストで付け直してから保存する
+    resolve_unresolved_gifts()
+    # 1〜4. コメント・有償ギフト・無償ギフト・システムメッセージの各ログをまとめて保存
+    if not save_logs(SAVE_KINDS):
+        raise RuntimeError("FTPへの最終保存に失敗しました")
+
+    # 5. ローカルアーカイブ (SQLite) へ保存
+    archive_stream(
+        st.session_state.room_id,
+        [
+            log for log in st.session_state.comment_log
+            if not any(keyword in log.get("name", "") or keyword in log.get("comment", "") for keyword in SYSTEM_COMMENT_KEYWORDS)
+        ],
+        st.session_state.gift_log,
+        st.session_state.free_gift_log,
+        st.session_state.get("system_msg_log", []),
+        st.session_state.gift_list_map,
+    )
+
+def finalize_stream(room_id):
+    """
+    現在バインドされているルームの最終保存 (flush_final_logs) を、ライフサイクルで一度だけ実行する。
+    配信終了の検知とトラッキング停止の両方から呼ぶ。失敗した場合はエラーを表示して False を返す（次の機会に再試行される）
+    """
+    lifecycle = get_stream_lifecycle(st.session_state.stream_lifecycles, room_id)
+    try:
+        lifecycle.finalize(flush_final_logs)
     except Exception as e:
-        st.error(f"ログ保存中にエラー: {e}")
+        st.error(f"ルームID {room_id} の最終保存中にエラーが発生しました（次回の更新時に再試行します）: {e}")
+        return False
+    return True
 
 
+# 再実行ごとの計測を開始（SRLOG_METRICS_PORT 指定時は /metrics もプロセスで1回だけ起動）
+begin_run()
+start_metrics_server()
 
 # ページ設定
 st.set_page_config(
@@ -170,15 +189,24 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
     "Accept-Language": "ja-JP,ja;q=0.9,en-US;q=0.8,en;q=0.7",
 }
-JST = pytz.timezone('Asia/Tokyo')
-ONLIVES_API_URL = "https://www.showroom-live.com/api/live/onlives"
-COMMENT_API_URL = "https://www.showroom-live.com/api/live/comment_log"
-GIFT_API_URL = "https://www.showroom-live.com/api/live/gift_log"
-GIFT_LIST_API_URL = "https://www.showroom-live.com/api/live/gift_list"
-FAN_LIST_API_URL = "https://www.showroom-live.com/api/active_fan/users"
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')  # 日本はサマータイムがないため固定オフセットで十分
+# 負荷試験などでローカルの代替サーバーを使う場合は環境変数で接続先を差し替える
+SHOWROOM_API_BASE = os.environ.get("SRLOG_SHOWROOM_API_BASE", "https://www.showroom-live.com/api")
+ONLIVES_API_URL = f"{SHOWROOM_API_BASE}/live/onlives"
+COMMENT_API_URL = f"{SHOWROOM_API_BASE}/live/comment_log"
+GIFT_API_URL = f"{SHOWROOM_API_BASE}/live/gift_log"
+GIFT_LIST_API_URL = f"{SHOWROOM_API_BASE}/live/gift_list"
+FAN_LIST_API_URL = f"{SHOWROOM_API_BASE}/active_fan/users"
+ROOM_PROFILE_API_URL = f"{SHOWROOM_API_BASE}/room/profile"
 SYSTEM_COMMENT_KEYWORDS = ["SHOWROOM Management", "Earn weekly glittery rewards!", "ウィークリーグリッター特典獲得中！", "SHOWROOM運営"]
-DEFAULT_AVATAR = "https://static.showroom-live.com/image/avatar/default_avatar.png"
-ROOM_LIST_URL = "https://mksoul-pro.com/showroom/file/room_list.csv"
+ROOM_LIST_URL = os.environ.get("SRLOG_ROOM_LIST_URL", "https://mksoul-pro.com/showroom/file/room_list.csv")
+# 1セッション（タブ）あたりのログ用メモリ予算（ルームごとにログ4種・コメント検索の索引・ユーザー索引で等分）。超えた分はディスク上のセグメントへ退避する
+SESSION_LOG_MEMORY_BUDGET_BYTES = int(os.environ.get("SRLOG_SESSION_MEMORY_MB", "16")) * 1024 * 1024
+SESSION_LOG_NAMES = ("comment_log", "gift_log", "free_gift_log", "system_msg_log")
+# 表示していないルームのファンリストを取得する間隔（秒）
+BACKGROUND_FAN_LIST_INTERVAL_SEC = 60
+# 同一ユーザー・同一無償ギフトをまとめる時間幅（秒）。0 で合算しない
+FREE_GIFT_COALESCE_WINDOW_SEC = int(os.environ.get("SRLOG_FREE_GIFT_COALESCE_SEC", "10"))
 
 if "authenticated" not in st.session_state:  #認証用
     st.session_state.authenticated = False  #認証用
@@ -265,7 +293,6 @@ CSS_STYLE = """
 }
 </style>
 """
-st.markdown(CSS_STYLE, unsafe_allow_html=True)
 
 # エラーメッセージ・警告メッセージの幅を100%に変更
 CUSTOM_MSG_CSS = """
@@ -291,37 +318,29 @@ section.main div.block-container {
 st.markdown(CUSTOM_MSG_CSS, unsafe_allow_html=True)
 
 
-# セッション状態の初期化
-if "room_id" not in st.session_state:
-    st.session_state.room_id = ""
-if "is_tracking" not in st.session_state:
-    st.session_state.is_tracking = False
-if "comment_log" not in st.session_state:
-    st.session_state.comment_log = []
-if "gift_log" not in st.session_state:
-    st.session_state.gift_log = []
-if "fan_list" not in st.session_state:
-    st.session_state.fan_list = []
-if "gift_list_map" not in st.session_state:
-    st.session_state.gift_list_map = {}
-if 'onlives_data' not in st.session_state:
-    st.session_state.onlives_data = {}
-if 'total_fan_count' not in st.session_state:
-    st.session_state.total_fan_count = 0
+def session_memory_share(room_count):
+    """セッションのメモリ予算を、ルーム数×（ログ4種＋コメント検索の索引＋ユーザー索引）で等分した1つ分"""
+    return SESSION_LOG_MEMORY_BUDGET_BYTES // ((len(SESSION_LOG_NAMES) + 2) * room_count)
+
+
+def new_session_log(name, room_count=1):
+    """セッション用のログを作成する"""
+    return EventLog(name, memory_budget_bytes=session_memory_share(room_count))
+
+
+def new_comment_search(room_count=1):
+    """コメント検索の索引を作成する（本文はログと同じく予算を超えた分をディスクへ退避する）"""
+    return CommentSearchIndex(memory_budget_bytes=session_memory_share(room_count))
+
+
+def new_user_index(room_count=1):
+    """ユーザー索引を作成する（タイムラインは予算を超えたら古い行から捨てる）"""
+    return UserIndex(memory_budget_bytes=session_memory_share(room_count))
 
-# --- 無償ギフト用に追加 ---
-if "free_gift_log" not in st.session_state:
-    st.session_state.free_gift_log = []
-if "raw_free_gift_queue" not in st.session_state:
-    st.session_state.raw_free_gift_queue = []
-if "free_gift_master" not in st.session_state:
-    st.session_state.free_gift_master = {} # {gift_id: {name, point, image}}
-if "ws_receiver" not in st.session_state:
-    st.session_state.ws_receiver = None
-# -----------------------
 
 # --- API連携関数 ---
 
+@timed("api.onlives")
 def get_onlives_rooms():
     onlives = {}
     try:
@@ -353,35 +372,76 @@ def get_onlives_rooms():
         st.error("配信情報のJSONデコードまたは解析に失敗しました。")
     return onlives
 
-def get_and_update_log(log_type, room_id):
+def fetch_log(log_type, room_id):
+    """コメント・有償ギフトのAPIから直近のログを取得する（ルームの共有フィードから呼ばれる）"""
     api_url = COMMENT_API_URL if log_type == "comment" else GIFT_API_URL
     url = f"{api_url}?room_id={room_id}"
-    try:
+    with stage(f"api.{log_type}_log"):
         response = requests.get(url, headers=HEADERS, timeout=5)
         response.raise_for_status()
-        new_log = response.json().get(f'{log_type}_log', [])
+        return response.json().get(f'{log_type}_log', [])
+
+def room_feed(room_id):
+    """ルームの共有フィード（同じルームを開いている全セッションで1系統のポーリング）"""
+    return get_room_feed(room_id, fetch_log, fetch_gift_list, get_fan_list)
+
+def ingest_room_feed(feed):
+    """共有フィードから、このセッションがまだ取り込んでいないコメント・有償ギフトをセッションのログへ取り込む"""
+    cursors = st.session_state.feed_cursors
+    series = st.session_state.time_series
+    user_index = st.session_state.user_index
+    for log_type in ROOM_FEED_LOG_TYPES:
+        fresh, cursors[log_type], missed = feed.read(log_type, cursors.get(log_type))
         existing_cache = st.session_state[f"{log_type}_log"]
-        existing_log_keys = {(log.get('created_at'), log.get('name')) for log in existing_cache}
-        for log in new_log:
-            log_key = (log.get('created_at'), log.get('name'))
-            if log_key not in existing_log_keys:
-                existing_cache.append(log)
-                existing_log_keys.add(log_key)
-        existing_cache.sort(key=lambda x: x.get('created_at', 0), reverse=True)
-        return existing_cache
-    except requests.exceptions.RequestException:
-        st.warning(f"ルームID {room_id} の{log_type}ログ取得中にエラーが発生しました。配信中か確認してください。")
-        return st.session_state.get(f"{log_type}_log", [])
-
-def get_gift_list(room_id, force_update=False):
+        for log in fresh:
+            existing_cache.add(log)
+            if log_type == "comment":
+                series.record("comments", log.get('created_at', 0))
+                user_index.record("comment", log)
+                st.session_state.comment_search.add(log)
+            else:
+                # ギフトリストにまだない ID のギフトは 0 pt で記録し、付け直した時にポイントを加算する
+                points = 0 if log.get('gift_unresolved') else log.get('line_pt', 0)
+                if log.get('gift_unresolved'):
+                    st.session_state.unresolved_gifts.append(log)
+                series.record("gift_points", log.get('created_at', 0), points, log.get('user_id'), log.get('name'))
+                user_index.record("gift", log, points)
+        count("srlog_events_total", len(fresh), log=log_type, outcome="ingested")
+        count("srlog_events_total", missed, log=log_type, outcome="missed")
+        if feed.errors.get(log_type):
+            st.warning(f"ルームID {feed.room_id} の{log_type}ログ取得中にエラーが発生しました。配信中か確認してください。")
+
+def resolve_unresolved_gifts():
     """
-    ギフトリストを取得しキャッシュする。
-    force_update=True、または未知のギフトIDに遭遇した際に再取得を行う。
+    取り込み時にギフトリストになかった有償ギフトに、取り直したリストからギフト名・ポイントを付け直し、
+    時系列・ユーザー索引へポイントを加算する（ログの version も進め、表・CSV・保存の対象にする）
+    """
+    pending = st.session_state.unresolved_gifts
+    if not pending:
+        return
+    gift_list_map = st.session_state.gift_list_map
+    still_unresolved = []
+    for log in pending:
+        # 共有フィードの同じエントリーを他のセッションが付け直し済みの場合も、ポイントの加算はセッションごとに行う
+        if log.get('gift_unresolved') and str(log.get('gift_id')) in gift_list_map:
+            enrich_gift_entry(log, gift_list_map)
+        if log.get('gift_unresolved'):
+            still_unresolved.append(log)
+            continue
+        st.session_state.time_series.record("gift_points", log.get('created_at', 0), log.get('line_pt', 0), log.get('user_id'), log.get('name'))
+        st.session_state.user_index.add_points("gift", log.get('user_id'), log.get('line_pt', 0))
+    resolved = len(pending) - len(still_unresolved)
+    if resolved:
+        st.session_state.gift_log.touch()
+        count("srlog_events_total", resolved, log="gift", outcome="resolved")
+    st.session_state.unresolved_gifts = still_unresolved
+
+@timed("api.gift_list")
+def fetch_gift_list(room_id):
+    """
+    ギフトリストを取得して {gift_id: {name, point, image, free}} を返す（取得できなければ None）。
+    キャッシュと未知のギフトIDでの取り直しはルームの共有フィード側で行う。
     """
-    # キャッシュがあり、強制更新でない場合はそのまま返す
-    if st.session_state.gift_list_map and not force_update:
-        return st.session_state.gift_list_map
-
     url = f"{GIFT_LIST_API_URL}?room_id={room_id}"
     try:
         response = requests.get(url, headers=HEADERS, timeout=5)
@@ -407,13 +467,13 @@ def get_gift_list(room_id, force_update=False):
                         'free': gift.get('free', False)
                     }
         
-        st.session_state.gift_list_map = new_map
         return new_map
     except Exception as e:
         print(f"Gift List API Error: {e}")
-        return st.session_state.get('gift_list_map', {})
+        return None
 
 
+@timed("api.fan_list")
 def get_fan_list(room_id):
     fan_list = []
     offset = 0
@@ -445,16 +505,17 @@ def get_fan_list(room_id):
 
 # --- ルームリスト取得関数 ---
 def get_room_list():
+    """トラッキング可能なルームIDの frozenset を返す（プロセス共通のキャッシュから。取得できなければ空）"""
     try:
-        df = pd.read_csv(ROOM_LIST_URL)
-        return df
+        return get_auth_registry(ROOM_LIST_URL).get().room_ids
     except Exception:
-        return pd.DataFrame()
+        return frozenset()
 
 
+@timed("api.gift_list_free")
 def update_free_gift_master(room_id):
     """ギフトリストAPIから無償ギフト(free=True)のみを抽出し、セッション状態のマスターを更新する"""
-    url = f"https://www.showroom-live.com/api/live/gift_list?room_id={room_id}"
+    url = f"{GIFT_LIST_API_URL}?room_id={room_id}"
     try:
         response = requests.get(url, headers=HEADERS, timeout=5)
         response.raise_for_status()
@@ -478,6 +539,144 @@ def update_free_gift_master(room_id):
         st.error(f"ギフトリストの取得に失敗しました: {e}")
 
 
+
+def watch_broadcast_session(onlive):
+    """
+    現在バインドされているルームの配信回の切り替わりを確認する（free_gift_handler.check_broadcast_session）。
+    受信機の購読を切り替えた場合は、欠落の可能性がある区間をシステムMSGに記録し、コメント・有償ギフトは
+    REST から待たずに取り直す（無償ギフト・システムMSG は REST で取得できないため、記録のみ）
+    """
+    receiver = st.session_state.get("ws_receiver")
+    if receiver is None or not receiver.is_running:
+        return
+    gap = check_broadcast_session(receiver, onlive)
+    if gap is None:
+        return
+    gap_start, gap_end = gap
+    time_range = "〜".join(datetime.datetime.fromtimestamp(ts, JST).strftime("%H:%M:%S") for ts in gap)
+    st.session_state.system_msg_log.add({
+        "created_at": int(gap_start),
+        "message": f"⚠️ 配信の再開を検知し、受信先を切り替えました（{time_range} の無償ギフト・システムメッセージは取得できていない可能性があります）",
+        "user_id": None,
+        "kind": GAP,
+        "visit_count": None,
+        "fan_level": None,
+    })
+    room_feed(st.session_state.room_id).request_poll()
+    count("srlog_events_total", log="system_msg", outcome="gap")
+
+def refresh_room_logs(is_live_now, is_viewed=True):
+    """
+    現在バインドされているルームのログを更新する（API取得・キューの取り出し・自動保存）。
+    複数ルームの場合はルームごとに bind_room() してから呼び出す。
+    """
+    # 配信中の時だけ新しいログを取得しにいく
+    # 取得はルーム単位の共有フィードが行い（他のセッションが取得したばかりなら取りに行かない）、
+    # このセッションはカーソル以降の分を取り込むだけにする
+    feed = room_feed(st.session_state.room_id)
+    # 表示していないルームのファンリストは間隔を空けて取得する（ページ送りで重いため）
+    feed.poll(include_logs=is_live_now, fan_interval_sec=0 if is_viewed else BACKGROUND_FAN_LIST_INTERVAL_SEC)
+    if is_live_now:
+        ingest_room_feed(feed)
+    else:
+        # 💡 ここにあった st.info を削除（またはコメントアウト）します
+        # st.info("配信が終了したため、自動更新を停止しました。現在のログを保持しています。")
+        pass
+
+    #auto_backup_if_needed()
+    st.session_state.gift_list_map = feed.gift_list_map
+    resolve_unresolved_gifts()
+    st.session_state.fan_list = feed.fan_list
+    st.session_state.total_fan_count = feed.total_fan_count
+    st.session_state.fan_list_version = feed.fan_list_version
+
+    # --- 放置で自動停止された受信機は、配信中なら再開する ---
+    receiver = st.session_state.get("ws_receiver")
+    if receiver and receiver.reaped and is_live_now:
+        receiver.start()
+
+    # --- 無償ギフト・システムMSG：キューからデータを取り出してログに変換 ---
+    with stage("ingest.queue_drain"):
+        while not gift_queue.empty():
+            try:
+                raw_data = gift_queue.get_nowait()
+            
+                # t の判定（文字列に変換して比較するのが最も安全です）
+                m_type = str(raw_data.get("t", ""))
+
+                # --- ✅ A. システムメッセージ (t: 18) の処理 ---
+                if m_type == "18":
+                    # time.time() は使わず、datetime で安全にタイムスタンプを取得
+                    ts = raw_data.get("created_at") or int(datetime.datetime.now().timestamp())
+                    # 種別・訪問回数・ファンレベルは受信機で分類済み（system_messages.classify_system_message）
+                    new_sys_entry = classified({
+                        "created_at": ts,
+                        "message": raw_data.get("m", ""),
+                        "user_id": raw_data.get("u"),
+                        "kind": raw_data.get("kind"),
+                        "visit_count": raw_data.get("visit_count"),
+                        "fan_level": raw_data.get("fan_level"),
+                    })
+                    st.session_state.system_msg_log.add(new_sys_entry)
+                    st.session_state.user_index.record("system_msg", new_sys_entry)
+                    if new_sys_entry["kind"] in VISIT_KINDS:
+                        st.session_state.time_series.record("visits", ts)
+                    count("srlog_events_total", log="system_msg", outcome="ingested")
+                    # 件数の切り詰めは行わず、メモリ上限は EventLog の予算で管理する
+
+                # --- 🎁 B. 無償ギフト (t: 2) の処理 ---
+                elif m_type == "2":
+                    g_id = raw_data.get("g")
+                    if g_id is None:
+                        count("srlog_events_total", log="free_gift", outcome="dropped")
+                        continue
+                
+                    # ギフトマスターとの照合
+                    master = st.session_state.get("free_gift_master", {})
+                    # IDが数値でも文字列でも見つけられるように検索
+                    gift_info = master.get(str(g_id)) or master.get(g_id)
+                
+                    if not gift_info:
+                        # マスターにない（有償ギフトなど）場合はスキップ
+                        count("srlog_events_total", log="free_gift", outcome="dropped")
+                        continue
+                
+                    ts = raw_data.get("created_at") or int(datetime.datetime.now().timestamp())
+                    new_entry = {
+                        "created_at": ts,
+                        "user_id": raw_data.get("u"),
+                        "name": raw_data.get("ac"),
+                        "avatar_id": raw_data.get("av"),
+                        "gift_id": str(g_id),
+                        "gift_name": gift_info.get("name"),
+                        "point": gift_info.get("point", 1),
+                        "num": raw_data.get("n", 1),
+                        "image": gift_info.get("image", "")
+                    }
+                    # 連打は (user_id, gift_id) 単位で1件にまとめて追加する
+                    merged = st.session_state.free_gift_coalescer.add(new_entry, st.session_state.free_gift_log)
+                    st.session_state.time_series.record("free_gifts", ts, new_entry["num"])
+                    st.session_state.user_index.record("free_gift", new_entry, new_entry["num"] * new_entry["point"], merged)
+                    count("srlog_events_total", log="free_gift", outcome="coalesced" if merged else "ingested")
+                    # 件数の切り詰めは行わず、メモリ上限は EventLog の予算で管理する
+
+            except Exception as e:
+                # ここで print しておけば、アプリを止めずにコンソールで原因を確認できます
+                print(f"Loop Error: {e}")
+                count("srlog_events_total", log="queue", outcome="error")
+                continue
+
+    # 時間順の並びは EventLog 側で保証される（順不同で届いた分は追加時に該当位置へ挿入される）
+
+    # --- 自動保存（全4ログ共通）: 時間・件数・サイズのいずれかに達したら、変化のあったログをまとめて保存する ---
+    logs = {kind: st.session_state[f"{kind}_log"] for kind in SAVE_KINDS}
+    kinds, reason = st.session_state.save_scheduler.due(logs)
+    if kinds:
+        with stage("autosave"):
+            count("srlog_autosave_total", reason=reason)
+            save_logs(kinds)
+
+
 # --- UI構築 ---
 
 #st.markdown("<h1 style='font-size:2.5em;'>🎤 SHOWROOM 配信ログ収集ツール</h1>", unsafe_allow_html=True)
@@ -491,6 +690,8 @@ st.write("")
 
 # ▼▼ 認証ステップ ▼▼
 if not st.session_state.authenticated:
+    # 認証ボタンが押されるまでにルームリストを読み込んでおく
+    get_auth_registry(ROOM_LIST_URL).warm()
     st.markdown("##### 🔑 認証コードを入力してください")
     input_room_id = st.text_input(
         "認証コードを入力してください:",
@@ -503,11 +704,8 @@ if not st.session_state.authenticated:
     if st.button("認証する"):
         if input_room_id:  # 入力が空でない場合のみ
             try:
-                response = requests.get(ROOM_LIST_URL, timeout=5)
-                response.raise_for_status()
-                room_df = pd.read_csv(io.StringIO(response.text), header=None)
-
-                valid_codes = set(str(x).strip() for x in room_df.iloc[:, 0].dropna())
+                # 認証コードはプロセス共通のキャッシュから参照する（毎回ダウンロードしない）
+                valid_codes = get_auth_registry(ROOM_LIST_URL).get().codes
 
                 # ✅ 特別認証コード「mksp154851」なら全ルーム利用可
                 if input_room_id.strip() == "mksp154851":
@@ -533,172 +731,315 @@ if not st.session_state.authenticated:
     st.stop()
 # ▲▲ 認証ステップここまで ▲▲
 
+# --- 認証後にだけ使うモジュール（認証画面では読み込まない） ---
+import pandas as pd
+from log_archive import archive_stream, top_gifters, first_seen, comment_counts_per_stream, stream_comments
+import export_jobs
+import plotly.graph_objects as go
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def archived_comment_index(stream_id):
+    """アーカイブ済み配信のコメント検索用索引（配信ごとに1回だけ作り、全セッションで共有）"""
+    index = CommentSearchIndex()
+    index.add_many(stream_comments(stream_id))
+    return index
+
+def ranking_names(*packed_logs):
+    """ランキング表の表示名（ユーザー索引の最新の名前）。ワーカーへ渡すため、ログに出てくるユーザーの分だけにする"""
+    names = st.session_state.user_index.names()
+    return {user_id: names.get(user_id, '') for packed in packed_logs for user_id in packed['user_id']}
+
+def gift_tab_args(kind, log):
+    packed = export_jobs.pack(kind, log)
+    return kind, packed, ranking_names(packed)
+
+def combined_tab_args(gift_log, free_gift_log):
+    gift_packed = export_jobs.pack("gift", gift_log)
+    free_packed = export_jobs.pack("free_gift", free_gift_log)
+    return gift_packed, free_packed, ranking_names(gift_packed, free_packed)
+
+# ダッシュボード用のCSSとセッション状態も認証後にだけ用意する
+st.markdown(CSS_STYLE, unsafe_allow_html=True)
 
-input_room_id = st.text_input("対象のルームIDを入力してください:", placeholder="例: 154851", key="target_room_id_input")
+# セッション状態の初期化
+if "room_id" not in st.session_state:
+    st.session_state.room_id = ""
+if "is_tracking" not in st.session_state:
+    st.session_state.is_tracking = False
+for log_name in SESSION_LOG_NAMES:
+    if log_name not in st.session_state:
+        st.session_state[log_name] = new_session_log(log_name)
+if "fan_list" not in st.session_state:
+    st.session_state.fan_list = []
+if "gift_list_map" not in st.session_state:
+    st.session_state.gift_list_map = {}
+if 'onlives_data' not in st.session_state:
+    st.session_state.onlives_data = {}
+if 'total_fan_count' not in st.session_state:
+    st.session_state.total_fan_count = 0
+if "fan_list_version" not in st.session_state:
+    st.session_state.fan_list_version = 0
+
+# --- 無償ギフト用に追加 ---
+if "raw_free_gift_queue" not in st.session_state:
+    st.session_state.raw_free_gift_queue = []
+if "free_gift_master" not in st.session_state:
+    st.session_state.free_gift_master = {} # {gift_id: {name, point, image}}
+if "ws_receiver" not in st.session_state:
+    st.session_state.ws_receiver = None
+if "free_gift_coalescer" not in st.session_state:
+    st.session_state.free_gift_coalescer = FreeGiftCoalescer(FREE_GIFT_COALESCE_WINDOW_SEC)
+if "time_series" not in st.session_state:
+    st.session_state.time_series = MinuteSeries()
+if "user_index" not in st.session_state:
+    st.session_state.user_index = new_user_index()
+if "comment_search" not in st.session_state:
+    st.session_state.comment_search = new_comment_search()
+if "feed_cursors" not in st.session_state:
+    st.session_state.feed_cursors = {} # {log_type: ルームの共有フィードをどこまで取り込んだか}
+if "unresolved_gifts" not in st.session_state:
+    st.session_state.unresolved_gifts = [] # 取り込み時にギフトリストになく、ギフト名・ポイントが未確定の有償ギフト
+if "export_cache" not in st.session_state:
+    st.session_state.export_cache = {} # {表の名前: (ログの version, ワーカーで作った結果)}
+if "save_scheduler" not in st.session_state:
+    st.session_state.save_scheduler = SaveScheduler()
+if "stream_lifecycles" not in st.session_state:
+    st.session_state.stream_lifecycles = {} # {room_id: StreamLifecycle}
+
+# --- 複数ルーム同時トラッキング用 ---
+if "rooms" not in st.session_state:
+    st.session_state.rooms = {} # {room_id: ルームごとの状態 (room_state.new_room_state)}
+if "tracked_room_ids" not in st.session_state:
+    st.session_state.tracked_room_ids = []
+if "stop_pending_room_ids" not in st.session_state:
+    st.session_state.stop_pending_room_ids = [] # 停止を押したが最終保存に失敗し、トラッキングを続けて再試行しているルーム
+# -----------------------
+
+
+input_room_id = st.text_input("対象のルームIDを入力してください（カンマ区切りで複数ルームを同時にトラッキングできます）:", placeholder="例: 154851 または 154851, 123456", key="target_room_id_input")
 
 # --- ボタンを縦並びに配置 ---
 if st.button("トラッキング開始", key="start_button"):
-    if input_room_id and input_room_id.isdigit():
-        room_list_df = get_room_list()
-        valid_ids = set(str(x) for x in room_list_df.iloc[:,0].dropna().astype(int))
+    input_room_ids = parse_room_ids(input_room_id)
+    if input_room_ids:
+        valid_ids = get_room_list()
 
         # ✅ 特別認証モード（mksp154851）の場合はバイパス許可
         is_master = st.session_state.get("is_master_access", False)
-        if not is_master and input_room_id not in valid_ids:
-            # エラー時は状態を更新せず、メッセージだけ出す（下の停止ボタンは非活性のまま残る）
-            st.error("指定されたルームIDが見つからないか、認証されていないルームIDか、現在配信中ではありません。")
-        else:
+        started_rooms = {}
+        for target_id in input_room_ids:
+            if not is_master and target_id not in valid_ids:
+                # エラー時は状態を更新せず、メッセージだけ出す（下の停止ボタンは非活性のまま残る）
+                st.error(f"ルームID {target_id}: 指定されたルームIDが見つからないか、認証されていないルームIDか、現在配信中ではありません。")
+                continue
+
             # 配信サーバー情報を取得
-            streaming_info = get_streaming_server_info(input_room_id)
-            
+            with stage("api.live_info"):
+                streaming_info = get_streaming_server_info(target_id)
             if not streaming_info:
                 # サーバー情報が取れない（配信中でない）場合もエラー表示のみ
-                st.error("指定されたルームIDが見つからないか、認証されていないルームIDか、現在配信中ではありません。")
-            else:
-                # --- 正常系：ここから下は配信中であることが確定した場合のみ実行 ---
-                st.session_state.is_tracking = True
-                st.session_state.room_id = input_room_id
-                
-                # --- 既存ログの初期化 ---
-                st.session_state.comment_log = []
-                st.session_state.gift_log = []
-                st.session_state.gift_list_map = {}
-                st.session_state.fan_list = []
-                st.session_state.total_fan_count = 0
-                st.session_state.free_gift_log = []
-                st.session_state.raw_free_gift_queue = []
-                st.session_state.system_msg_log = []
-                
-                # 1. 無償ギフトマスターの取得
-                update_free_gift_master(input_room_id)
-                
-                # 2. 受信機の起動
-                if st.session_state.get("ws_receiver"):
+                st.error(f"ルームID {target_id}: 指定されたルームIDが見つからないか、認証されていないルームIDか、現在配信中ではありません。")
+                continue
+            started_rooms[target_id] = streaming_info
+
+        if started_rooms:
+            # --- 正常系：ここから下は配信中であることが確定したルームのみ実行 ---
+            # 既存の受信機を全て停止
+            for old_state in st.session_state.rooms.values():
+                if old_state.get("ws_receiver"):
                     try:
-                        st.session_state.ws_receiver.stop()
+                        old_state["ws_receiver"].stop()
                     except:
                         pass
-                
+
+            # --- 既存ログの初期化（ルームごとに新しい状態を作成） ---
+            room_count = len(started_rooms)
+            st.session_state.rooms = {}
+            st.session_state.stop_pending_room_ids = []
+            for target_id, streaming_info in started_rooms.items():
+                st.session_state.rooms[target_id] = new_room_state(
+                    target_id,
+                    lambda name: new_session_log(name, room_count),
+                    FreeGiftCoalescer(FREE_GIFT_COALESCE_WINDOW_SEC),
+                    MinuteSeries(),
+                    new_user_index(room_count),
+                    new_comment_search(room_count),
+                    SaveScheduler(),
+                )
+                reset_stream_lifecycle(st.session_state.stream_lifecycles, target_id)
+                bind_room(st.session_state, st.session_state.rooms, target_id)
+
+                # 1. 無償ギフトマスターの取得
+                update_free_gift_master(target_id)
+
+                # 2. 受信機の起動
                 receiver = FreeGiftReceiver(
-                    room_id=input_room_id,
+                    room_id=target_id,
                     host=streaming_info["host"],
                     key=streaming_info["key"]
                 )
                 receiver.start()
                 st.session_state.ws_receiver = receiver
+                store_room(st.session_state, st.session_state.rooms, target_id)
+
+            st.session_state.tracked_room_ids = list(started_rooms)
+            st.session_state.view_room_id = st.session_state.tracked_room_ids[0]
+            st.session_state.raw_free_gift_queue = []
+            st.session_state.is_tracking = True
+            bind_room(st.session_state, st.session_state.rooms, st.session_state.view_room_id)
 
-                # 成功時のみ画面を更新して「ログ詳細」を表示
-                st.rerun()
+            # 成功時のみ画面を更新して「ログ詳細」を表示
+            st.rerun()
     else:
         st.error("ルームIDを入力してください。")
 
 if st.button("トラッキング停止", key="stop_button", disabled=not st.session_state.is_tracking):
-    if st.session_state.is_tracking:
-        save_log_to_ftp("comment")
-        save_log_to_ftp("gift")
-        save_log_to_ftp("free_gift")
-        save_log_to_ftp("system_msg")
-
-    st.session_state.is_tracking = False
-    st.session_state.room_info = None
-    st.success("トラッキングを停止しました。このままログの確認・ダウンロードが可能です。")
+    # 停止時の保存も最終保存（FTP＋アーカイブ）として扱い、その後の配信終了検知で再保存しない。
+    # 最終保存に失敗したルームはトラッキングを続け、自動更新のたびに再試行する（成功したら停止する）
+    stop_pending = []
+    for tracked_id in st.session_state.tracked_room_ids:
+        bind_room(st.session_state, st.session_state.rooms, tracked_id)
+        if not finalize_stream(tracked_id):
+            stop_pending.append(tracked_id)
+        store_room(st.session_state, st.session_state.rooms, tracked_id)
+    st.session_state.stop_pending_room_ids = stop_pending
+
+    if stop_pending:
+        st.warning(f"ルームID {', '.join(stop_pending)} は最終保存が完了していないため、トラッキングを続けて再試行します。")
+    else:
+        st.session_state.is_tracking = False
+        st.session_state.room_info = None
+        st.success("トラッキングを停止しました。このままログの確認・ダウンロードが可能です。")
     # st.rerun()  # ← ここをコメントアウトして即時リセットを防ぐ
 
 
-if st.session_state.is_tracking or st.session_state.get("room_id"):
-    onlives_data = get_onlives_rooms()
-    target_room_info = onlives_data.get(int(st.session_state.room_id)) if st.session_state.room_id.isdigit() else None
+# --- 自動更新（ダッシュボード部分だけのフラグメント再実行）と変更検知 ---
+# 自動更新ではログの取得とダッシュボードだけを再実行し、タブ・表・ダウンロードは作り直さない。
+# 取り込みで version が変わったセクション（コメント・有償ギフト・無償ギフト・システムMSG・ファンリスト）があれば、
+# タブも更新するため全体を再実行する（変化のない更新はフラグメントだけで終わる）
+LIVE_REFRESH_SEC = 10
 
-    # --- 配信終了検知と自動保存処理 ---
-    # インデントを一段（半角スペース4つ）に統一しています
-    is_live_now = int(st.session_state.room_id) in onlives_data
 
-    if not is_live_now:
-        # st.warning("📡 配信が終了しました。全ログを最終保存します。")
-        st.info("📡 配信の終了を確認しました。未保存のログを含め、最終データを保存します。")
+@st.cache_data(ttl=600, show_spinner=False)
+def get_room_profile(room_id):
+    """ルームのプロフィール（ルーム名・URLキー）。取得できなければ空の辞書"""
+    try:
+        with stage("api.room_profile"):
+            return requests.get(f"{ROOM_PROFILE_API_URL}?room_id={room_id}", headers=HEADERS, timeout=5).json()
+    except Exception:
+        return {}
+
+def section_versions(room_ids):
+    """ルームごとの (コメント, 有償ギフト, 無償ギフト, システムMSG, ファンリスト) の version"""
+    rooms = st.session_state.rooms
+    return tuple(
+        (room_id, rooms[room_id]["comment_log"].version, rooms[room_id]["gift_log"].version,
+         rooms[room_id]["free_gift_log"].version, rooms[room_id]["system_msg_log"].version, rooms[room_id]["fan_list_version"])
+        for room_id in room_ids
+    )
 
-        # 1. コメントログ保存
-        if st.session_state.comment_log:
-            comment_df = pd.DataFrame([
-                {
-                    "コメント時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                    "ユーザー名": log.get("name", ""),
-                    "コメント内容": log.get("comment", ""),
-                    "ユーザーID": log.get("user_id", "")
-                }
-                for log in st.session_state.comment_log
-                if not any(keyword in log.get("name", "") or keyword in log.get("comment", "") for keyword in SYSTEM_COMMENT_KEYWORDS)
-            ])
-            buf = io.BytesIO()
-            comment_df.to_csv(buf, index=False, encoding="utf-8-sig")
-            upload_csv_to_ftp(f"comment_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-
-        # 2. 有償ギフトログ保存
-        if st.session_state.gift_log:
-            gift_df = pd.DataFrame([
-                {
-                    "ギフト時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                    "ユーザー名": log.get("name", ""),
-                    "ギフト名": st.session_state.gift_list_map.get(str(log.get("gift_id")), {}).get("name", ""),
-                    "個数": log.get("num", ""),
-                    "ポイント": st.session_state.gift_list_map.get(str(log.get("gift_id")), {}).get("point", 0),
-                    "ユーザーID": log.get("user_id", "")
-                }
-                for log in st.session_state.gift_log
-            ])
-            buf = io.BytesIO()
-            gift_df.to_csv(buf, index=False, encoding="utf-8-sig")
-            upload_csv_to_ftp(f"gift_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-
-        # 3. 無償ギフトログ保存（追加分）
-        if st.session_state.free_gift_log:
-            free_gift_df = pd.DataFrame([
-                {
-                    "ギフト時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                    "ユーザー名": log.get("name", ""),
-                    "ギフト名": log.get("gift_name", ""),
-                    "個数": log.get("num", ""),
-                    "ポイント": log.get("point", 0),
-                    "ユーザーID": log.get("user_id", "")
-                }
-                for log in st.session_state.free_gift_log
-            ])
-            buf = io.BytesIO()
-            free_gift_df.to_csv(buf, index=False, encoding="utf-8-sig")
-            upload_csv_to_ftp(f"free_gift_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-
-        # 4. システムメッセージログ保存（追加）
-        if st.session_state.system_msg_log:
-            system_msg_df = pd.DataFrame([
-                {
-                    "時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                    "メッセージ": log.get("message", ""),
-                    "ユーザーID": log.get("user_id", "")
-                }
-                for log in st.session_state.system_msg_log
-            ])
-            buf = io.BytesIO()
-            system_msg_df.to_csv(buf, index=False, encoding="utf-8-sig")
-            upload_csv_to_ftp(f"system_msg_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-
-        # 配信が終了しても、表示用のフラグを「停止」にせず、警告を出すだけにする
-        # st.session_state.is_tracking = False  # 消去またはコメントアウト
-        # st.warning("📡 配信が終了しました。ログを最終保存しました。このまま振り返りが可能です。")
-        # st.success("✅ 最終保存が完了しました。このままデータの確認や手動ダウンロードが可能です。")
-        st.success("✅ 最終保存が完了しました。自動更新を停止し、現在のログを保持しています。このままデータの確認やダウンロードが可能です。")
-        # st.rerun()  # 消去またはコメントアウト
+def feed_html(kind, log, select=None):
+    """ダッシュボードの1カラム分の HTML。ログの version が前回と同じなら、行の選択も連結もせずに前回の結果を使う"""
+    cache = st.session_state.export_cache
+    hit = cache.get(f"dashboard_{kind}")
+    if hit is None or hit[0] != log.version:
+        hit = (log.version, render_feed(kind, select(log) if select else log))
+        cache[f"dashboard_{kind}"] = hit
+    return hit[1]
+
+def live_dashboard(tracked_room_ids, view_room_id, onlives_data):
+    """ログの取得・配信終了検知・自動保存とリアルタイムダッシュボード（自動更新ではここだけを再実行する）"""
+    # 全体の再実行では直前に "full" が設定される。ここで "fragment" に戻すため、この後の自動更新は
+    # 全体の再実行が途中で止まって（例外・st.stop()）も、フラグメントだけの再実行として扱われる
+    fragment_pass = st.session_state.get("render_pass") == "fragment"
+    st.session_state.render_pass = "fragment"
+    if not fragment_pass:
+        render_live_dashboard(tracked_room_ids, view_room_id, onlives_data, fragment_pass)
+        return
+    begin_run("fragment")
+    try:
+        # 配信の開始・終了で自動更新の有無が変わるときは全体を再実行する（最終保存もそちらで行う）
+        onlives_data = get_onlives_rooms()
+        if [rid for rid in tracked_room_ids if int(rid) in onlives_data] != st.session_state.live_room_ids:
+            st.rerun()
+        render_live_dashboard(tracked_room_ids, view_room_id, onlives_data, fragment_pass)
+    finally:
+        end_run()
+
+def render_live_dashboard(tracked_room_ids, view_room_id, onlives_data, fragment_pass):
+    live_room_ids = st.session_state.live_room_ids
+
+    # --- 全ルームのログ更新・配信終了検知と自動保存処理 ---
+    stop_pending = st.session_state.stop_pending_room_ids
+    for tracked_id in tracked_room_ids:
+        if stop_pending and tracked_id not in stop_pending:
+            continue  # 停止を押して最終保存が済んだルーム
+        bind_room(st.session_state, st.session_state.rooms, tracked_id)
+        if tracked_id in stop_pending:
+            # 停止時の最終保存の再試行。成功したらこのルームの取り込みをやめる
+            if finalize_stream(tracked_id):
+                stop_pending.remove(tracked_id)
+                store_room(st.session_state, st.session_state.rooms, tracked_id)
+                if not stop_pending:
+                    st.session_state.is_tracking = False
+                    st.session_state.room_info = None
+                    st.rerun()
+                continue
+        is_room_live = tracked_id in live_room_ids
+        if is_room_live:
+            # 配信の再開で受信先のキーが変わっていれば、受信機の購読を切り替える
+            watch_broadcast_session(onlives_data.get(int(tracked_id)))
+
+        if not is_room_live:
+            # 💡 最終保存はライフサイクル (tracking → ended → finalized) で一度だけ実行する
+            lifecycle = get_stream_lifecycle(st.session_state.stream_lifecycles, tracked_id)
+            lifecycle.mark_ended()
+
+            if not lifecycle.is_finalized:
+                # st.warning("📡 配信が終了しました。全ログを最終保存します。")
+                st.info(f"📡 ルームID {tracked_id} の配信の終了を確認しました。未保存のログを含め、最終データを保存します。")
+
+                # 配信が終了しても、表示用のフラグを「停止」にせず、警告を出すだけにする
+                # st.session_state.is_tracking = False  # 消去またはコメントアウト
+                if finalize_stream(tracked_id):
+                    st.success("✅ 最終保存が完了しました。自動更新を停止し、現在のログを保持しています。このままデータの確認やダウンロードが可能です。")
+
+        refresh_room_logs(is_room_live, is_viewed=(tracked_id == view_room_id))
+        store_room(st.session_state, st.session_state.rooms, tracked_id)
+
+    # 取り込みで変化したセクションがあれば、タブも作り直すため全体を再実行する
+    versions = section_versions(tracked_room_ids)
+    if fragment_pass and versions != st.session_state.get("rendered_versions"):
+        st.rerun()
+    st.session_state.rendered_versions = versions
+
+    # --- 複数ルームの統合サマリー ---
+    if len(tracked_room_ids) > 1:
+        summary_rows = []
+        for tracked_id in tracked_room_ids:
+            room_state = st.session_state.rooms[tracked_id]
+            summary_rows.append({
+                'ルームID': tracked_id,
+                '配信状態': '配信中' if tracked_id in live_room_ids else '終了',
+                'コメント': len(room_state['comment_log']),
+                'スペシャルギフト': len(room_state['gift_log']),
+                '無償ギフト': len(room_state['free_gift_log']),
+                'システムMSG': len(room_state['system_msg_log']),
+                'ファン': room_state['total_fan_count'],
+            })
+        st.dataframe(pd.DataFrame(summary_rows), use_container_width=True, hide_index=True)
 
+    # 以降の表示は選択中のルームを対象にする
+    bind_room(st.session_state, st.session_state.rooms, view_room_id)
+    is_live_now = view_room_id in live_room_ids
+    target_room_info = onlives_data.get(int(view_room_id))
 
     if target_room_info or st.session_state.get("room_id"):
         room_id = st.session_state.room_id
 
-        # ルーム名取得
-        try:
-            prof = requests.get(f"https://www.showroom-live.com/api/room/profile?room_id={room_id}", headers=HEADERS, timeout=5).json()
-            room_name = prof.get("room_name", f"ルームID {room_id}")
-        except Exception:
-            room_name = f"ルームID {room_id}"
-        # URLキー取得
+        # ルーム名・URLキー取得（自動更新のたびには取りに行かない）
+        prof = get_room_profile(room_id)
+        room_name = prof.get("room_name", f"ルームID {room_id}")
         room_url_key = prof.get("room_url_key", "")
         room_url = f"https://www.showroom-live.com/r/{room_url_key}" if room_url_key else f"https://www.showroom-live.com/room/profile?room_id={room_id}"
         link_html = f'<a href="{room_url}" target="_blank" style="font-weight:bold; text-decoration:underline; color:inherit;">{room_name}</a>'        
@@ -710,170 +1051,6 @@ if st.session_state.is_tracking or st.session_state.get("room_id"):
             # 💡 ここを直接書き込みから「クラス指定」に変更します
             st.markdown(f'<div class="tracking-info">🏁 {link_html} の配信は終了しました。</div>', unsafe_allow_html=True)
 
-        # 配信中の時だけ自動更新し、新しいログを取得しにいく
-        if is_live_now:
-            st_autorefresh(interval=10000, limit=None, key="dashboard_refresh")
-            st.session_state.comment_log = get_and_update_log("comment", st.session_state.room_id)
-            st.session_state.gift_log = get_and_update_log("gift", st.session_state.room_id)
-        else:
-            # 💡 ここにあった st.info を削除（またはコメントアウト）します
-            # st.info("配信が終了したため、自動更新を停止しました。現在のログを保持しています。")
-            pass
-
-        import math
-
-        # コメントログ自動保存
-        prev_comment_count = st.session_state.get("prev_comment_count", 0)
-        current_comment_count = len(st.session_state.comment_log)
-
-        # 💡 修正後の保存しきい値: prev_comment_countを次の100の倍数に丸めた値
-        # 例: prev_countが105の場合、次の保存しきい値は200
-        # 例: prev_countが100の場合、次の保存しきい値は200
-        next_save_threshold = math.ceil((prev_comment_count + 1) / 100) * 100
-
-        # 🌟 条件判定: 現在の総数が次の100の倍数のしきい値以上になったら保存
-        if current_comment_count >= next_save_threshold:
-            if current_comment_count > 0:
-                comment_df = pd.DataFrame([
-                    # ... DataFrame生成の処理は省略 ...
-                    # 既存のコードのまま、全ログをDataFrameに変換
-                    {
-                        "コメント時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                        "ユーザー名": log.get("name", ""),
-                        "コメント内容": log.get("comment", ""),
-                        "ユーザーID": log.get("user_id", "")
-                    }
-                    for log in st.session_state.comment_log
-                    if not any(keyword in log.get("name", "") or keyword in log.get("comment", "") for keyword in SYSTEM_COMMENT_KEYWORDS)
-                ])
-                
-                buf = io.BytesIO()
-                comment_df.to_csv(buf, index=False, encoding="utf-8-sig")
-                upload_csv_to_ftp(f"comment_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-                
-                # 🌟 変更点: 次に保存すべき件数 (100の倍数) に更新する
-                # ここで `current_comment_count` ではなく `next_save_threshold` を使用
-                st.session_state.prev_comment_count = next_save_threshold
-
-        import math # mathモジュールをインポートしてください
-
-        # ギフトログ自動保存
-        prev_gift_count = st.session_state.get("prev_gift_count", 0)
-        current_gift_count = len(st.session_state.gift_log)
-
-        # 🌟 修正点1: 次に保存を実行すべき100の倍数を計算
-        # 例: prev_gift_countが105の場合、next_save_thresholdは200になる
-        next_save_threshold = math.ceil((prev_gift_count + 1) / 100) * 100
-
-        # 🌟 修正点2: 条件判定を次の100の倍数に達したかどうかに変更
-        if current_gift_count >= next_save_threshold:
-            if current_gift_count > 0:
-                gift_df = pd.DataFrame([
-                    {
-                        "ギフト時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                        "ユーザー名": log.get("name", ""),
-                        "ギフト名": st.session_state.gift_list_map.get(str(log.get("gift_id")), {}).get("name", ""),
-                        "個数": log.get("num", ""),
-                        "ポイント": st.session_state.gift_list_map.get(str(log.get("gift_id")), {}).get("point", 0),
-                        "ユーザーID": log.get("user_id", "")
-                    }
-                    for log in st.session_state.gift_log
-                ])
-                
-                buf = io.BytesIO()
-                gift_df.to_csv(buf, index=False, encoding="utf-8-sig")
-                upload_csv_to_ftp(f"gift_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-                
-                # 🌟 修正点3: prev_gift_countを、実際に保存したときの総数ではなく、
-                # 次の保存しきい値（100の倍数）に強制的に更新する
-                st.session_state.prev_gift_count = next_save_threshold
-
-        #auto_backup_if_needed()
-        st.session_state.gift_list_map = get_gift_list(st.session_state.room_id)
-        fan_list, total_fan_count = get_fan_list(st.session_state.room_id)
-        st.session_state.fan_list = fan_list
-        st.session_state.total_fan_count = total_fan_count
-
-        # --- 無償ギフト・システムMSG：キューからデータを取り出してログに変換 ---
-        while not gift_queue.empty():
-            try:
-                raw_data = gift_queue.get_nowait()
-                
-                # t の判定（文字列に変換して比較するのが最も安全です）
-                m_type = str(raw_data.get("t", ""))
-
-                # --- ✅ A. システムメッセージ (t: 18) の処理 ---
-                if m_type == "18":
-                    # time.time() は使わず、datetime で安全にタイムスタンプを取得
-                    ts = raw_data.get("created_at") or int(datetime.datetime.now().timestamp())
-                    new_sys_entry = {
-                        "created_at": ts,
-                        "message": raw_data.get("m", ""),
-                        "user_id": raw_data.get("u")
-                    }
-                    st.session_state.system_msg_log.insert(0, new_sys_entry)
-                    # st.session_state.system_msg_log = st.session_state.system_msg_log[:200]
-
-                # --- 🎁 B. 無償ギフト (t: 2) の処理 ---
-                elif m_type == "2":
-                    g_id = raw_data.get("g")
-                    if g_id is None:
-                        continue
-                    
-                    # ギフトマスターとの照合
-                    master = st.session_state.get("free_gift_master", {})
-                    # IDが数値でも文字列でも見つけられるように検索
-                    gift_info = master.get(str(g_id)) or master.get(g_id)
-                    
-                    if not gift_info:
-                        # マスターにない（有償ギフトなど）場合はスキップ
-                        continue
-                    
-                    ts = raw_data.get("created_at") or int(datetime.datetime.now().timestamp())
-                    new_entry = {
-                        "created_at": ts,
-                        "user_id": raw_data.get("u"),
-                        "name": raw_data.get("ac"),
-                        "avatar_id": raw_data.get("av"),
-                        "gift_id": str(g_id),
-                        "gift_name": gift_info.get("name"),
-                        "point": gift_info.get("point", 1),
-                        "num": raw_data.get("n", 1),
-                        "image": gift_info.get("image", "")
-                    }
-                    st.session_state.free_gift_log.insert(0, new_entry)
-                    # st.session_state.free_gift_log = st.session_state.free_gift_log[:200]
-
-            except Exception as e:
-                # ここで print しておけば、アプリを止めずにコンソールで原因を確認できます
-                print(f"Loop Error: {e}")
-                continue
-
-        # 最後に時間順にソート（念のため）
-        st.session_state.free_gift_log.sort(key=lambda x: x["created_at"], reverse=True)
-
-        # --- 無償ギフトログ自動保存 (100件ごと) ---
-        prev_free_gift_count = st.session_state.get("prev_free_gift_count", 0)
-        current_free_gift_count = len(st.session_state.free_gift_log)
-        next_free_save_threshold = math.ceil((prev_free_gift_count + 1) / 100) * 100
-
-        if current_free_gift_count >= next_free_save_threshold:
-            if current_free_gift_count > 0:
-                free_gift_df = pd.DataFrame([
-                    {
-                        "ギフト時間": datetime.datetime.fromtimestamp(log.get("created_at", 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
-                        "ユーザー名": log.get("name", ""),
-                        "ギフト名": log.get("gift_name", ""),
-                        "個数": log.get("num", ""),
-                        "ポイント": log.get("point", 0),
-                        "ユーザーID": log.get("user_id", "")
-                    }
-                    for log in st.session_state.free_gift_log
-                ])
-                buf = io.BytesIO()
-                free_gift_df.to_csv(buf, index=False, encoding="utf-8-sig")
-                upload_csv_to_ftp(f"free_gift_log_{st.session_state.room_id}_{datetime.datetime.now(JST).strftime('%Y%m%d_%H%M%S')}.csv", buf)
-                st.session_state.prev_free_gift_count = next_free_save_threshold
 
         st.markdown("---")
         st.markdown("<h2 style='font-size:2em;'>📊 リアルタイムダッシュボード</h2>", unsafe_allow_html=True)
@@ -883,195 +1060,43 @@ if st.session_state.is_tracking or st.session_state.get("room_id"):
         # カラムを4つに分割
         col_comment, col_gift, col_free_gift, col_fan = st.columns(4)
 
-        with col_comment:
+        # 各行の HTML はイベント単位でキャッシュした断片を使い、カラムごとに連結して1回だけ描画する
+        with col_comment, stage("dashboard.comment"):
             st.markdown("###### 📝 コメント")
             with st.container(border=True, height=500):
-                filtered_comments = [
-                    log for log in st.session_state.comment_log 
-                    if not any(keyword in log.get('name', '') or keyword in log.get('comment', '') for keyword in SYSTEM_COMMENT_KEYWORDS)
-                ]
-                if filtered_comments:
-                    # 💡 表示制限コントロール (制限したい場合は [:100] を有効にする)
-                    display_comments = filtered_comments # [:100]
-                    for log in display_comments:
-                        user_name = log.get('name', '匿名ユーザー')
-                        comment_text = log.get('comment', '')
-                        created_at = datetime.datetime.fromtimestamp(log.get('created_at', 0), JST).strftime("%H:%M:%S")
-                        avatar_url = log.get('avatar_url', '')
-                        html = f"""
-                        <div class="comment-item">
-                            <div class="comment-item-row">
-                                <img src="{avatar_url}" class="comment-avatar" />
-                                <div class="comment-content">
-                                    <div class="comment-time">{created_at}</div>
-                                    <div class="comment-user">{user_name}</div>
-                                    <div class="comment-text">{comment_text}</div>
-                                </div>
-                            </div>
-                        </div>
-                        <hr style="border: none; border-top: 1px solid #eee; margin: 8px 0;">
-                        """
-                        st.markdown(html, unsafe_allow_html=True)
+                comments_html = feed_html("comment", st.session_state.comment_log, lambda log: [
+                    entry for entry in log
+                    if not any(keyword in entry.get('name', '') or keyword in entry.get('comment', '') for keyword in SYSTEM_COMMENT_KEYWORDS)
+                ])  # 💡 表示制限コントロール (制限したい場合は [:100] を有効にする)
+                if comments_html:
+                    st.markdown(comments_html, unsafe_allow_html=True)
                 else:
                     st.info("コメントはまだありません。")
 
-        with col_gift:
+        with col_gift, stage("dashboard.gift"):
             st.markdown("###### 🎁 スペシャルギフト")
             with st.container(border=True, height=500):
                 if st.session_state.gift_log:
-                    # 最新のキャッシュを取得
-                    current_map = st.session_state.gift_list_map
-                    display_gifts = st.session_state.gift_log
-                    
-                    for log in display_gifts:
-                        gid = str(log.get('gift_id'))
-                        
-                        # --- 💡 未知のギフトID対策ロジック ---
-                        if gid not in current_map:
-                            # リストにないIDが来たら、その場でAPIを叩き直す
-                            current_map = get_gift_list(st.session_state.room_id, force_update=True)
-                        # ----------------------------------
-
-                        gift_info = current_map.get(gid, {})
-                        if not gift_info:
-                            # それでも取得できない場合のフォールバック
-                            gift_name = "未知のギフト"
-                            gift_point = 0
-                            gift_image_url = log.get('image', '')
-                        else:
-                            gift_name = gift_info.get('name', 'N/A')
-                            gift_point = gift_info.get('point', 0)
-                            gift_image_url = log.get('image', gift_info.get('image', ''))
-
-                        user_name = log.get('name', '匿名ユーザー')
-                        created_at = datetime.datetime.fromtimestamp(log.get('created_at', 0), JST).strftime("%H:%M:%S")
-                        gift_count = log.get('num', 0)
-                        total_point = gift_point * gift_count
-                        
-                        # 背景色の判定
-                        highlight_class = ""
-                        if total_point >= 300000: highlight_class = "highlight-300000"
-                        elif total_point >= 100000: highlight_class = "highlight-100000"
-                        elif total_point >= 60000: highlight_class = "highlight-60000"
-                        elif total_point >= 30000: highlight_class = "highlight-30000"
-                        elif total_point >= 10000: highlight_class = "highlight-10000"
-                        
-                        avatar_id = log.get('avatar_id', None)
-                        avatar_url = f"https://static.showroom-live.com/image/avatar/{avatar_id}.png" if avatar_id else DEFAULT_AVATAR
-                        
-                        html = f"""
-                        <div class="gift-item {highlight_class}">
-                            <div class="gift-item-row">
-                                <img src="{avatar_url}" class="gift-avatar" />
-                                <div class="gift-content">
-                                    <div class="gift-time">{created_at}</div>
-                                    <div class="gift-user">{user_name}</div>
-                                    <div class="gift-info-row">
-                                        <img src="{gift_image_url}" class="gift-image" title="{gift_name}" />
-                                        <span>×{gift_count}</span>
-                                    </div>
-                                    <div style="font-size: 0.9em; color: #555;">{total_point} pt</div>
-                                </div>
-                            </div>
-                        </div>
-                        <hr style="border: none; border-top: 1px solid #eee; margin: 8px 0;">
-                        """
-                        st.markdown(html, unsafe_allow_html=True)
+                    # ギフト名・単価は取り込み時に付けたもの（未知のギフトIDは取り込み時にリストを取り直している）
+                    st.markdown(feed_html("gift", st.session_state.gift_log), unsafe_allow_html=True)
                 else:
                     st.info("スペシャルギフトはまだありません。")
 
-        with col_free_gift:
+        with col_free_gift, stage("dashboard.free_gift"):
             st.markdown("###### 🎈 無償ギフト")
             with st.container(border=True, height=500):
                 if st.session_state.free_gift_log:
                     # 💡 表示制限コントロール
-                    display_free_gifts = st.session_state.free_gift_log # [:100]
-                    for log in display_free_gifts:
-                        user_name = log.get('name', '匿名ユーザー')
-                        created_at = datetime.datetime.fromtimestamp(log.get('created_at', 0), JST).strftime("%H:%M:%S")
-                        gift_count = log.get('num', 0)
-                        gift_point = log.get('point', 1) # 1pt
-                        gift_image_url = log.get('image', '')
-                        avatar_id = log.get('avatar_id', None)
-                        avatar_url = f"https://static.showroom-live.com/image/avatar/{avatar_id}.png" if avatar_id else DEFAULT_AVATAR
-                        
-                        # デザインをスペシャルギフト(col_gift)と統一
-                        html = f"""
-                        <div class="gift-item">
-                            <div class="gift-item-row">
-                                <img src="{avatar_url}" class="gift-avatar" />
-                                <div class="gift-content">
-                                    <div class="gift-time">{created_at}</div>
-                                    <div class="gift-user">{user_name}</div>
-                                    <div class="gift-info-row">
-                                        <img src="{gift_image_url}" class="gift-image" />
-                                        <span>×{gift_count}</span>
-                                    </div>
-                                    <div>{gift_point} pt</div>
-                                </div>
-                            </div>
-                        </div>
-                        <hr style="border: none; border-top: 1px solid #eee; margin: 8px 0;">
-                        """
-                        st.markdown(html, unsafe_allow_html=True)
+                    st.markdown(feed_html("free_gift", st.session_state.free_gift_log), unsafe_allow_html=True)
                 else:
                     st.info("無償ギフトはまだありません。")
 
-        with col_fan:
+        with col_fan, stage("dashboard.system_msg"):
             st.markdown("###### 🧡 システムMSG") 
             with st.container(border=True, height=500):
                 if st.session_state.get("system_msg_log"):
-                    for log in st.session_state.system_msg_log:
-                        created_at = datetime.datetime.fromtimestamp(log.get('created_at', 0), JST).strftime("%H:%M:%S")
-                        msg_text = log.get('message', '')
-                        
-                        # --- 💡 ハイライト判定ロジック（優先順位順） ---
-                        bg_color = "transparent"
-                        border_color = "transparent"
-
-                        # 1. 〇〇回目の訪問 (最優先・最も目立つ)
-                        if "回目の訪問" in msg_text:
-                            bg_color = "#ffebee"  # 薄い赤（お祝い感）
-                            # border_color = "#ffcdd2"
-                        
-                        # 2. 初訪問 (次に目立つ)
-                        elif "初訪問" in msg_text:
-                            bg_color = "#e3f2fd"  # 薄い青（フレッシュな印象）
-                            # border_color = "#bbdefb"
-
-                        # 3. 2度目の訪問
-                        elif "2度目の訪問" in msg_text:
-                            bg_color = "#f5f5f5"  # ごく薄いグレー
-                            # border_color = "#eeeeee"
-
-                        # 4. フォロー通知 (追加箇所)
-                        elif "フォローしました" in msg_text:
-                            bg_color = "#e8f5e9"  # 薄い緑（新規アクション感）
-                            # border_color = "#f8bbd0"
-
-                        # 5. ファンレベル上昇 (Lv10: 暖色 / Lv9: 同系統の薄い色)
-                        # elif "ファンレベルが10に" in msg_text:
-                        elif "ファンレベルが10に" in msg_text or "人になりました" in msg_text:
-                            bg_color = "#fff3cd"  # ゴールド（ファン化）
-                            # border_color = "#ffeeba"
-                        elif "ファンレベルが9に" in msg_text:
-                            bg_color = "#fff9e6"  # さらに薄いイエロー（リーチ）
-                            # border_color = "#fff3cd"
-                        
-                        # スタイルの組み立て
-                        # style = f"background-color: {bg_color}; border: 1px solid {border_color}; padding: 0px 8px 4px 8px; border-radius: 4px; margin-bottom: 2px;"
-                        style = f"background-color: {bg_color}; padding: 0px 8px 4px 8px; margin-bottom: 2px;"
-                        
-                        html = f"""
-                        <div class="comment-item" style="{style}">
-                            <div class="comment-time">{created_at}</div>
-                            <div style="color: #FF6C1A; font-weight: bold; font-size: 0.9em; line-height: 1.5; margin-top: 2px;">
-                                {msg_text}
-                            </div>
-                        </div>
-                        <hr style="border: none; border-top: 1px solid #eee; margin: 8px 0;">
-                        """
-                        st.markdown(html, unsafe_allow_html=True)
+                    # 背景色のハイライトは取り込み時の分類結果から決める
+                    st.markdown(feed_html("system_msg", st.session_state.system_msg_log), unsafe_allow_html=True)
                 else:
                     st.info("システムメッセージはありません。")
     else:
@@ -1079,6 +1104,28 @@ if st.session_state.is_tracking or st.session_state.get("room_id"):
         st.session_state.is_tracking = False
 
 
+if st.session_state.is_tracking or st.session_state.get("room_id"):
+    # --- 表示するルームの切り替え（複数ルーム時のみ） ---
+    tracked_room_ids = st.session_state.tracked_room_ids
+    if len(tracked_room_ids) > 1:
+        st.radio("表示するルーム", tracked_room_ids, horizontal=True, key="view_room_id")
+    view_room_id = st.session_state.get("view_room_id")
+    if view_room_id not in tracked_room_ids:
+        view_room_id = tracked_room_ids[0]
+
+    # 配信中リストは1回だけ取得し、全ルームで共有する
+    onlives_data = get_onlives_rooms()
+    st.session_state.live_room_ids = [rid for rid in tracked_room_ids if int(rid) in onlives_data]
+
+    # 配信中のルーム、または停止時の最終保存を再試行しているルームがあれば自動更新する
+    # （タイマーはセッションで1つ。更新はダッシュボード部分だけを再実行する）
+    st.session_state.render_pass = "full"
+    auto_refresh = st.session_state.live_room_ids or st.session_state.stop_pending_room_ids
+    st.fragment(live_dashboard, run_every=LIVE_REFRESH_SEC if auto_refresh else None)(
+        tracked_room_ids, view_room_id, onlives_data
+    )
+
+
 # if st.session_state.is_tracking and st.session_state.room_id:
 if st.session_state.get("room_id"):
 
@@ -1101,33 +1148,67 @@ if st.session_state.get("room_id"):
     )
 
     # --- タブの作成 (タブ名を変更) ---
-    tab_com, tab_sp, tab_free, tab_all, tab_fan = st.tabs([
-        "💬🧡 コメント&MSG", "🎁 スペシャルギフト", "🎈 無償ギフト", "🎁🎈 ギフト統合 (SP&無償)", "🏆 ファンリスト"
+    tab_com, tab_sp, tab_free, tab_all, tab_fan, tab_users, tab_trend, tab_archive = st.tabs([
+        "💬🧡 コメント&MSG", "🎁 スペシャルギフト", "🎈 無償ギフト", "🎁🎈 ギフト統合 (SP&無償)", "🏆 ファンリスト", "👥 ユーザー", "📈 推移", "📚 アーカイブ"
     ])
 
     # ==========================================
     # タブ1: コメント & システムメッセージログ
     # ==========================================
-    with tab_com:
+    with tab_com, stage("tab.comment"):
         # --- 1. コメントログ部分 ---
         with st.expander("📝 コメントログ一覧", expanded=True):
-            filtered_comments = [
-                log for log in st.session_state.comment_log 
-                if not any(keyword in log.get('name', '') or keyword in log.get('comment', '') for keyword in SYSTEM_COMMENT_KEYWORDS)
-            ]
-            if filtered_comments:
-                c_df = pd.DataFrame(filtered_comments)
-                c_df['コメント時間'] = pd.to_datetime(c_df['created_at'], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                c_df = c_df.rename(columns={'name': 'ユーザー名', 'comment': 'コメント内容', 'user_id': 'ユーザーID'})
-                
-                st.dataframe(c_df[['コメント時間', 'ユーザー名', 'コメント内容']], use_container_width=True, hide_index=True)
-                
-                buf_com = io.BytesIO()
-                c_df[['コメント時間', 'ユーザー名', 'ユーザーID', 'コメント内容']].to_csv(buf_com, index=False, encoding='utf-8-sig')
-                st.download_button("コメントログをダウンロード", buf_com.getvalue(), f"comment_log_{st.session_state.room_id}.csv", "text/csv", key="dl_c")
+            # 表と CSV はワーカープロセスで作り、コメントログの version が変わるまで使い回す
+            comment_tables = export_jobs.cached(
+                st.session_state.export_cache, "comment_tab", st.session_state.comment_log.version, export_jobs.comment_tab,
+                lambda: (export_jobs.pack("comment", st.session_state.comment_log), SYSTEM_COMMENT_KEYWORDS),
+            )
+            if comment_tables:
+                st.dataframe(comment_tables["table"], use_container_width=True, hide_index=True)
+                st.download_button("コメントログをダウンロード", comment_tables["csv"], f"comment_log_{st.session_state.room_id}.csv", "text/csv", key="dl_c")
             else:
                 st.info("コメントデータがありません。")
 
+        # --- コメント検索（bi-gram 索引。現在の配信とアーカイブ済みの配信） ---
+        with st.expander("🔍 コメント検索", expanded=False):
+            search_sources = {"current": "現在の配信"}
+            try:
+                for archived in comment_counts_per_stream(st.session_state.room_id, last_n_streams=30):
+                    started = datetime.datetime.fromtimestamp(archived['started_at'], JST).strftime("%Y-%m-%d %H:%M")
+                    search_sources[archived['stream_id']] = f"アーカイブ: {started} 開始（{archived['comment_count']} 件）"
+            except Exception as e:
+                st.warning(f"アーカイブの読み込み中にエラー: {e}")
+            search_source = st.selectbox("検索対象", list(search_sources), format_func=search_sources.get, key="comment_search_source")
+            search_index = st.session_state.comment_search if search_source == "current" else archived_comment_index(search_source)
+
+            search_cols = st.columns([2, 1])
+            search_text = search_cols[0].text_input("コメント内容（部分一致）:", key="comment_search_text")
+            search_user = search_cols[1].text_input("ユーザーID または ユーザー名:", key="comment_search_user")
+            search_since = search_until = None
+            time_range = search_index.time_range()
+            if time_range and time_range[0] < time_range[1]:
+                range_start, range_end = (datetime.datetime.fromtimestamp(t, JST).replace(second=0) for t in time_range)
+                range_end += datetime.timedelta(minutes=1)
+                selected_range = st.slider(
+                    "時間帯", min_value=range_start, max_value=range_end, value=(range_start, range_end),
+                    step=datetime.timedelta(minutes=1), format="HH:mm", key=f"comment_search_range_{search_source}",
+                )
+                if selected_range != (range_start, range_end):
+                    search_since, search_until = (int(t.timestamp()) for t in selected_range)
+
+            if search_text or search_user or search_since is not None:
+                with stage("search.comment"):
+                    hits = search_index.search(search_text, user=search_user, since=search_since, until=search_until)
+                st.caption(f"{len(hits)} 件" + ("（上限に達したため新しいものから表示）" if len(hits) >= SEARCH_RESULT_LIMIT else ""))
+                if hits:
+                    st.dataframe(pd.DataFrame([
+                        {
+                            'コメント時間': datetime.datetime.fromtimestamp(hit['created_at'], JST).strftime("%Y-%m-%d %H:%M:%S"),
+                            'ユーザー名': hit['name'], 'コメント内容': hit['comment'], 'ユーザーID': hit['user_id'],
+                        }
+                        for hit in hits
+                    ]), use_container_width=True, hide_index=True)
+
         # --- 2. システムMSGログ部分 (追加) ---
         with st.expander("🧡 システムMSGログ一覧", expanded=True):
             system_msgs = st.session_state.get("system_msg_log", [])
@@ -1140,106 +1221,89 @@ if st.session_state.get("room_id"):
                 
                 # 表示用データフレーム（CSVダウンロード不要とのことなので表示のみ）
                 st.dataframe(s_msg_df[['表示時間', '表示内容']], use_container_width=True, hide_index=True)
+
+                # 種別・ファンレベルでの絞り込み（分類済みの値を使う）
+                classified_msgs = [classified(log) for log in system_msgs]
+                kind_options = [k for k in KIND_LABELS if any(log['kind'] == k for log in classified_msgs)]
+                selected_kinds = st.multiselect("種別で絞り込み", kind_options, format_func=KIND_LABELS.get, key="sys_msg_kinds")
+                if selected_kinds:
+                    filtered_msgs = [log for log in classified_msgs if log['kind'] in selected_kinds]
+                    st.dataframe(pd.DataFrame([
+                        {
+                            '表示時間': datetime.datetime.fromtimestamp(log.get('created_at', 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
+                            '種別': KIND_LABELS[log['kind']], '訪問回数': log.get('visit_count'),
+                            'ファンレベル': log.get('fan_level'), '表示内容': log.get('message', ''), 'ユーザーID': log.get('user_id'),
+                        }
+                        for log in filtered_msgs
+                    ]), use_container_width=True, hide_index=True)
             else:
                 st.info("システムメッセージデータがありません。")
 
+        # --- 3. ファンレベル到達ユーザー ---
+        with st.expander("⭐ ファンレベル到達ユーザー", expanded=False):
+            reached_level = st.number_input("ファンレベル", min_value=1, max_value=100, value=10, step=1, key="sys_msg_fan_level")
+            reached = {}
+            for log in st.session_state.get("system_msg_log", []):
+                log = classified(log)
+                if log['kind'] == FAN_LEVEL and log.get('fan_level') == reached_level:
+                    # ログは新しい順なので、最初に見つかったもの＝最新の到達記録
+                    reached.setdefault(log.get('user_id'), log)
+            if reached:
+                st.dataframe(pd.DataFrame([
+                    {
+                        '到達時間': datetime.datetime.fromtimestamp(log.get('created_at', 0), JST).strftime("%Y-%m-%d %H:%M:%S"),
+                        'ユーザーID': user_id, '表示内容': log.get('message', ''),
+                    }
+                    for user_id, log in reached.items()
+                ]), use_container_width=True, hide_index=True)
+            else:
+                st.info(f"ファンレベル{reached_level}に到達したユーザーはいません。")
+
     # ==========================================
     # タブ2: スペシャルギフトログ
     # ==========================================
-    with tab_sp:
+    with tab_sp, stage("tab.gift"):
         if st.session_state.gift_log:
-            s_raw = pd.DataFrame(st.session_state.gift_log)
-            if st.session_state.gift_list_map:
-                g_info = pd.DataFrame.from_dict(st.session_state.gift_list_map, orient='index')
-                g_info.index = g_info.index.astype(str)
-                s_raw['gift_id'] = s_raw['gift_id'].astype(str)
-                s_raw = s_raw.set_index('gift_id').join(g_info, on='gift_id', lsuffix='_u', rsuffix='_g').reset_index()
+            # ギフト名・単価・行ポイントは取り込み時に付与済み（enrich_gift_entry）
+            gift_tables = export_jobs.cached(
+                st.session_state.export_cache, "gift_tab", st.session_state.gift_log.version, export_jobs.gift_tab,
+                lambda: gift_tab_args("gift", st.session_state.gift_log),
+            )
 
             # 1. 全量一覧
             with st.expander("📜 スペシャルギフトログ一覧表 (全量)", expanded=True):
-                s_disp = s_raw.copy()
-                s_disp['ギフト時間'] = pd.to_datetime(s_disp['created_at'], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                s_disp['合計Pt（※単純合計値）'] = (pd.to_numeric(s_disp['num']) * pd.to_numeric(s_disp['point'])).astype(int)
-                s_disp = s_disp.rename(columns={'name_u': 'ユーザー名', 'name_g': 'ギフト名', 'num': '個数', 'point': 'ポイント', 'user_id': 'ユーザーID'})
-                st.dataframe(s_disp[['ギフト時間', 'ユーザー名', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']], use_container_width=True, hide_index=True)
-                
-                buf_s1 = io.BytesIO()
-                s_disp[['ギフト時間', 'ユーザー名', 'ユーザーID', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']].to_csv(buf_s1, index=False, encoding='utf-8-sig')
-                st.download_button("スペシャルギフトログをダウンロード", buf_s1.getvalue(), "sp_gift_all.csv", "text/csv", key="dl_s1")
+                st.dataframe(gift_tables["table"], use_container_width=True, hide_index=True)
+                st.download_button("スペシャルギフトログをダウンロード", gift_tables["csv"], "sp_gift_all.csv", "text/csv", key="dl_s1")
 
             # 2. ギフト単位合算
             with st.expander("🎁 ユーザー単位でギフト合算集計", expanded=False):
-                s_sum = s_raw.groupby(['user_id', 'name_g', 'point'], as_index=False).agg({'num': 'sum', 'created_at': 'max', 'name_u': 'last'})
-                s_sum['合計Pt（※単純合計値）'] = (s_sum['num'] * pd.to_numeric(s_sum['point'])).astype(int)
-                s_sum['最新ギフト時間'] = pd.to_datetime(s_sum['created_at'], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                s_sum = s_sum.rename(columns={'name_u': 'ユーザー名', 'name_g': 'ギフト名', 'num': '合計個数', 'point': 'ポイント', 'user_id': 'ユーザーID'}).sort_values('最新ギフト時間', ascending=False)
-                st.dataframe(s_sum[['最新ギフト時間', 'ユーザー名', 'ギフト名', '合計個数', 'ポイント', '合計Pt（※単純合計値）']], use_container_width=True, hide_index=True)
+                st.dataframe(gift_tables["summary"], use_container_width=True, hide_index=True)
 
             # 3. ユーザー単位集計 (貢献順)
             with st.expander("👤 ユーザー単位で集計 (総貢献Pt順)", expanded=False):
-                s_user = s_raw.copy()
-                s_user['line_pt'] = pd.to_numeric(s_user['num']) * pd.to_numeric(s_user['point'])
-                latest_names = s_user.sort_values('created_at').groupby('user_id')['name_u'].last()
-                u_agg = s_user.groupby(['user_id', 'name_g', 'point'], as_index=False).agg({'num': 'sum', 'line_pt': 'sum'})
-                u_total = u_agg.groupby('user_id')['line_pt'].sum().rename('総Pt')
-                u_merged = u_agg.merge(u_total, on='user_id').sort_values(['総Pt', 'user_id', 'line_pt'], ascending=[False, True, False])
-                
-                u_rows = []
-                prev_id = None
-                for _, r in u_merged.iterrows():
-                    u_rows.append({
-                        'ユーザー名': latest_names[r['user_id']] if r['user_id'] != prev_id else '',
-                        'ギフト名': r['name_g'], '合計個数': r['num'], 'ポイント': r['point'],
-                        'ギフト単位Pt': int(r['line_pt']), '総貢献Pt（※単純合計値）': int(r['総Pt']) if r['user_id'] != prev_id else ''
-                    })
-                    prev_id = r['user_id']
-                st.dataframe(pd.DataFrame(u_rows), use_container_width=True, hide_index=True)
+                st.dataframe(gift_tables["ranking"], use_container_width=True, hide_index=True)
         else:
             st.info("スペシャルギフトデータがありません。")
 
     # ==========================================
     # タブ3: 無償ギフトログ
     # ==========================================
-    with tab_free:
+    with tab_free, stage("tab.free_gift"):
         if st.session_state.free_gift_log:
-            f_raw = pd.DataFrame(st.session_state.free_gift_log)
+            free_gift_tables = export_jobs.cached(
+                st.session_state.export_cache, "free_gift_tab", st.session_state.free_gift_log.version, export_jobs.gift_tab,
+                lambda: gift_tab_args("free_gift", st.session_state.free_gift_log),
+            )
             
             with st.expander("📜 無償ギフトログ一覧表 (全量)", expanded=True):
-                f_disp = f_raw.copy()
-                f_disp['ギフト時間'] = pd.to_datetime(f_disp['created_at'], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                f_disp['合計Pt（※単純合計値）'] = (pd.to_numeric(f_disp['num']) * pd.to_numeric(f_disp['point'])).astype(int)
-                f_disp = f_disp.rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '個数', 'point': 'ポイント', 'user_id': 'ユーザーID'})
-                st.dataframe(f_disp[['ギフト時間', 'ユーザー名', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']], use_container_width=True, hide_index=True)
-                
-                buf_f1 = io.BytesIO()
-                f_disp[['ギフト時間', 'ユーザー名', 'ユーザーID', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']].to_csv(buf_f1, index=False, encoding='utf-8-sig')
-                st.download_button("無償ギフトログをダウンロード", buf_f1.getvalue(), "free_gift_all.csv", "text/csv", key="dl_f1")
+                st.dataframe(free_gift_tables["table"], use_container_width=True, hide_index=True)
+                st.download_button("無償ギフトログをダウンロード", free_gift_tables["csv"], "free_gift_all.csv", "text/csv", key="dl_f1")
 
             with st.expander("🎈 ユーザー単位でギフト合算集計", expanded=False):
-                f_sum = f_raw.groupby(['user_id', 'gift_name', 'point'], as_index=False).agg({'num': 'sum', 'created_at': 'max', 'name': 'last'})
-                f_sum['合計Pt（※単純合計値）'] = (f_sum['num'] * pd.to_numeric(f_sum['point'])).astype(int)
-                f_sum['最新ギフト時間'] = pd.to_datetime(f_sum['created_at'], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                f_sum = f_sum.rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '合計個数', 'point': 'ポイント'}).sort_values('最新ギフト時間', ascending=False)
-                st.dataframe(f_sum[['最新ギフト時間', 'ユーザー名', 'ギフト名', '合計個数', 'ポイント', '合計Pt（※単純合計値）']], use_container_width=True, hide_index=True)
+                st.dataframe(free_gift_tables["summary"], use_container_width=True, hide_index=True)
 
             with st.expander("👤 ユーザー単位で集計 (総貢献Pt順)", expanded=False):
-                f_u_df = f_raw.copy()
-                f_u_df['line_pt'] = pd.to_numeric(f_u_df['num']) * pd.to_numeric(f_u_df['point'])
-                latest_f_names = f_u_df.sort_values('created_at').groupby('user_id')['name'].last()
-                f_u_agg = f_u_df.groupby(['user_id', 'gift_name', 'point'], as_index=False).agg({'num': 'sum', 'line_pt': 'sum'})
-                f_u_total = f_u_agg.groupby('user_id')['line_pt'].sum().rename('総Pt')
-                f_u_merged = f_u_agg.merge(f_u_total, on='user_id').sort_values(['総Pt', 'user_id', 'line_pt'], ascending=[False, True, False])
-                
-                f_u_rows = []
-                prev_f_id = None
-                for _, r in f_u_merged.iterrows():
-                    f_u_rows.append({
-                        'ユーザー名': latest_f_names[r['user_id']] if r['user_id'] != prev_f_id else '',
-                        'ギフト名': r['gift_name'], '合計個数': r['num'], 'ポイント': r['point'],
-                        'ギフト単位Pt': int(r['line_pt']), '総貢献Pt（※単純合計値）': int(r['総Pt']) if r['user_id'] != prev_f_id else ''
-                    })
-                    prev_f_id = r['user_id']
-                st.dataframe(pd.DataFrame(f_u_rows), use_container_width=True, hide_index=True)
+                st.dataframe(free_gift_tables["ranking"], use_container_width=True, hide_index=True)
         else:
             st.info("無償ギフトデータがありません。")
 
@@ -1247,81 +1311,202 @@ if st.session_state.get("room_id"):
     # タブ4: スペシャル＆無償 統合ログ
     # ==========================================
    
-    with tab_all:
-        combined_data = []
-        if st.session_state.gift_log:
-            s_part = pd.DataFrame(st.session_state.gift_log)
-            if st.session_state.gift_list_map:
-                g_map = pd.DataFrame.from_dict(st.session_state.gift_list_map, orient='index')
-                s_part['gift_id'] = s_part['gift_id'].astype(str)
-                s_part = s_part.set_index('gift_id').join(g_map, on='gift_id', lsuffix='_u', rsuffix='_g').reset_index()
-                s_part = s_part.rename(columns={'name_u': 'name', 'name_g': 'gift_name'})
-            combined_data.append(s_part[['created_at', 'name', 'user_id', 'gift_name', 'num', 'point']])
-        
-        if st.session_state.free_gift_log:
-            f_part = pd.DataFrame(st.session_state.free_gift_log)
-            combined_data.append(f_part[['created_at', 'name', 'user_id', 'gift_name', 'num', 'point']])
-
-        if combined_data:
-            all_df = pd.concat(combined_data, ignore_index=True)
-            all_df['created_at_dt'] = pd.to_datetime(all_df['created_at'], unit='s')
+    with tab_all, stage("tab.combined"):
+        if st.session_state.gift_log or st.session_state.free_gift_log:
+            combined_tables = export_jobs.cached(
+                st.session_state.export_cache, "combined_tab",
+                (st.session_state.gift_log.version, st.session_state.free_gift_log.version), export_jobs.combined_tab,
+                lambda: combined_tab_args(st.session_state.gift_log, st.session_state.free_gift_log),
+            )
 
             with st.expander("📜 SP&無償ギフトログ一覧表 (全量)", expanded=True):
-                all_disp = all_df.sort_values('created_at', ascending=False).copy()
-                all_disp['ギフト時間'] = all_disp['created_at_dt'].dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                all_disp['合計Pt（※単純合計値）'] = (pd.to_numeric(all_disp['num']) * pd.to_numeric(all_disp['point'])).astype(int)
-                all_disp = all_disp.rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '個数', 'point': 'ポイント', 'user_id': 'ユーザーID'})
-                st.dataframe(all_disp[['ギフト時間', 'ユーザー名', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']], use_container_width=True, hide_index=True)
-                
-                buf_all1 = io.BytesIO()
-                all_disp[['ギフト時間', 'ユーザー名', 'ユーザーID', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']].to_csv(buf_all1, index=False, encoding='utf-8-sig')
-                st.download_button("SP&無償ギフトログをダウンロード", buf_all1.getvalue(), "combined_gift_all.csv", "text/csv", key="dl_all1")
+                st.dataframe(combined_tables["table"], use_container_width=True, hide_index=True)
+                st.download_button("SP&無償ギフトログをダウンロード", combined_tables["csv"], "combined_gift_all.csv", "text/csv", key="dl_all1")
 
             with st.expander("🎁🎈 ユーザー単位でギフト合算集計", expanded=False):
-                all_sum = all_df.groupby(['user_id', 'gift_name', 'point'], as_index=False).agg({'num': 'sum', 'created_at_dt': 'max', 'name': 'last'})
-                all_sum['合計Pt（※単純合計値）'] = (all_sum['num'] * pd.to_numeric(all_sum['point'])).astype(int)
-                all_sum['最新ギフト時間'] = all_sum['created_at_dt'].dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
-                all_sum = all_sum.rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '合計個数', 'point': 'ポイント'}).sort_values('最新ギフト時間', ascending=False)
-                st.dataframe(all_sum[['最新ギフト時間', 'ユーザー名', 'ギフト名', '合計個数', 'ポイント', '合計Pt（※単純合計値）']], use_container_width=True, hide_index=True)
+                st.dataframe(combined_tables["summary"], use_container_width=True, hide_index=True)
 
             with st.expander("👤 ユーザー単位で集計 (総貢献Pt順)", expanded=False):
-                all_u = all_df.copy()
-                all_u['line_pt'] = pd.to_numeric(all_u['num']) * pd.to_numeric(all_u['point'])
-                latest_all_names = all_u.sort_values('created_at').groupby('user_id')['name'].last()
-                all_u_agg = all_u.groupby(['user_id', 'gift_name', 'point'], as_index=False).agg({'num': 'sum', 'line_pt': 'sum'})
-                all_u_total = all_u_agg.groupby('user_id')['line_pt'].sum().rename('総Pt')
-                all_u_merged = all_u_agg.merge(all_u_total, on='user_id').sort_values(['総Pt', 'user_id', 'line_pt'], ascending=[False, True, False])
-                
-                all_u_rows = []
-                prev_all_id = None
-                for _, r in all_u_merged.iterrows():
-                    all_u_rows.append({
-                        'ユーザー名': latest_all_names[r['user_id']] if r['user_id'] != prev_all_id else '',
-                        'ギフト名': r['gift_name'], '合計個数': r['num'], 'ポイント': r['point'],
-                        'ギフト単位Pt': int(r['line_pt']), '総貢献Pt（※単純合計値）': int(r['総Pt']) if r['user_id'] != prev_all_id else ''
-                    })
-                    prev_all_id = r['user_id']
-                st.dataframe(pd.DataFrame(all_u_rows), use_container_width=True, hide_index=True)
+                st.dataframe(combined_tables["ranking"], use_container_width=True, hide_index=True)
         else:
             st.info("SP&無償ギフトデータがありません。")
 
     # ==========================================
     # タブ5: ファンリスト
     # ==========================================
-    with tab_fan:
+    with tab_fan, stage("tab.fan"):
         if st.session_state.fan_list:
-            raw_fan_df = pd.DataFrame(st.session_state.fan_list)
-            rename_map = {'rank': '順位', 'level': 'レベル', 'user_name': 'ユーザー名', 'point': 'ポイント', 'user_id': 'ユーザーID'}
-            existing_rename_map = {k: v for k, v in rename_map.items() if k in raw_fan_df.columns}
-            fan_df = raw_fan_df.rename(columns=existing_rename_map)
-            desired_cols = ['順位', 'レベル', 'ユーザー名', 'ポイント', 'ユーザーID']
-            final_display_cols = [c for c in desired_cols if c in fan_df.columns]
+            # 表と CSV はファンリストの内容が変わった時だけ作り直す
+            fan_tables = st.session_state.export_cache.get("fan_tab")
+            if fan_tables is None or fan_tables[0] != st.session_state.fan_list_version:
+                raw_fan_df = pd.DataFrame(st.session_state.fan_list)
+                rename_map = {'rank': '順位', 'level': 'レベル', 'user_name': 'ユーザー名', 'point': 'ポイント', 'user_id': 'ユーザーID'}
+                existing_rename_map = {k: v for k, v in rename_map.items() if k in raw_fan_df.columns}
+                fan_df = raw_fan_df.rename(columns=existing_rename_map)
+                desired_cols = ['順位', 'レベル', 'ユーザー名', 'ポイント', 'ユーザーID']
+                final_display_cols = [c for c in desired_cols if c in fan_df.columns]
+                buf_fan = io.BytesIO()
+                fan_df[final_display_cols].to_csv(buf_fan, index=False, encoding='utf-8-sig')
+                fan_tables = (st.session_state.fan_list_version, fan_df[final_display_cols], buf_fan.getvalue())
+                st.session_state.export_cache["fan_tab"] = fan_tables
             
             st.markdown("### 🏆 ファンリスト一覧")
-            st.dataframe(fan_df[final_display_cols], use_container_width=True, hide_index=True)
-            
-            buf_fan = io.BytesIO()
-            fan_df[final_display_cols].to_csv(buf_fan, index=False, encoding='utf-8-sig')
-            st.download_button(label="ファンリストをダウンロード", data=buf_fan.getvalue(), file_name=f"fan_list_{st.session_state.room_id}.csv", mime="text/csv", key="dl_f_final")
+            st.dataframe(fan_tables[1], use_container_width=True, hide_index=True)
+            st.download_button(label="ファンリストをダウンロード", data=fan_tables[2], file_name=f"fan_list_{st.session_state.room_id}.csv", mime="text/csv", key="dl_f_final")
         else:
-            st.info("ファンデータがありません。")
\ No newline at end of file
+            st.info("ファンデータがありません。")
+
+    # ==========================================
+    # タブ6: ユーザー（取り込み時に更新した索引から表示）
+    # ==========================================
+    with tab_users, stage("tab.users"):
+        user_index = st.session_state.user_index
+        if len(user_index):
+            with st.expander("👥 ユーザー一覧", expanded=True):
+                users_df = pd.DataFrame(user_index.rows()).sort_values(['gift_points', 'last_seen'], ascending=False)
+                for col in ('first_seen', 'last_seen'):
+                    users_df[col] = pd.to_datetime(users_df[col], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
+                users_df = users_df.rename(columns={
+                    'name': 'ユーザー名', 'user_id': 'ユーザーID', 'first_seen': '初回記録', 'last_seen': '最終記録',
+                    'comment_count': 'コメント数', 'gift_count': 'SPギフト回数', 'free_gift_count': '無償ギフト回数',
+                    'system_msg_count': 'システムMSG数', 'gift_points': 'SPギフトPt', 'free_gift_points': '無償ギフトPt',
+                })
+                st.dataframe(users_df[['ユーザー名', 'SPギフトPt', '無償ギフトPt', 'コメント数', 'SPギフト回数', '無償ギフト回数',
+                                       'システムMSG数', '初回記録', '最終記録', 'ユーザーID']], use_container_width=True, hide_index=True)
+
+            with st.expander("🔎 ユーザーのタイムライン", expanded=False):
+                user_query = st.text_input("ユーザーID または ユーザー名（部分一致）:", key="user_timeline_query")
+                matched_users = user_index.find(user_query)
+                if matched_users:
+                    selected_user = st.selectbox(
+                        "ユーザー", matched_users, format_func=lambda u: f"{u.name} ({u.user_id})", key="user_timeline_select"
+                    )
+                    st.markdown(
+                        f"SPギフト {selected_user.gift_points} pt ／ 無償ギフト {selected_user.free_gift_points} pt ／ "
+                        f"コメント {selected_user.counts['comment']} 件 ／ システムMSG {selected_user.counts['system_msg']} 件"
+                    )
+                    user_timeline = user_index.timeline(selected_user.user_id)
+                    if len(user_timeline) < sum(selected_user.counts.values()):
+                        st.caption("タイムラインは直近の分のみ表示しています（件数・ポイントは全期間）。")
+                    st.dataframe(pd.DataFrame([
+                        {
+                            '時間': datetime.datetime.fromtimestamp(ts, JST).strftime("%Y-%m-%d %H:%M:%S"),
+                            '種類': EVENT_LABELS[kind], '内容': text, '個数': num,
+                        }
+                        for ts, kind, text, num in user_timeline
+                    ]), use_container_width=True, hide_index=True)
+                elif user_query:
+                    st.info("該当するユーザーがいません。")
+        else:
+            st.info("まだデータがありません。")
+
+    # ==========================================
+    # タブ7: 分単位の推移（取り込み時に集計したリングバッファから描画）
+    # ==========================================
+    with tab_trend, stage("tab.trend"):
+        series = st.session_state.time_series
+        trend_minutes = st.selectbox("表示範囲", [30, 60, 180, 360], index=1, format_func=lambda m: f"直近{m}分", key="trend_minutes")
+        trend_rows = series.rows(trend_minutes)
+        if trend_rows:
+            trend_x = [datetime.datetime.fromtimestamp(ts, JST) for ts, _ in trend_rows]
+
+            with st.expander("📊 1分あたりの件数", expanded=True):
+                fig_counts = go.Figure()
+                for kind in ("comments", "free_gifts", "visits"):
+                    fig_counts.add_trace(go.Scatter(x=trend_x, y=[row[kind] for _, row in trend_rows], mode="lines", name=SERIES_LABELS[kind]))
+                fig_counts.update_layout(height=320, margin=dict(l=10, r=10, t=30, b=10), hovermode="x unified")
+                st.plotly_chart(fig_counts, use_container_width=True)
+
+            with st.expander("💎 1分あたりの有償ギフトPt", expanded=True):
+                fig_points = go.Figure(go.Bar(x=trend_x, y=[row["gift_points"] for _, row in trend_rows], name=SERIES_LABELS["gift_points"]))
+                fig_points.update_layout(height=280, margin=dict(l=10, r=10, t=30, b=10))
+                st.plotly_chart(fig_points, use_container_width=True)
+
+            with st.expander("🏅 ギフト貢献上位ユーザーの累計Pt推移", expanded=False):
+                board_x, board_series = series.leaderboard(top_n=5, last_minutes=trend_minutes)
+                if board_series:
+                    fig_board = go.Figure()
+                    for user_id, user_name, values in board_series:
+                        fig_board.add_trace(go.Scatter(
+                            x=[datetime.datetime.fromtimestamp(ts, JST) for ts in board_x], y=values,
+                            mode="lines", line_shape="hv", name=f"{user_name} ({user_id})",
+                        ))
+                    fig_board.update_layout(height=360, margin=dict(l=10, r=10, t=30, b=10), hovermode="x unified")
+                    st.plotly_chart(fig_board, use_container_width=True)
+                else:
+                    st.info("スペシャルギフトデータがありません。")
+        else:
+            st.info("まだデータがありません。")
+
+    # ==========================================
+    # タブ8: 過去配信アーカイブ (ローカル SQLite)
+    # ==========================================
+    with tab_archive, stage("tab.archive"):
+        try:
+            with st.expander("🏅 直近30配信のギフト貢献ランキング", expanded=True):
+                include_free = st.checkbox("無償ギフトを含める", value=False, key="archive_include_free")
+                gifters = top_gifters(st.session_state.room_id, last_n_streams=30, limit=50, include_free=include_free)
+                if gifters:
+                    gifters_df = pd.DataFrame(gifters).rename(columns={
+                        'name': 'ユーザー名', 'total_point': '総貢献Pt（※単純合計値）', 'total_num': '合計個数',
+                        'stream_count': 'ギフト配信回数', 'user_id': 'ユーザーID'
+                    })
+                    st.dataframe(gifters_df[['ユーザー名', '総貢献Pt（※単純合計値）', '合計個数', 'ギフト配信回数', 'ユーザーID']], use_container_width=True, hide_index=True)
+                else:
+                    st.info("アーカイブされた配信がありません。")
+
+            with st.expander("💬 配信ごとのコメント数", expanded=False):
+                counts = comment_counts_per_stream(st.session_state.room_id, last_n_streams=30)
+                if counts:
+                    counts_df = pd.DataFrame(counts)
+                    for col in ('started_at', 'ended_at'):
+                        counts_df[col] = pd.to_datetime(counts_df[col], unit='s').dt.tz_localize('UTC').dt.tz_convert(JST).dt.strftime("%Y-%m-%d %H:%M:%S")
+                    counts_df = counts_df.rename(columns={
+                        'started_at': '配信開始', 'ended_at': '配信終了', 'comment_count': 'コメント数', 'commenter_count': 'コメントユーザー数'
+                    })
+                    st.dataframe(counts_df[['配信開始', '配信終了', 'コメント数', 'コメントユーザー数']], use_container_width=True, hide_index=True)
+                else:
+                    st.info("アーカイブされた配信がありません。")
+
+            with st.expander("🔎 ユーザーの初回記録日時", expanded=False):
+                lookup_user_id = st.text_input("ユーザーIDを入力してください:", key="archive_user_id")
+                if lookup_user_id and lookup_user_id.isdigit():
+                    seen_at = first_seen(lookup_user_id, room_id=st.session_state.room_id)
+                    if seen_at:
+                        st.write(f"初回記録: {datetime.datetime.fromtimestamp(seen_at, JST).strftime('%Y-%m-%d %H:%M:%S')}")
+                    else:
+                        st.info("このルームのアーカイブに記録がありません。")
+        except Exception as e:
+            st.error(f"アーカイブの読み込み中にエラー: {e}")
+
+# ==========================================
+# パフォーマンス計測パネル（デバッグ用）
+# ==========================================
+with st.expander("🛠 パフォーマンス計測 (デバッグ)", expanded=False):
+    current_trace = current_run()
+    if current_trace and current_trace.stages:
+        st.markdown(f"**今回の再実行:** {current_trace.elapsed() * 1000:.0f} ms（このパネルの表示時点まで）")
+        st.dataframe(pd.DataFrame([
+            {'段階': stage_name, '時間(ms)': round(sec * 1000, 1)} for stage_name, sec in current_trace.stages
+        ]), use_container_width=True, hide_index=True)
+
+    perf = perf_snapshot()
+    st.markdown("**プロセス全体の集計（全セッション）**")
+    st.dataframe(pd.DataFrame([
+        {'段階': stage_name, '回数': v['count'], '平均(ms)': round(v['avg_sec'] * 1000, 1),
+         '最大(ms)': round(v['max_sec'] * 1000, 1), '合計(秒)': round(v['sum_sec'], 2)}
+        for stage_name, v in sorted(perf['stages'].items())
+    ]), use_container_width=True, hide_index=True)
+    if perf['counters']:
+        st.dataframe(pd.DataFrame([
+            {'メトリクス': name, '値': value} for name, value in sorted(perf['counters'].items())
+        ]), use_container_width=True, hide_index=True)
+
+    # 受信機（WebSocket）の状態
+    publish_receiver_metrics()
+    receiver_rows = receivers_health()
+    if receiver_rows:
+        st.markdown("**受信機の状態（全セッション）**")
+        st.dataframe(pd.DataFrame(receiver_rows), use_container_width=True, hide_index=True)
+
+end_run()
\ No newline at end of file
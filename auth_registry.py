@@ -0,0 +1,146 @@
+import csv
+import io
+import os
+import threading
+import time
+
+import requests
+
+# --- 認証用ルームリスト (room_list.csv) のプロセス共通キャッシュ ---
+# 全セッションで1つのレジストリを共有し、TTL 経過後はバックグラウンドで再取得する。
+# リモートに繋がらない場合はディスク上の最後に取得できたコピーを使う
+ROOM_LIST_TTL_SEC = 300
+# 負荷試験などで本番のキャッシュを上書きしないよう、環境変数で保存先を差し替えられる
+ROOM_LIST_CACHE_PATH = os.environ.get(
+    "SRLOG_ROOM_LIST_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "room_list_cache.csv")
+)
+
+
+class AuthSnapshot:
+    """ある時点のルームリスト。codes は認証コード、room_ids はトラッキング可能なルームID（いずれも文字列）"""
+
+    def __init__(self, codes, room_ids, fetched_at, source):
+        self.codes = codes
+        self.room_ids = room_ids
+        self.fetched_at = fetched_at
+        self.source = source  # "remote" or "disk"
+
+
+def parse_room_list(text):
+    """room_list.csv の1列目を読み取り、(認証コード, ルームID) の frozenset を返す"""
+    codes = []
+    for row in csv.reader(io.StringIO(text)):
+        if row and row[0].strip():
+            codes.append(row[0].strip())
+    room_ids = []
+    for code in codes:
+        try:
+            room_ids.append(str(int(float(code))))
+        except ValueError:
+            continue  # ヘッダー行など
+    return frozenset(codes), frozenset(room_ids)
+
+
+class AuthRegistry:
+    def __init__(self, url, ttl_sec=ROOM_LIST_TTL_SEC, cache_path=ROOM_LIST_CACHE_PATH):
+        self.url = url
+        self.ttl_sec = ttl_sec
+        self.cache_path = cache_path
+        self._snapshot = None
+        self._lock = threading.Lock()          # 読み込み・更新の直列化
+        self._flag_lock = threading.Lock()     # _refreshing の判定用（取得中でも待たされない）
+        self._refreshing = False
+        self.last_error = None
+
+    def get(self):
+        """
+        現在のスナップショットを返す。TTL 切れならバックグラウンドで更新を開始し、古いものをそのまま返す。
+        まだ何も読み込んでいない場合だけ、ディスク → リモートの順で同期的に読み込む。
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load_from_disk()
+                if self._snapshot is None:
+                    self._refresh()
+                snapshot = self._snapshot
+            if snapshot is None:
+                raise RuntimeError(f"ルームリストを取得できませんでした: {self.last_error}")
+        if time.time() - snapshot.fetched_at >= self.ttl_sec:
+            self._refresh_in_background()
+        return snapshot
+
+    def warm(self):
+        """認証画面の表示時などに呼び、未読み込みならディスクから読み込んだうえでバックグラウンド取得を始める"""
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load_from_disk()
+        if self._snapshot is None or time.time() - self._snapshot.fetched_at >= self.ttl_sec:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._flag_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_locked, daemon=True).start()
+
+    def _refresh_locked(self):
+        try:
+            with self._lock:
+                self._refresh()
+        finally:
+            self._refreshing = False
+
+    def _refresh(self):
+        try:
+            response = requests.get(self.url, timeout=5)
+            response.raise_for_status()
+            text = response.text
+            codes, room_ids = parse_room_list(text)
+            if not codes:
+                raise ValueError("ルームリストが空です")
+            self._snapshot = AuthSnapshot(codes, room_ids, time.time(), "remote")
+            self.last_error = None
+            self._save_to_disk(text)
+        except Exception as e:
+            self.last_error = e
+            print(f"Room List Error: {e}")
+            if self._snapshot is not None:
+                # 取得失敗時は今のスナップショットを使い続け、TTL 後に再試行する
+                self._snapshot.fetched_at = time.time()
+
+    def _load_from_disk(self):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                codes, room_ids = parse_room_list(f.read())
+        except OSError:
+            return None
+        if not codes:
+            return None
+        return AuthSnapshot(codes, room_ids, os.path.getmtime(self.cache_path), "disk")
+
+    def _save_to_disk(self, text):
+        try:
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Room List Cache Error: {e}")
+
+
+# --- プロセス全体で共有するレジストリ（URL ごとに1つ） ---
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_auth_registry(url):
+    with _registries_lock:
+        registry = _registries.get(url)
+        if registry is None:
+            registry = AuthRegistry(url)
+            _registries[url] = registry
+        return registry
@@ -0,0 +1,116 @@
+"""
+自動保存の方式を、以前の「ログごとに100件の倍数を超えたら保存」と save_scheduler.SaveScheduler で比べる（時刻は模擬）。
+静かな時間帯（1分に1件）と集中する時間帯（毎秒数十件）を続けて流し、10秒ごとの再実行で保存判定を行う。
+
+    python benchmarks/autosave.py
+    python benchmarks/autosave.py --quiet-min 180 --rush-min 10 --rush-rate 80
+
+FTP への接続回数と、取り込んでから保存されるまでの最大の待ち（この間に落ちるとログが失われる）をログごとに表示する。
+"""
+import argparse
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_log import EventLog  # noqa: E402
+from save_scheduler import SAVE_KINDS, SaveScheduler  # noqa: E402
+
+RERUN_SEC = 10
+
+
+def make_events(quiet_min, rush_min, rush_rate):
+    """(時刻, kind) の列。システムMSG は入室などで常に少しずつ届く"""
+    events = []
+    t = 0
+    for _ in range(quiet_min):
+        events += [(t, "comment"), (t + 20, "system_msg"), (t + 40, "free_gift")]
+        t += 60
+    for i in range(rush_min * 60 * rush_rate):
+        events.append((t + i / rush_rate, SAVE_KINDS[i % 4]))
+    return events, t + rush_min * 60
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(events, end, save_policy):
+    """save_policy(logs, now) -> 保存する kind のリスト。接続回数と ログごとの最大の待ち（秒）を返す"""
+    logs = {kind: EventLog(kind, memory_budget_bytes=1 << 30) for kind in SAVE_KINDS}
+    unsaved_since = dict.fromkeys(SAVE_KINDS)
+    max_wait = dict.fromkeys(SAVE_KINDS, 0.0)
+    connections = 0
+    i = 0
+    now = 0.0
+    while now <= end:
+        while i < len(events) and events[i][0] <= now:
+            created_at, kind = events[i]
+            logs[kind].add({"created_at": created_at, "user_id": i, "comment": f"event{i}"})
+            if unsaved_since[kind] is None:
+                unsaved_since[kind] = created_at
+            i += 1
+        for kind in SAVE_KINDS:
+            if unsaved_since[kind] is not None:
+                max_wait[kind] = max(max_wait[kind], now - unsaved_since[kind])
+        kinds = save_policy(logs, now)
+        connections += len(kinds) if save_policy.per_log_connections else bool(kinds)
+        for kind in kinds:
+            unsaved_since[kind] = None
+        now += RERUN_SEC
+    return connections, max_wait
+
+
+def legacy_policy():
+    """ログごとに次の100の倍数を超えたら保存（システムMSG は保存しない）。1ログにつき1接続"""
+    prev = dict.fromkeys(("comment", "gift", "free_gift"), 0)
+
+    def policy(logs, now):
+        kinds = []
+        for kind in prev:
+            threshold = math.ceil((prev[kind] + 1) / 100) * 100
+            if len(logs[kind]) >= threshold:
+                prev[kind] = threshold
+                kinds.append(kind)
+        return kinds
+    policy.per_log_connections = True
+    return policy
+
+
+def scheduler_policy():
+    clock = Clock()
+    scheduler = SaveScheduler(clock=clock)
+
+    def policy(logs, now):
+        clock.now = now
+        kinds, _ = scheduler.due(logs)
+        if kinds:
+            scheduler.mark_attempted()
+            scheduler.mark_saved(scheduler.snapshot({kind: logs[kind] for kind in kinds}))
+        return kinds
+    policy.per_log_connections = False
+    return policy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quiet-min", type=int, default=120)
+    parser.add_argument("--rush-min", type=int, default=5)
+    parser.add_argument("--rush-rate", type=int, default=50, help="集中時の件数/秒（4ログ合計）")
+    args = parser.parse_args()
+
+    events, end = make_events(args.quiet_min, args.rush_min, args.rush_rate)
+    print(f"events={len(events)} 模擬時間={end / 60:.0f}分 再実行間隔={RERUN_SEC}秒")
+    for label, policy in (("100件ごと（以前）", legacy_policy()), ("SaveScheduler", scheduler_policy())):
+        connections, max_wait = simulate(events, end, policy)
+        waits = " ".join(f"{kind}={max_wait[kind] / 60:>6.1f}分" for kind in SAVE_KINDS)
+        print(f"{label:<18} FTP接続={connections:>4}回  最大の未保存時間: {waits}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+ポーリングログの重複判定を、以前の (created_at, name) タプルの set と指紋の集合 (dedup_index.FingerprintSet) で比べる。
+件数ごとのメモリと1件あたりの判定時間を計測する。
+
+    python benchmarks/dedup.py                       # 100万件
+    python benchmarks/dedup.py --entries 300000
+
+あわせて以下も確認する（満たさなければ終了コード 1）。
+  * 同じ秒に同じ表示名の別ユーザーの行が落ちないこと
+  * 同じユーザーが同じ秒に投稿した2件目が落ちないこと
+  * APIが同じ行を再度返したときは重複として捨てること
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup_index import FingerprintSet, log_fingerprint  # noqa: E402
+
+
+def make_comments(n, users, seed=0):
+    rng = random.Random(seed)
+    t0 = 1700000000
+    comments = []
+    for i in range(n):
+        user = rng.randrange(users)
+        comments.append({
+            "created_at": t0 + i * 4 * 3600 // n,
+            "user_id": 100000 + user,
+            "name": f"user{user % (users // 4)}",  # 表示名の重複を意図的に作る
+            "comment": f"コメント{rng.randrange(1000)}",
+        })
+    return comments
+
+
+def measure(label, build, comments):
+    t = time.perf_counter()
+    build(comments)
+    sec = time.perf_counter() - t
+    # メモリは時間とは別に計測する（tracemalloc は処理を遅くするため）
+    tracemalloc.start()
+    container = build(comments)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{label:<28} kept={len(container):>8} {sec:>6.2f}s ({sec / len(comments) * 1e6:.2f}us/件) {mem / 1024 / 1024:>7.1f}MiB")
+    return len(container)
+
+
+def legacy(comments):
+    keys = set()
+    for log in comments:
+        keys.add((log.get('created_at'), log.get('name')))
+    return keys
+
+
+def fingerprints(comments):
+    seen = FingerprintSet()
+    for log in comments:
+        seen.add(log_fingerprint("comment", log))
+    return seen
+
+
+def check_semantics():
+    seen = FingerprintSet()
+    rows = [
+        {"created_at": 1, "user_id": 1, "name": "同名", "comment": "a"},
+        {"created_at": 1, "user_id": 2, "name": "同名", "comment": "a"},  # 同名の別ユーザー
+        {"created_at": 1, "user_id": 1, "name": "同名", "comment": "b"},  # 同じ秒の2件目
+    ]
+    kept = [seen.add(log_fingerprint("comment", row)) for row in rows]
+    again = [seen.add(log_fingerprint("comment", dict(row))) for row in rows]  # 次のポーリングで再度届く
+    return kept == [True, True, True] and again == [False, False, False]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    comments = make_comments(args.entries, args.users)
+    expected = len({(c["created_at"], c["user_id"], c["comment"]) for c in comments})
+    print(f"entries={len(comments)} 正しい件数={expected}")
+    measure("(created_at, name) の set", legacy, comments)
+    kept = measure("FingerprintSet", fingerprints, comments)
+
+    ok = kept == expected and check_semantics()
+    print("OK" if ok else "NG: 重複判定の結果が想定と異なります")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
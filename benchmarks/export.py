@@ -0,0 +1,80 @@
+"""
+統合タブの表作成 (export_jobs.combined_tab) を、このプロセスで実行した場合とワーカープロセスで実行した場合で比べる。
+実行中に別スレッド（他のセッションの再実行の代わり）が 10ms ごとに起きられたかを測り、GIL による待ちの最大値を表示する。
+
+    python benchmarks/export.py                  # 有償・無償ギフト各10万件
+    python benchmarks/export.py --gifts 300000
+
+ワーカーが起動時にメインモジュール（この場合はこのスクリプト、streamlit run では app.py）を読み込んでいないことも確認する
+（読み込んでいれば終了コード 1）。
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_jobs  # noqa: E402
+
+
+def make_logs(n, users, seed=0):
+    rng = random.Random(seed)
+    t0 = 1700000000
+    gifts, free_gifts = [], []
+    for i in range(n):
+        user = rng.randrange(users)
+        gifts.append({"created_at": t0 + i, "user_id": user, "name": f"user{user}", "gift_name": f"gift{rng.randrange(30)}",
+                      "num": rng.randint(1, 10), "point": rng.choice((1, 10, 100, 500)), "line_pt": 0})
+        user = rng.randrange(users)
+        free_gifts.append({"created_at": t0 + i, "last_created_at": t0 + i + 5, "user_id": user, "name": f"user{user}",
+                           "gift_name": f"free{rng.randrange(5)}", "num": 10, "point": 1})
+    for g in gifts:
+        g["line_pt"] = g["num"] * g["point"]
+    return gifts[::-1], free_gifts[::-1]
+
+
+def measure(label, gifts, free_gifts, names):
+    stop = threading.Event()
+    lags = []
+
+    def ticker():
+        while not stop.is_set():
+            t = time.perf_counter()
+            time.sleep(0.01)
+            lags.append(time.perf_counter() - t - 0.01)
+
+    thread = threading.Thread(target=ticker, daemon=True)
+    thread.start()
+    t = time.perf_counter()
+    result = export_jobs.run(export_jobs.combined_tab, export_jobs.pack("gift", gifts), export_jobs.pack("free_gift", free_gifts), names)
+    sec = time.perf_counter() - t
+    stop.set()
+    thread.join()
+    print(f"{label:<10} {sec:>6.2f}s rows={len(result['table'])} 他スレッドの最大待ち={max(lags) * 1000:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gifts", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=3000)
+    args = parser.parse_args()
+
+    gifts, free_gifts = make_logs(args.gifts, args.users)
+    names = {user: f"user{user}" for user in range(args.users)}
+    workers = export_jobs.EXPORT_WORKERS
+    export_jobs.EXPORT_WORKERS = 0
+    measure("inline", gifts, free_gifts, names)
+    export_jobs.EXPORT_WORKERS = max(workers, 1)
+    export_jobs.run(len, [])  # ワーカーの起動を計測から外す
+    measure("worker", gifts, free_gifts, names)
+    if export_jobs.worker_main_files:
+        print(f"NG: ワーカーがメインモジュールを読み込みました: {', '.join(sorted(export_jobs.worker_main_files))}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
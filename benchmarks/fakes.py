@@ -0,0 +1,455 @@
+"""
+負荷試験用のローカル代替サーバー（標準ライブラリのみ）。
+
+- FakeShowroomAPI: onlives / comment_log / gift_log / gift_list / active_fan/users / live_info / room/profile
+  と room_list.csv を返す HTTP サーバー。コメント・ギフトは経過時間に応じて決定的に生成する
+- FakeBroadcastServer: 配信サーバー (WebSocket) の代替。SUB を受けたら MSG フレームを指定レートで送る。
+  フレームは合成するか、記録ファイル（1行1フレーム）を繰り返し再生する。retired_keys のキーには送らない
+- FakeFTPServer: STOR / LIST / DELE だけを持つ最小限の FTP サーバー。アップロードバイト数を数える
+
+単体でも起動できる:
+    python benchmarks/fakes.py --rooms 1001,1002
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+FREE_GIFTS = [
+    {"gift_id": 1, "gift_name": "星(赤)", "point": 1, "free": True},
+    {"gift_id": 2, "gift_name": "星(黄)", "point": 1, "free": True},
+    {"gift_id": 1601, "gift_name": "種", "point": 1, "free": True},
+]
+PAID_GIFTS = [
+    {"gift_id": 1001, "gift_name": "ハート", "point": 10, "free": False},
+    {"gift_id": 1002, "gift_name": "花束", "point": 100, "free": False},
+    {"gift_id": 1003, "gift_name": "タワー", "point": 10000, "free": False},
+]
+
+
+class RoomFeed:
+    """ルームごとの疑似イベント列。i 番目のイベントは常に同じ内容になる（再現性のため）"""
+
+    def __init__(self, room_id, started_at, comment_rate, gift_rate, users, window=50):
+        self.room_id = int(room_id)
+        self.started_at = started_at
+        self.comment_rate = comment_rate
+        self.gift_rate = gift_rate
+        self.users = users
+        self.window = window
+        self.restarts = 0  # 配信の再開の回数（bcsvr_key が変わる）
+
+    def _user(self, i):
+        uid = 100000 + (i * 7919) % self.users
+        return uid, f"user{uid}"
+
+    def comments(self, now):
+        total = int((now - self.started_at) * self.comment_rate)
+        out = []
+        for i in range(total - 1, max(-1, total - 1 - self.window), -1):
+            uid, name = self._user(i)
+            out.append({
+                "created_at": int(self.started_at + i / self.comment_rate),
+                "user_id": uid, "name": name, "comment": f"コメント{i} 🎉",
+                "avatar_url": f"https://static.showroom-live.com/image/avatar/{i % 50}.png",
+            })
+        return out
+
+    def gifts(self, now):
+        total = int((now - self.started_at) * self.gift_rate)
+        out = []
+        for i in range(total - 1, max(-1, total - 1 - self.window), -1):
+            uid, name = self._user(i * 31)
+            gift = PAID_GIFTS[i % len(PAID_GIFTS)]
+            out.append({
+                "created_at": int(self.started_at + i / self.gift_rate),
+                "user_id": uid, "name": name, "gift_id": gift["gift_id"],
+                "num": 1 + i % 10, "avatar_id": i % 50, "image": "",
+            })
+        return out
+
+
+class FakeShowroomAPI:
+    def __init__(self, rooms, ws_host, host="127.0.0.1", port=0,
+                 comment_rate=2.0, gift_rate=0.5, users=2000, fans=300):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        now = time.time()
+        self.feeds = {int(r): RoomFeed(r, now - 60, comment_rate, gift_rate, users) for r in rooms}
+        self.live = set(self.feeds)
+        self.ws_host = ws_host
+        self.fans = fans
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with api._lock:
+                    api.counts[url.path] += 1
+                body = api.route(url.path, qs)
+                if body is None:
+                    self.send_error(404)
+                    return
+                data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv" if isinstance(body, bytes) else "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+
+    def route(self, path, qs):
+        now = time.time()
+        room_id = int(qs.get("room_id", 0) or 0)
+        feed = self.feeds.get(room_id)
+        if path == "/api/live/onlives":
+            lives = [{"room_id": r, "started_at": int(self.feeds[r].started_at)} for r in sorted(self.live)]
+            return {"onlives": [{"genre_id": 0, "lives": lives}]}
+        if path == "/room_list.csv":
+            return ("\n".join(str(r) for r in sorted(self.feeds)) + "\n").encode("utf-8")
+        if feed is None:
+            return {}
+        if path == "/api/live/comment_log":
+            return {"comment_log": feed.comments(now)}
+        if path == "/api/live/gift_log":
+            return {"gift_log": feed.gifts(now)}
+        if path == "/api/live/gift_list":
+            return {"normal": [dict(g, image="") for g in FREE_GIFTS + PAID_GIFTS]}
+        if path == "/api/active_fan/users":
+            offset, limit = int(qs.get("offset", 0)), int(qs.get("limit", 50))
+            users = [
+                {"rank": i + 1, "level": max(1, 60 - i // 5), "user_name": f"fan{i}", "point": 10000 - i, "user_id": 500000 + i}
+                for i in range(offset, min(offset + limit, self.fans))
+            ]
+            return {"total_user_count": self.fans, "users": users}
+        if path == "/api/live/live_info":
+            if room_id not in self.live:
+                return {}
+            return {"bcsvr_host": self.ws_host, "bcsvr_key": self.broadcast_key(room_id), "live_id": int(feed.started_at)}
+        if path == "/api/room/profile":
+            return {"room_name": f"テストルーム{room_id}", "room_url_key": f"test_{room_id}"}
+        return None
+
+    def broadcast_key(self, room_id):
+        """配信回ごとに変わる bcsvr_key（最初の配信回は key-<room_id>）"""
+        feed = self.feeds[int(room_id)]
+        return f"key-{room_id}-{feed.restarts}" if feed.restarts else f"key-{room_id}"
+
+    def restart(self, room_id):
+        """配信の再開（started_at・live_id・bcsvr_key が変わる）。以前のキーを返す"""
+        feed = self.feeds[int(room_id)]
+        old_key = self.broadcast_key(room_id)
+        feed.restarts += 1
+        feed.started_at = time.time()
+        return old_key
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# --- WebSocket (RFC 6455) の最小実装 ---
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_frame(payload, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        header += bytes([n])
+    elif n < 65536:
+        header += bytes([126]) + struct.pack("!H", n)
+    else:
+        header += bytes([127]) + struct.pack("!Q", n)
+    return header + payload
+
+
+def _ws_read_frame(sock_file):
+    head = sock_file.read(2)
+    if len(head) < 2:
+        return None, None
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    n = head[1] & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", sock_file.read(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", sock_file.read(8))[0]
+    mask = sock_file.read(4) if masked else b""
+    payload = bytearray(sock_file.read(n))
+    if masked:
+        for i in range(len(payload)):
+            payload[i] ^= mask[i % 4]
+    return opcode, bytes(payload)
+
+
+def synthetic_frames(key, users=2000):
+    """無償ギフト (t=2) とシステムMSG (t=18) を交互に含む MSG フレームを無限に生成する"""
+    i = 0
+    while True:
+        uid = 100000 + (i * 104729) % users
+        if i % 10 == 9:
+            templates = ("{name}さんが{n}回目の訪問をしました", "{name}さんが初訪問しました", "{name}さんがフォローしました",
+                         "{name}さんのファンレベルが{level}になりました")
+            text = templates[(i // 10) % len(templates)].format(name=f"user{uid}", n=i % 30 + 3, level=i % 10 + 1)
+            body = {"t": 18, "u": uid, "m": text, "created_at": int(time.time())}
+        else:
+            gift = FREE_GIFTS[i % len(FREE_GIFTS)]
+            body = {"t": 2, "u": uid, "ac": f"user{uid}", "av": i % 50, "g": gift["gift_id"], "n": 10, "created_at": int(time.time())}
+        yield f"MSG\t{key}\t{json.dumps(body, ensure_ascii=False)}"
+        i += 1
+
+
+def recorded_frames(path):
+    """
+    記録ファイルを繰り返し返す。受信機の記録 (*.frames.gz、frame_recording 形式) のほか、
+    1行1フレームの生テキスト、{"frame": ...} の JSON Lines も読める
+    """
+    if path.endswith(".gz"):
+        from frame_recording import read_frames
+        while True:
+            for _, frame in read_frames(path):
+                yield frame
+    while True:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    line = json.loads(line).get("frame", "")
+                yield line
+
+
+class FakeBroadcastServer:
+    def __init__(self, host="127.0.0.1", port=0, rate=20.0, frames_path=None):
+        self.rate = rate
+        self.frames_path = frames_path
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.retired_keys = set()  # 配信の再開で使われなくなったキー（購読していてもフレームは届かない）
+        broadcast = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                broadcast._serve(self.connection, self.rfile)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host = f"{host}:{self.server.server_address[1]}"
+
+    def _serve(self, conn, rfile):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return
+            request += chunk
+        headers = {}
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key", "") + _WS_GUID).encode()).digest()).decode()
+        conn.sendall(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+        )
+        self.connections += 1
+        send_lock = threading.Lock()
+        closed = threading.Event()
+        subscribed = {}
+
+        def reader():
+            try:
+                while not closed.is_set():
+                    opcode, payload = _ws_read_frame(rfile)
+                    if opcode is None or opcode == 0x8:
+                        break
+                    if opcode == 0x9:
+                        with send_lock:
+                            conn.sendall(_ws_frame(payload, 0xA))
+                    elif opcode == 0x1 and payload.startswith(b"SUB\t"):
+                        subscribed["key"] = payload.decode("utf-8").split("\t", 1)[1]
+            except OSError:
+                pass
+            closed.set()
+
+        threading.Thread(target=reader, daemon=True).start()
+        while "key" not in subscribed and not closed.is_set():
+            time.sleep(0.01)
+        if closed.is_set():
+            return
+        frames = recorded_frames(self.frames_path) if self.frames_path else synthetic_frames(subscribed["key"])
+        interval = 1.0 / self.rate if self.rate > 0 else 0
+        next_at = time.perf_counter()
+        try:
+            for frame in frames:
+                if closed.is_set():
+                    break
+                if subscribed["key"] in self.retired_keys:
+                    time.sleep(0.05)
+                    continue
+                data = _ws_frame(frame.encode("utf-8"))
+                with send_lock:
+                    conn.sendall(data)
+                self.frames_sent += 1
+                self.bytes_sent += len(data)
+                if interval:
+                    next_at += interval
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        except OSError:
+            pass
+        closed.set()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# --- FTP の最小実装（ftplib の login / cwd / storbinary / retrlines("LIST") / delete / quit 用） ---
+class FakeFTPServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.files = {}
+        self.upload_bytes = 0
+        self.upload_count = 0
+        self.commands = Counter()
+        self._lock = threading.Lock()
+        ftp = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                ftp._serve(self.connection, self.rfile, host)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = host, self.server.server_address[1]
+
+    def _serve(self, conn, rfile, host):
+        def reply(text):
+            conn.sendall((text + "\r\n").encode("utf-8"))
+
+        reply("220 fake ftp ready")
+        pasv = None
+        while True:
+            line = rfile.readline()
+            if not line:
+                break
+            cmd, _, arg = line.decode("utf-8").strip().partition(" ")
+            cmd = cmd.upper()
+            with self._lock:
+                self.commands[cmd] += 1
+            if cmd == "USER":
+                reply("331 password please")
+            elif cmd == "PASS":
+                reply("230 logged in")
+            elif cmd in ("CWD", "TYPE"):
+                reply("250 ok" if cmd == "CWD" else "200 ok")
+            elif cmd == "PASV":
+                pasv = socket.socket()
+                pasv.bind((host, 0))
+                pasv.listen(1)
+                p = pasv.getsockname()[1]
+                reply(f"227 Entering Passive Mode ({host.replace('.', ',')},{p >> 8},{p & 0xFF})")
+            elif cmd == "STOR" and pasv:
+                reply("150 ok to send")
+                data_conn, _ = pasv.accept()
+                chunks = []
+                while True:
+                    chunk = data_conn.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                data_conn.close()
+                pasv.close()
+                pasv = None
+                body = b"".join(chunks)
+                with self._lock:
+                    self.files[arg] = body
+                    self.upload_bytes += len(body)
+                    self.upload_count += 1
+                reply("226 transfer complete")
+            elif cmd == "LIST" and pasv:
+                reply("150 here comes the listing")
+                data_conn, _ = pasv.accept()
+                with self._lock:
+                    listing = "".join(
+                        f"-rw-r--r-- 1 owner group {len(b)} Jan 01 00:00 {name}\r\n" for name, b in self.files.items()
+                    )
+                data_conn.sendall(listing.encode("utf-8"))
+                data_conn.close()
+                pasv.close()
+                pasv = None
+                reply("226 transfer complete")
+            elif cmd == "DELE":
+                with self._lock:
+                    self.files.pop(arg, None)
+                reply("250 deleted")
+            elif cmd == "QUIT":
+                reply("221 bye")
+                break
+            else:
+                reply("502 not implemented")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", default="1001")
+    parser.add_argument("--ws-rate", type=float, default=20.0, help="1接続あたりの送信フレーム数/秒 (0 で最大速度)")
+    parser.add_argument("--frames", help="再生する記録ファイル")
+    args = parser.parse_args()
+    ws = FakeBroadcastServer(rate=args.ws_rate, frames_path=args.frames).start()
+    api = FakeShowroomAPI(args.rooms.split(","), ws_host=ws.host).start()
+    ftp = FakeFTPServer().start()
+    print(f"SRLOG_SHOWROOM_API_BASE={api.base_url}/api")
+    print(f"SRLOG_ROOM_LIST_URL={api.base_url}/room_list.csv")
+    print("SRLOG_BROADCAST_WS_URL=ws://{host}/")
+    print(f"ftp: {ftp.host}:{ftp.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
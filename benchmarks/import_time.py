@@ -0,0 +1,115 @@
+"""
+認証画面（初回表示）までに読み込まれるモジュールの import 時間を計測する。
+
+    python benchmarks/import_time.py            # 初回表示分（app.py の認証ステップまで）
+    python benchmarks/import_time.py --full     # 認証後に読み込むモジュールも含めた場合と比較
+
+対象のモジュールは app.py のトップレベルの import を認証ステップの前後で分けて求める（一覧を手で保守しない）。
+python -X importtime の出力を集計し、累積時間の大きい順に表示する。
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_PATH = os.path.join(ROOT, "app.py")
+# app.py 以外のモジュールが関数内で遅延インポートするもの（受信開始時に読み込む）
+OTHER_DEFERRED_IMPORTS = ["websocket"]
+# 初回表示で読み込まれてはいけないモジュール
+MUST_NOT_LOAD = ["pandas", "websocket", "sqlite3", "ftplib", "http.server"]
+
+
+def _imported_modules(node):
+    if isinstance(node, ast.Import):
+        return [alias.name for alias in node.names]
+    if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+        return [node.module]
+    return []
+
+
+def _calls_st_stop(node):
+    return any(
+        isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute) and n.func.attr == "stop"
+        and isinstance(n.func.value, ast.Name) and n.func.value.id == "st"
+        for n in ast.walk(node)
+    )
+
+
+def app_imports():
+    """
+    app.py の import を (初回表示で読み込むもの, 認証後に読み込むもの) に分けて返す。
+    st.stop() を含む最初のトップレベルの if（認証ステップ）より前のトップレベルの import が前者、
+    それより後のトップレベルの import と関数内の import が後者
+    """
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), APP_PATH)
+    first_paint, deferred = [], []
+    gate_passed = False
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            (deferred if gate_passed else first_paint).extend(_imported_modules(node))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for inner in ast.walk(node):
+                deferred.extend(_imported_modules(inner))
+        elif isinstance(node, ast.If) and not gate_passed and _calls_st_stop(node):
+            gate_passed = True
+    if not gate_passed:
+        sys.exit("app.py に認証ステップ (st.stop() を含む if) が見つかりません")
+    return first_paint, [m for m in deferred if m not in first_paint]
+
+
+def measure(modules, repeat):
+    code = "import sys\n" + "\n".join(f"import {m}" for m in modules) + \
+        "\nprint(','.join(sorted(m for m in sys.modules)))"
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            sys.exit(proc.stderr.strip().splitlines()[-1])
+        rows = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            # 形式: "import time:  self_us | cumulative_us | name"（ネストは name の先頭スペースで表される）
+            self_part, cumulative_part, name = line.split("|", 2)
+            rows.append((int(cumulative_part), int(self_part.split(":", 1)[1]), name[1:]))
+        total = sum(r[1] for r in rows)
+        if best is None or total < best[0]:
+            best = (total, rows, set(proc.stdout.strip().split(",")))
+    return best
+
+
+def report(label, modules, repeat, top):
+    total, rows, loaded = measure(modules, repeat)
+    print(f"== {label}: {total / 1000:.1f} ms (self 合計, best of {repeat}), {len(loaded)} modules")
+    top_level = sorted((r for r in rows if not r[2].startswith(" ")), reverse=True)[:top]
+    for cumulative_us, _, name in top_level:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="認証後に読み込むモジュールを含めた場合も計測する")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    first_paint, deferred = app_imports()
+    loaded = report("first paint", first_paint, args.repeat, args.top)
+    leaked = [m for m in MUST_NOT_LOAD if m in loaded]
+    if leaked:
+        print(f"!! 初回表示で重いモジュールが読み込まれています: {', '.join(leaked)}")
+    if args.full:
+        report("first paint + deferred", first_paint + deferred + OTHER_DEFERRED_IMPORTS, args.repeat, args.top)
+    sys.exit(1 if leaked else 0)
+
+
+if __name__ == "__main__":
+    main()
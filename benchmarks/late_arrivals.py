@@ -0,0 +1,53 @@
+"""
+EventLog に遅れて届いたイベントの並びを確認する。メモリ予算を小さくしてディスクへ退避させながら時刻順に追加し、
+一定の割合で過去（退避済みの分より古いものを含む）のイベントを混ぜる。
+
+    python benchmarks/late_arrivals.py
+    python benchmarks/late_arrivals.py --events 200000 --late-ratio 0.05
+
+反復の結果が created_at の新しい順に並び、件数が一致することを確認する（違っていれば終了コード 1）。
+追加と全件の反復にかかった時間も表示する。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_log import EventLog  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--late-ratio", type=float, default=0.02, help="遅れて届くイベントの割合")
+    parser.add_argument("--budget-kb", type=int, default=256, help="EventLog のメモリ予算")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    log = EventLog("late_arrivals", memory_budget_bytes=args.budget_kb * 1024)
+    t0 = 1700000000
+    t = time.perf_counter()
+    for i in range(args.events):
+        ts = t0 + i
+        if i and rng.random() < args.late_ratio:
+            # 直近の遅れと、退避済みの分まで遡る遅れを半々にする
+            ts = t0 + (rng.randrange(max(1, i - 50), i) if rng.random() < 0.5 else rng.randrange(i))
+        log.add({"created_at": ts, "user_id": i, "comment": f"event{i}"})
+    add_sec = time.perf_counter() - t
+
+    t = time.perf_counter()
+    keys = [entry["created_at"] for entry in log]
+    iter_sec = time.perf_counter() - t
+    ordered = all(a >= b for a, b in zip(keys, keys[1:]))
+    complete = len(keys) == len(log) == args.events
+    print(f"events={args.events} spilled={log.spilled_count} add={add_sec:.2f}s iter={iter_sec:.2f}s "
+          f"並び={'OK' if ordered else 'NG'} 件数={'OK' if complete else 'NG'}")
+    log.clear()
+    return 0 if ordered and complete else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+ローカルの代替サーバー (benchmarks/fakes.py) に対して app.py を複数セッション同時に動かす負荷試験。
+
+    python benchmarks/loadtest.py --rooms 3 --viewers 4 --iterations 20
+    python benchmarks/loadtest.py --rooms 10 --viewers 1 --ws-rate 200 --json result.json
+
+各セッションは streamlit.testing.v1.AppTest で実行する（ブラウザ不要）。
+認証済みの状態でルームIDを入力してトラッキングを開始し、自動更新1回分の再実行を --iterations 回繰り返す。
+再実行の所要時間 (p50/p95/max)・CPU 時間・RSS・代替サーバーへのリクエスト数・FTP アップロード量を表示する。
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeBroadcastServer, FakeFTPServer, FakeShowroomAPI  # noqa: E402
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_viewer(room_ids, ftp, iterations, interval, latencies, errors):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.secrets["ftp"] = {"host": ftp.host, "port": ftp.port, "user": "loadtest", "password": "loadtest"}
+    at.session_state["authenticated"] = True
+    at.run()
+    at.text_input(key="target_room_id_input").input(",".join(room_ids))
+    at.button(key="start_button").click()
+    at.run()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        at.run()
+        latencies.append(time.perf_counter() - t0)
+        if at.exception:
+            errors.append(str(at.exception[0].value))
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=1, help="ルーム数")
+    parser.add_argument("--viewers", type=int, default=1, help="1ルームあたりの同時セッション数")
+    parser.add_argument("--rooms-per-session", type=int, default=1, help="1セッションでトラッキングするルーム数")
+    parser.add_argument("--iterations", type=int, default=10, help="1セッションあたりの再実行回数")
+    parser.add_argument("--interval", type=float, default=0.0, help="再実行の間隔（秒）")
+    parser.add_argument("--comment-rate", type=float, default=2.0, help="1ルームあたりのコメント数/秒")
+    parser.add_argument("--gift-rate", type=float, default=0.5, help="1ルームあたりの有償ギフト数/秒")
+    parser.add_argument("--ws-rate", type=float, default=20.0, help="1接続あたりの配信サーバーフレーム数/秒 (0 で最大速度)")
+    parser.add_argument("--frames", help="配信サーバーが再生する記録ファイル")
+    parser.add_argument("--json", help="結果を JSON で書き出すパス")
+    args = parser.parse_args()
+
+    room_ids = [str(1001 + i) for i in range(args.rooms)]
+    ws = FakeBroadcastServer(rate=args.ws_rate, frames_path=args.frames).start()
+    api = FakeShowroomAPI(room_ids, ws_host=ws.host, comment_rate=args.comment_rate, gift_rate=args.gift_rate).start()
+    ftp = FakeFTPServer().start()
+
+    # app.py / free_gift_handler.py / auth_registry.py / log_archive.py は import 時に読むため、AppTest の実行前に設定する
+    os.environ["SRLOG_SHOWROOM_API_BASE"] = f"{api.base_url}/api"
+    os.environ["SRLOG_ROOM_LIST_URL"] = f"{api.base_url}/room_list.csv"
+    os.environ["SRLOG_BROADCAST_WS_URL"] = "ws://{host}/"
+    # 認証用ルームリストのキャッシュとアーカイブは一時ディレクトリへ書き、本番のファイルを汚さない（終了時に削除する）
+    scratch_dir = tempfile.mkdtemp(prefix="srlog_loadtest_")
+    atexit.register(shutil.rmtree, scratch_dir, ignore_errors=True)
+    os.environ["SRLOG_ROOM_LIST_CACHE_PATH"] = os.path.join(scratch_dir, "room_list_cache.csv")
+    os.environ["SRLOG_ARCHIVE_DB_PATH"] = os.path.join(scratch_dir, "srlog_archive.sqlite3")
+
+    sessions = []
+    step = max(1, args.rooms_per_session)
+    for start in range(0, len(room_ids), step):
+        for _ in range(args.viewers):
+            sessions.append(room_ids[start:start + step])
+
+    latencies, errors = [], []
+    cpu0, wall0, rss0 = time.process_time(), time.perf_counter(), rss_mb()
+    threads = [
+        threading.Thread(target=run_viewer, args=(rooms, ftp, args.iterations, args.interval, latencies, errors))
+        for rooms in sessions
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall0
+
+    result = {
+        "sessions": len(sessions),
+        "rooms": args.rooms,
+        "reruns": len(latencies),
+        "wall_sec": round(wall, 3),
+        "cpu_sec": round(time.process_time() - cpu0, 3),
+        "rerun_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95": round(percentile(latencies, 0.95) * 1000, 1),
+            "max": round(max(latencies, default=0.0) * 1000, 1),
+            "mean": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        },
+        "rss_mb": {"start": round(rss0, 1), "end": round(rss_mb(), 1)},
+        "api_requests": dict(api.counts),
+        "ws": {"connections": ws.connections, "frames_sent": ws.frames_sent, "bytes_sent": ws.bytes_sent},
+        "ftp": {"uploads": ftp.upload_count, "upload_bytes": ftp.upload_bytes},
+        "errors": errors[:20],
+    }
+
+    print(f"sessions={result['sessions']} rooms={result['rooms']} reruns={result['reruns']} "
+          f"wall={result['wall_sec']}s cpu={result['cpu_sec']}s")
+    print("rerun ms: " + " ".join(f"{k}={v}" for k, v in result["rerun_ms"].items()))
+    print(f"rss MB: {result['rss_mb']['start']} -> {result['rss_mb']['end']}")
+    for path, n in sorted(result["api_requests"].items()):
+        print(f"  {n:>7}  GET {path}")
+    print(f"ws: {result['ws']}")
+    print(f"ftp: {result['ftp']}")
+    if errors:
+        print(f"errors ({len(errors)}): {errors[0]}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    ws.stop()
+    api.stop()
+    ftp.stop()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+「👤 ユーザー単位で集計 (総貢献Pt順)」表の作成時間を、以前の iterrows 版と gift_tables.build_user_ranking で比較する。
+
+    python benchmarks/ranking.py                  # 1万・10万行
+    python benchmarks/ranking.py --rows 1000000   # 行数を指定
+
+両者の出力が同じであることも確認する（違っていれば終了コード 1）。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gift_tables import build_user_ranking  # noqa: E402
+
+
+def legacy_user_ranking(df):
+    """置き換え前の app.py の実装（比較用にそのまま残す）"""
+    f_u_df = df.copy()
+    f_u_df['line_pt'] = pd.to_numeric(f_u_df['num']) * pd.to_numeric(f_u_df['point'])
+    latest_f_names = f_u_df.sort_values('created_at').groupby('user_id')['name'].last()
+    f_u_agg = f_u_df.groupby(['user_id', 'gift_name', 'point'], as_index=False).agg({'num': 'sum', 'line_pt': 'sum'})
+    f_u_total = f_u_agg.groupby('user_id')['line_pt'].sum().rename('総Pt')
+    f_u_merged = f_u_agg.merge(f_u_total, on='user_id').sort_values(['総Pt', 'user_id', 'line_pt'], ascending=[False, True, False], kind='mergesort')
+
+    f_u_rows = []
+    prev_f_id = None
+    for _, r in f_u_merged.iterrows():
+        f_u_rows.append({
+            'ユーザー名': latest_f_names[r['user_id']] if r['user_id'] != prev_f_id else '',
+            'ギフト名': r['gift_name'], '合計個数': r['num'], 'ポイント': r['point'],
+            'ギフト単位Pt': int(r['line_pt']), '総貢献Pt（※単純合計値）': int(r['総Pt']) if r['user_id'] != prev_f_id else ''
+        })
+        prev_f_id = r['user_id']
+    return pd.DataFrame(f_u_rows)
+
+
+def make_gift_log(rows, users, gifts, seed=0):
+    rng = np.random.default_rng(seed)
+    gift_ids = rng.integers(0, gifts, rows)
+    user_ids = rng.zipf(1.3, rows) % users + 100000
+    return pd.DataFrame({
+        'created_at': 1700000000 + np.sort(rng.integers(0, 4 * 3600, rows)),
+        'user_id': user_ids,
+        'name': [f"user{u}" for u in user_ids],
+        'gift_name': [f"gift{g}" for g in gift_ids],
+        'num': rng.integers(1, 11, rows),
+        'point': (gift_ids % 5 + 1) * 10,
+    })
+
+
+def best_of(func, df, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = func(df)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="*", default=[10000, 100000])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--gifts", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    ok = True
+    print(f"{'rows':>9} {'out rows':>9} {'iterrows':>10} {'vectorized':>11} {'speed-up':>9}")
+    for rows in args.rows:
+        df = make_gift_log(rows, args.users, args.gifts)
+        legacy_sec, legacy = best_of(legacy_user_ranking, df, args.repeat)
+        new_sec, new = best_of(build_user_ranking, df, args.repeat)
+        same = legacy.astype(str).reset_index(drop=True).equals(new.astype(str).reset_index(drop=True))
+        ok = ok and same
+        print(f"{rows:>9} {len(new):>9} {legacy_sec * 1000:>8.1f}ms {new_sec * 1000:>9.1f}ms {legacy_sec / new_sec:>8.1f}x"
+              + ("" if same else "  OUTPUT MISMATCH"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+受信機の記録ファイル (*.frames.gz) をオフラインで再生し、デコード〜ログ取り込みの処理量を計測する。
+
+    # 記録（本番で SRLOG_RECORD_DIR を設定して受信するか、合成フレームで作る）
+    python benchmarks/replay.py make sample.frames.gz --frames 200000 --rate 500
+    # 最大速度で再生して処理量を計測
+    python benchmarks/replay.py run sample.frames.gz
+    # 記録時の10倍速で再生（バースト時の取りこぼし・キュー滞留の再現用）
+    python benchmarks/replay.py run sample.frames.gz --speed 10 --drain-interval 1
+
+FreeGiftReceiver.on_message → 受信キュー → app.py の取り込み処理と同じ変換 → FreeGiftCoalescer → EventLog
+の経路を通し、段階ごとの所要時間と frames/s を表示する。
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from event_log import EventLog  # noqa: E402
+from fakes import FREE_GIFTS, synthetic_frames  # noqa: E402
+from frame_recording import FrameRecorder, read_header  # noqa: E402
+from free_gift_handler import FreeGiftCoalescer, FreeGiftReceiver  # noqa: E402
+from system_messages import classified  # noqa: E402
+
+FREE_GIFT_MASTER = {str(g["gift_id"]): {"name": g["gift_name"], "image": "", "point": 1} for g in FREE_GIFTS}
+
+
+def make_recording(path, frames, rate):
+    """合成フレームを rate frames/s 相当の時刻で記録したファイルを作る"""
+    recorder = FrameRecorder(path, room_id="replay")
+    for i, frame in zip(range(frames), synthetic_frames("replay")):
+        recorder.write(frame, offset_sec=i / rate)
+    recorder.close()
+    print(f"wrote {frames} frames to {path} ({os.path.getsize(path) / 1024:.0f} KiB)")
+
+
+def ingest(receiver, system_msg_log, free_gift_log, coalescer):
+    """app.py の「キューからデータを取り出してログに変換」と同じ処理。取り込んだ件数を返す"""
+    n = 0
+    queue = receiver.my_queue
+    while not queue.empty():
+        raw_data = queue.get_nowait()
+        m_type = str(raw_data.get("t", ""))
+        if m_type == "18":
+            system_msg_log.add(classified({
+                "created_at": raw_data.get("created_at") or int(time.time()),
+                "message": raw_data.get("m", ""),
+                "user_id": raw_data.get("u"),
+                "kind": raw_data.get("kind"),
+                "visit_count": raw_data.get("visit_count"),
+                "fan_level": raw_data.get("fan_level"),
+            }))
+        elif m_type == "2":
+            gift_info = FREE_GIFT_MASTER.get(str(raw_data.get("g")))
+            if not gift_info:
+                continue
+            coalescer.add({
+                "created_at": raw_data.get("created_at") or int(time.time()),
+                "user_id": raw_data.get("u"),
+                "name": raw_data.get("ac"),
+                "avatar_id": raw_data.get("av"),
+                "gift_id": str(raw_data.get("g")),
+                "gift_name": gift_info.get("name"),
+                "point": gift_info.get("point", 1),
+                "num": raw_data.get("n", 1),
+                "image": gift_info.get("image", ""),
+            }, free_gift_log)
+        n += 1
+    return n
+
+
+def run_replay(path, speed, drain_interval, coalesce_sec):
+    header = read_header(path)
+    receiver = FreeGiftReceiver(room_id=header.get("room_id") or "replay", host=None, key=None,
+                                replay_path=path, replay_speed=speed)
+    system_msg_log = EventLog("system_msg_log", 256 * 1024 * 1024)
+    free_gift_log = EventLog("free_gift_log", 256 * 1024 * 1024)
+    coalescer = FreeGiftCoalescer(coalesce_sec)
+
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    ingest_sec = 0.0
+    ingested = 0
+    max_depth = 0
+    if speed > 0:
+        # 実時間で再生しながら、アプリの自動更新と同じように一定間隔でキューを取り出す
+        thread = threading.Thread(target=receiver.run, daemon=True)
+        thread.start()
+        while thread.is_alive() or not receiver.my_queue.empty():
+            time.sleep(drain_interval)
+            max_depth = max(max_depth, receiver.my_queue.qsize())
+            t = time.perf_counter()
+            ingested += ingest(receiver, system_msg_log, free_gift_log, coalescer)
+            ingest_sec += time.perf_counter() - t
+        decode_sec = time.perf_counter() - t0 - ingest_sec
+    else:
+        receiver.run()
+        decode_sec = time.perf_counter() - t0
+        max_depth = receiver.my_queue.qsize()
+        t = time.perf_counter()
+        ingested = ingest(receiver, system_msg_log, free_gift_log, coalescer)
+        ingest_sec = time.perf_counter() - t
+    wall = time.perf_counter() - t0
+    receiver.my_queue.close()
+
+    frames = receiver.frames_total
+    return {
+        "recording": os.path.basename(path),
+        "speed": speed,
+        "frames": frames,
+        "ingested": ingested,
+        "parse_errors": receiver.parse_errors,
+        "queue_max_depth": max_depth,
+        "queue_dropped": receiver.my_queue.dropped,
+        "queue_spilled": receiver.my_queue.spilled,
+        "free_gift_rows": len(free_gift_log),
+        "system_msg_rows": len(system_msg_log),
+        "wall_sec": round(wall, 3),
+        "cpu_sec": round(time.process_time() - cpu0, 3),
+        "decode_sec": round(decode_sec, 3),
+        "ingest_sec": round(ingest_sec, 3),
+        "frames_per_sec": round(frames / wall, 1) if wall else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    make = sub.add_parser("make", help="合成フレームで記録ファイルを作る")
+    make.add_argument("path")
+    make.add_argument("--frames", type=int, default=100000)
+    make.add_argument("--rate", type=float, default=200.0, help="記録上の frames/s")
+    run = sub.add_parser("run", help="記録ファイルを再生して計測する")
+    run.add_argument("path")
+    run.add_argument("--speed", type=float, default=0.0, help="再生速度（1.0=等速、0 で最大速度）")
+    run.add_argument("--drain-interval", type=float, default=10.0, help="キューを取り出す間隔（秒、speed>0 の場合）")
+    run.add_argument("--coalesce-sec", type=float, default=10.0, help="無償ギフトの合算ウィンドウ（秒）")
+    run.add_argument("--json", help="結果を JSON で書き出すパス")
+    args = parser.parse_args()
+
+    if args.command == "make":
+        make_recording(args.path, args.frames, args.rate)
+        return 0
+    result = run_replay(args.path, args.speed, args.drain_interval, args.coalesce_sec)
+    for k, v in result.items():
+        print(f"{k:>16}: {v}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
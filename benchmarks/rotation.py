@@ -0,0 +1,108 @@
+"""
+配信の再開（bcsvr_key の変更）に受信機が追従できるかを、ローカルの代替サーバー (fakes.py) で確認する。
+
+    python benchmarks/rotation.py
+    python benchmarks/rotation.py --silence-sec 3
+
+1. onlives の started_at が変わる場合: 同じ配信サーバーのまま新しいキーへ SUB し直す
+2. onlives が変わらず無受信が続く場合: 無受信の検知で live_info を取り直し、別の配信サーバーへ接続し直す
+それぞれ、再開から検知までの時間・切り替えの所要時間 (rekey latency)・欠落区間の長さと、切り替え後にフレームが
+再び届いたかを表示する（届かなければ終了コード 1）。比較用に、確認を行わない場合に届いたフレーム数も表示する。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeBroadcastServer, FakeShowroomAPI  # noqa: E402
+
+ROOM_ID = 1001
+
+
+def wait_for_frames(receiver, timeout=5.0):
+    """受信機にフレームが届き始めるまで待ち、待った秒数を返す（届かなければ None）"""
+    start = receiver.frames_total
+    t = time.perf_counter()
+    while time.perf_counter() - t < timeout:
+        if receiver.frames_total > start:
+            return time.perf_counter() - t
+        time.sleep(0.01)
+    return None
+
+
+def onlive(api):
+    return {"room_id": ROOM_ID, "started_at": int(api.feeds[ROOM_ID].started_at)}
+
+
+def restart(api, servers):
+    time.sleep(1.1)  # started_at（秒単位）を前回と変えるため
+    old_key = api.restart(ROOM_ID)
+    for server in servers:
+        server.retired_keys.add(old_key)
+    return time.time()
+
+
+def report(label, detected_after, receiver, gap, resumed):
+    gap_sec = gap[1] - gap[0] if gap else None
+    print(f"{label:<16} 検知={detected_after:>5.2f}s rekey={receiver.last_rekey_latency_sec or 0:>6.3f}s "
+          f"欠落区間={gap_sec or 0:>5.1f}s 受信再開={'OK' if resumed is not None else 'NG'}")
+    return resumed is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--silence-sec", type=float, default=2.0, help="無受信とみなすまでの秒数（本番は SRLOG_BROADCAST_SILENCE_SEC）")
+    args = parser.parse_args()
+
+    ws = FakeBroadcastServer(rate=50).start()
+    ws2 = FakeBroadcastServer(rate=50).start()
+    api = FakeShowroomAPI([ROOM_ID], ws_host=ws.host).start()
+    os.environ["SRLOG_SHOWROOM_API_BASE"] = f"{api.base_url}/api"
+    os.environ["SRLOG_BROADCAST_WS_URL"] = "ws://{host}/"
+    os.environ["SRLOG_BROADCAST_SILENCE_SEC"] = str(args.silence_sec)
+    import free_gift_handler  # 接続先の環境変数を設定してから読み込む
+    from free_gift_handler import FreeGiftReceiver, check_broadcast_session, get_streaming_server_info
+
+    # 比較: 確認を行わない受信機は、再開後はフレームを受け取れない
+    info = get_streaming_server_info(ROOM_ID)
+    unwatched = FreeGiftReceiver(ROOM_ID, info["host"], info["key"])
+    unwatched.start()
+    wait_for_frames(unwatched)
+
+    receiver = FreeGiftReceiver(ROOM_ID, info["host"], info["key"])
+    receiver.start()
+    wait_for_frames(receiver)
+    check_broadcast_session(receiver, onlive(api))  # 最初の確認で配信回を記録する
+
+    ok = True
+    # 1. onlives の started_at の変化で検知（同じ配信サーバー）
+    restarted_at = restart(api, (ws, ws2))
+    frames_before = unwatched.frames_total
+    gap = check_broadcast_session(receiver, onlive(api))
+    ok &= report("started_at の変化", time.time() - restarted_at, receiver, gap, wait_for_frames(receiver))
+
+    # 2. 無受信で検知（onlives は古い配信回のまま。別の配信サーバーへ接続し直す）
+    stale = onlive(api)
+    api.ws_host = ws2.host
+    restarted_at = restart(api, (ws, ws2))
+    gap = None
+    while gap is None and time.time() - restarted_at < args.silence_sec * 5:
+        time.sleep(0.1)
+        gap = check_broadcast_session(receiver, stale)
+    ok &= report("無受信", time.time() - restarted_at, receiver, gap, wait_for_frames(receiver))
+
+    time.sleep(0.5)
+    print(f"確認なしの受信機: 再開後に届いたフレーム={unwatched.frames_total - frames_before}  "
+          f"切り替えた受信機: rekey={receiver.rekey_count}回 reconnect={receiver.reconnect_count}回 "
+          f"(SRLOG_BROADCAST_SILENCE_SEC={free_gift_handler.BROADCAST_SILENCE_SEC:g})")
+    for r in (unwatched, receiver):
+        r.stop()
+    print("OK" if ok else "NG: 切り替え後にフレームが届いていません")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
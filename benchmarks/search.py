@@ -0,0 +1,120 @@
+"""
+コメント検索 (comment_search.CommentSearchIndex) の索引作成時間・メモリ・検索時間を計測する。
+
+    python benchmarks/search.py                 # 10万件
+    python benchmarks/search.py --comments 300000
+    python benchmarks/search.py --budget-kb 65536   # 本文をほぼ退避させない場合
+
+検索結果が単純な全件走査と一致すること、各検索の p95 が目標 (--target-ms, 既定 10ms) 以内であることを確認する
+（どちらかを満たさなければ終了コード 1）。
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comment_search import DEFAULT_MEMORY_BUDGET_BYTES, SEARCH_RESULT_LIMIT, CommentSearchIndex  # noqa: E402
+
+WORDS = [
+    "こんばんは", "かわいい", "ありがとう", "おつかれさま", "初見です", "わこつ", "888", "草", "すごい", "おめでとう",
+    "歌って", "たのしい", "また来ます", "星投げ", "カウント", "ナイス", "えらい", "おやすみ", "待ってた", "Good",
+    "最高", "神回", "好き", "応援してます", "天才", "やばい", "声きれい", "笑", "大好き", "きた",
+]
+REPEAT = 50
+
+
+def make_comments(n, users, seed=0):
+    rng = random.Random(seed)
+    t0 = 1700000000
+    return [
+        {
+            "created_at": t0 + i * 4 * 3600 // n,
+            "user_id": 100000 + rng.randrange(users),
+            # 一部のユーザー名は数字だけ（ユーザーIDと同じ入力欄で名前として探せるか確認する）
+            "name": str(rng.randrange(10000)) if i % 100 == 0 else f"user{rng.randrange(users)}",
+            "comment": "".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))),
+        }
+        for i in range(n)
+    ]
+
+
+def brute_force(comments, text, user, since, until):
+    text = text.lower()
+    hits = []
+    for c in reversed(comments):
+        if since is not None and c["created_at"] < since:
+            continue
+        if until is not None and c["created_at"] > until:
+            continue
+        if user and str(c["user_id"]) != user and user not in c["name"]:
+            continue
+        if text and text not in c["comment"].lower():
+            continue
+        hits.append(c)
+        if len(hits) >= SEARCH_RESULT_LIMIT:
+            break
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--target-ms", type=float, default=10.0, help="1回の検索 (p95) の目標時間")
+    parser.add_argument("--budget-kb", type=int, default=DEFAULT_MEMORY_BUDGET_BYTES // 1024, help="本文をメモリに置く上限")
+    args = parser.parse_args()
+
+    comments = make_comments(args.comments, args.users)
+    t = time.perf_counter()
+    index = CommentSearchIndex(memory_budget_bytes=args.budget_kb * 1024)
+    index.add_many(comments)
+    build_sec = time.perf_counter() - t
+    # tracemalloc を有効にすると索引作成が数倍遅くなるため、メモリは別に作り直して測る
+    tracemalloc.start()
+    measured = CommentSearchIndex(memory_budget_bytes=args.budget_kb * 1024)
+    measured.add_many(comments)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del measured
+    gc.collect()
+    print(f"comments={len(comments)} build={build_sec:.2f}s ({build_sec / len(comments) * 1e6:.1f}us/件) index≈{mem / 1024 / 1024:.1f}MiB "
+          f"(索引の推定 {index.memory_bytes / 1024 / 1024:.1f}MiB, 本文の退避 {index.spilled_count} 件)")
+
+    t_mid = comments[len(comments) // 2]["created_at"]
+    queries = [
+        ("草", None, None, None), ("おめでとう", None, None, None), ("神回", None, None, None),
+        ("声きれい", None, None, None), ("存在しない", None, None, None), ("good", None, None, None),
+        ("かわいいありがとう", None, None, None), ("", str(comments[0]["user_id"]), None, None),
+        ("好き", str(comments[10]["user_id"]), None, None), ("", comments[0]["name"], None, None),
+        ("", "user12", None, None), ("888", None, t_mid, t_mid + 600),
+    ]
+    ok = True
+    print(f"{'query':<22} {'hits':>5} {'p50':>8} {'p95':>8} {'max':>8}")
+    for text, user, since, until in queries:
+        times = []
+        for _ in range(REPEAT):
+            t = time.perf_counter()
+            hits = index.search(text, user=user, since=since, until=until)
+            times.append(time.perf_counter() - t)
+        times.sort()
+        p95_ms = times[int(len(times) * 0.95) - 1] * 1000
+        expected = brute_force(comments, text, user, since, until)
+        same = sorted((h["created_at"], h["comment"]) for h in hits) == sorted((h["created_at"], h["comment"]) for h in expected)
+        fast = p95_ms <= args.target_ms
+        ok = ok and same and fast
+        label = text or f"user={user}"
+        if since is not None:
+            label += " +10分"
+        print(f"{label:<22} {len(hits):>5} {statistics.median(times) * 1000:>6.2f}ms {p95_ms:>6.2f}ms {times[-1] * 1000:>6.2f}ms"
+              + ("" if same else "  MISMATCH") + ("" if fast else f"  SLOW (>{args.target_ms:g}ms)"))
+    print("OK" if ok else "NG")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
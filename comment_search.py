@@ -0,0 +1,274 @@
+import mmap
+import os
+import sys
+import threading
+import uuid
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+
+from event_log import SEGMENT_DIR
+
+# --- コメントの全文検索（文字 bi-gram の転置索引） ---
+# 取り込み時に add() で追加していく。日本語は単語区切りがないため、文字単位の bi-gram で候補を絞り、
+# 最後に部分文字列として含まれるかを確かめる。1文字の検索語は 1-gram の索引を使う。
+# 索引の推定サイズ（posting・時刻・ユーザーなど＋メモリ上の本文）をメモリ予算と比べ、超えたら EventLog と同じく
+# 古い本文からセグメントファイルへ退避して、検索時に必要な分だけ読む。posting などは件数に比例して残る
+SEARCH_RESULT_LIMIT = 500
+DEFAULT_MEMORY_BUDGET_BYTES = 4 * 1024 * 1024
+# posting などが予算の大半を占めても、直近の本文はこのバイト数まではメモリに置く
+MIN_HOT_TEXT_BYTES = 256 * 1024
+# 本文1件あたりのリストの要素・参照のおおよそのオーバーヘッド
+_TEXT_OVERHEAD_BYTES = 16
+# 1件あたりの時刻・ユーザーID・ユーザー名の番号・退避位置と、posting の1要素のバイト数
+_DOC_BYTES = 8 + 8 + 4 + 8
+_POSTING_ENTRY_BYTES = 4
+
+
+def _grams(text):
+    """text に含まれる 1-gram と 2-gram（重複なし）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CommentSearchIndex:
+    def __init__(self, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES):
+        # 文書 (コメント) は追加順の連番 doc_id で管理する
+        self.memory_budget_bytes = memory_budget_bytes
+        self._times = array("q")
+        self._user_ids = []
+        self._doc_names = array("I")  # doc_id ごとのユーザー名の番号
+        self._names = []              # ユーザー名（番号順）
+        self._name_ids = {}           # {ユーザー名: 番号}
+        self._texts = []              # メモリ上の本文（doc_id が _hot_start 以降）
+        self._lowered = []            # 検索用に小文字にした本文（変わらない場合は _texts と同じオブジェクト）
+        self._text_bytes = 0
+        self._posting_entries = 0
+        self._hot_start = 0
+        self._offsets = array("Q")    # 退避した本文のファイル上の位置（doc_id が _hot_start より前。末尾はファイルの終端）
+        self._segment_path = None
+        self._postings = {}           # {gram: array('I') 昇順の doc_id}
+        self._by_user = {}            # {user_id: array('I')}
+        self._by_name = {}            # {ユーザー名の番号: array('I')}
+        self._time_range = None       # (最古, 最新) の created_at
+        self._times_sorted = True     # created_at が doc_id 順に並んでいれば、期間指定を doc_id の範囲に直せる
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._times)
+
+    @property
+    def memory_bytes(self):
+        """索引の推定サイズ（メモリ予算と比べる値）"""
+        return self._fixed_bytes() + self._text_bytes
+
+    def _fixed_bytes(self):
+        """本文以外（退避できない部分）の推定サイズ"""
+        return len(self._times) * _DOC_BYTES + self._posting_entries * _POSTING_ENTRY_BYTES
+
+    @property
+    def spilled_count(self):
+        return self._hot_start
+
+    def add(self, entry):
+        """コメント1件 (created_at, user_id, name, comment) を索引に追加する"""
+        text = str(entry.get("comment", "") or "")
+        user_id = entry.get("user_id")
+        name = entry.get("name", "") or ""
+        with self._lock:
+            doc_id = len(self._times)
+            ts = int(entry.get("created_at", 0) or 0)
+            if self._times_sorted and self._times and ts < self._times[-1]:
+                self._times_sorted = False
+            self._times.append(ts)
+            if self._time_range is None:
+                self._time_range = (ts, ts)
+            elif not self._time_range[0] <= ts <= self._time_range[1]:
+                self._time_range = (min(ts, self._time_range[0]), max(ts, self._time_range[1]))
+            self._user_ids.append(user_id)
+            name_id = self._name_ids.get(name)
+            if name_id is None:
+                name_id = self._name_ids[name] = len(self._names)
+                self._names.append(name)
+            self._doc_names.append(name_id)
+            lowered = text.lower()
+            if lowered == text:
+                lowered = text
+            self._texts.append(text)
+            self._lowered.append(lowered)
+            self._text_bytes += sys.getsizeof(text) + (0 if lowered is text else sys.getsizeof(lowered)) + _TEXT_OVERHEAD_BYTES
+            grams = _grams(lowered)
+            for gram in grams:
+                self._append(self._postings, gram, doc_id)
+            self._append(self._by_user, user_id, doc_id)
+            self._append(self._by_name, name_id, doc_id)
+            self._posting_entries += len(grams) + 2
+            if self._text_bytes > self._text_budget():
+                self._spill_texts()
+
+    @staticmethod
+    def _append(postings, key, doc_id):
+        posting = postings.get(key)
+        if posting is None:
+            posting = postings[key] = array("I")
+        posting.append(doc_id)
+
+    def time_range(self):
+        """(最古, 最新) の created_at。空なら None"""
+        return self._time_range
+
+    def add_many(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    # --- 本文の退避 ---
+    def _text_budget(self):
+        """本文に使えるバイト数: 予算から本文以外の推定サイズを引いた残り（最低 MIN_HOT_TEXT_BYTES）"""
+        return max(self.memory_budget_bytes - self._fixed_bytes(), MIN_HOT_TEXT_BYTES)
+
+    def _spill_texts(self):
+        """本文に使える予算の半分になるまで、古い本文をセグメントファイルへ退避する"""
+        target = self._text_budget() // 2
+        n = freed = 0
+        while n < len(self._texts) - 1 and self._text_bytes - freed > target:
+            text, lowered = self._texts[n], self._lowered[n]
+            freed += sys.getsizeof(text) + (0 if lowered is text else sys.getsizeof(lowered)) + _TEXT_OVERHEAD_BYTES
+            n += 1
+        if not n:
+            return
+        if self._segment_path is None:
+            os.makedirs(SEGMENT_DIR, exist_ok=True)
+            self._segment_path = os.path.join(SEGMENT_DIR, f"comment_search_{uuid.uuid4().hex}.txt")
+            # 索引が破棄されたらファイルも消す
+            weakref.finalize(self, _remove_file, self._segment_path)
+        data = [text.encode("utf-8") for text in self._texts[:n]]
+        with open(self._segment_path, "ab") as f:
+            if not self._offsets:
+                self._offsets.append(f.tell())
+            offset = self._offsets[-1]
+            for encoded in data:
+                offset += len(encoded)
+                self._offsets.append(offset)
+            f.write(b"".join(data))
+        del self._texts[:n]
+        del self._lowered[:n]
+        self._text_bytes -= freed
+        self._hot_start += n
+
+    def _map_segment(self):
+        """退避済みの本文のファイルを読み取り専用で割り当てる（退避した本文がなければ None）"""
+        if not self._offsets or self._offsets[-1] == self._offsets[0]:
+            return None
+        with open(self._segment_path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _text(self, doc_id, segment):
+        """(本文, 小文字にした本文)。退避済みなら segment (_map_segment() の戻り値) から読む"""
+        if doc_id >= self._hot_start:
+            i = doc_id - self._hot_start
+            return self._texts[i], self._lowered[i]
+        start, end = self._offsets[doc_id], self._offsets[doc_id + 1]
+        text = segment[start:end].decode("utf-8") if end > start else ""
+        return text, text.lower()
+
+    # --- 検索 ---
+    def _user_posting(self, user):
+        """user（ユーザーID、またはユーザー名の部分一致）に当たる doc_id の posting。数字だけでも名前との一致を含める"""
+        postings = [self._by_name[name_id] for name_id, name in enumerate(self._names) if user in name]
+        if user.isdigit():
+            by_id = self._by_user.get(int(user)) or self._by_user.get(user)
+            if by_id:
+                postings.append(by_id)
+        if len(postings) == 1:
+            return postings[0]
+        return array("I", sorted({doc_id for posting in postings for doc_id in posting}))
+
+    def _postings_for(self, query, user):
+        """絞り込みに使う posting のリスト。None は「全件」、空リストを含む場合は該当なし"""
+        postings = []
+        if query:
+            grams = [query] if len(query) == 1 else {query[i:i + 2] for i in range(len(query) - 1)}
+            # 3文字以上は最後に部分文字列として確かめるため、全ての bi-gram の posting を二分探索するより、
+            # 最も少ない2つで絞って（退避済みの本文を読む回数を減らして）確かめる方が速い
+            postings.extend(sorted((self._postings.get(gram, ()) for gram in grams), key=len)[:2])
+        if user:
+            postings.append(self._user_posting(user))
+        return postings or None
+
+    def _doc_range(self, since, until):
+        """期間に当たりうる doc_id の範囲 [lo, hi)。created_at が追加順に並んでいなければ全件"""
+        lo, hi = 0, len(self._times)
+        if self._times_sorted:
+            if since is not None:
+                lo = bisect_left(self._times, since)
+            if until is not None:
+                hi = bisect_right(self._times, until)
+        return lo, hi
+
+    @staticmethod
+    def _newest_first(postings, lo, hi):
+        """
+        全ての posting に含まれる [lo, hi) の doc_id を大きい順（≒新しい順）に1つずつ返す。
+        最も短い posting を基準に、他の posting は前回見つけた位置より手前だけを二分探索する
+        """
+        postings = sorted(postings, key=len)
+        smallest, rest = postings[0], postings[1:]
+        bounds = [len(p) for p in rest]
+        for i in range(bisect_left(smallest, hi) - 1, bisect_left(smallest, lo) - 1, -1):
+            doc_id = smallest[i]
+            for j, posting in enumerate(rest):
+                k = bisect_left(posting, doc_id, 0, bounds[j])
+                found = k < bounds[j] and posting[k] == doc_id
+                bounds[j] = k
+                if not found:
+                    if k == 0:
+                        return  # この posting にはこれより小さい doc_id が無い
+                    break
+            else:
+                yield doc_id
+
+    def search(self, text="", user=None, since=None, until=None, limit=SEARCH_RESULT_LIMIT):
+        """
+        コメント本文に text を含み（大文字小文字は区別しない）、user（ユーザーID、またはユーザー名の部分一致）、
+        since <= created_at <= until を満たすものを新しい順に最大 limit 件返す。
+        戻り値は [{"created_at", "user_id", "name", "comment"}]。
+        """
+        query = (text or "").strip().lower()
+        user = (str(user).strip() if user is not None else "")
+        with self._lock:
+            postings = self._postings_for(query, user)
+            lo, hi = self._doc_range(since, until)
+            doc_ids = range(hi - 1, lo - 1, -1) if postings is None else self._newest_first(postings, lo, hi)
+
+            results = []
+            segment = self._map_segment()
+            try:
+                for doc_id in doc_ids:
+                    ts = self._times[doc_id]
+                    if since is not None and ts < since:
+                        continue
+                    if until is not None and ts > until:
+                        continue
+                    comment, lowered = self._text(doc_id, segment)
+                    if query and len(query) > 2 and query not in lowered:
+                        continue  # 最も少ない bi-gram は含むが、検索語そのものは含まない
+                    results.append({
+                        "created_at": ts, "user_id": self._user_ids[doc_id],
+                        "name": self._names[self._doc_names[doc_id]], "comment": comment,
+                    })
+                    if len(results) >= limit:
+                        break
+            finally:
+                if segment is not None:
+                    segment.close()
+        # 取り込みはポーリング単位で時刻順なので、doc_id の逆順はほぼ新しい順。最後に時刻で整える
+        results.sort(key=lambda r: r["created_at"], reverse=True)
+        return results
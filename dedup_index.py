@@ -0,0 +1,75 @@
+from array import array
+from hashlib import blake2b
+
+# --- ポーリングで取り込むログ（コメント・有償ギフト）の重複判定 ---
+# (created_at, user_id, 内容) を 64bit の指紋にして、配列ベースのハッシュ集合（開番地法）に入れておく。
+# 集合はルームの状態としてポーリングをまたいで保持する（毎回ログから作り直さない）。
+# 以前の (created_at, name) では、同じ秒に同じ表示名の別ユーザーの行や、同じユーザーの同じ秒の2件目が落ちていた
+_EMPTY = 0
+_MIN_SLOTS = 1024
+
+
+def fingerprint(created_at, user_id, payload):
+    """(created_at, user_id, payload) の 64bit 指紋（0 は空きスロットの印なので使わない）"""
+    digest = blake2b(f"{created_at}\x1f{user_id}\x1f{payload}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def log_fingerprint(log_type, log):
+    """ポーリングで届いたログ1件の指紋。コメントは本文、有償ギフトはギフトIDと個数を内容とする"""
+    if log_type == "comment":
+        payload = log.get('comment', '')
+    else:
+        payload = f"{log.get('gift_id')}\x1f{log.get('num')}"
+    return fingerprint(log.get('created_at'), log.get('user_id'), payload)
+
+
+class FingerprintSet:
+    """64bit 指紋の集合。array('Q') の線形探索ハッシュ表で、埋まりが半分を超えたら倍に広げる"""
+
+    def __init__(self, capacity=0):
+        size = _MIN_SLOTS
+        while size < capacity * 2:
+            size *= 2
+        self._slots = array("Q", bytes(8 * size))
+        self._mask = size - 1
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def nbytes(self):
+        return self._slots.itemsize * len(self._slots)
+
+    def _find(self, fp):
+        """fp が入っているスロット、なければ入れるべき空きスロットの位置"""
+        slots, mask = self._slots, self._mask
+        i = fp & mask
+        while True:
+            value = slots[i]
+            if value == fp or value == _EMPTY:
+                return i
+            i = (i + 1) & mask
+
+    def __contains__(self, fp):
+        return self._slots[self._find(fp)] == fp
+
+    def add(self, fp):
+        """fp を追加する。新しく追加した場合は True、既にあった場合は False"""
+        i = self._find(fp)
+        if self._slots[i] == fp:
+            return False
+        self._slots[i] = fp
+        self._len += 1
+        if self._len * 2 > len(self._slots):
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self._slots
+        self._slots = array("Q", bytes(8 * len(old) * 2))
+        self._mask = len(self._slots) - 1
+        for fp in old:
+            if fp != _EMPTY:
+                self._slots[self._find(fp)] = fp
@@ -0,0 +1,209 @@
+import heapq
+import json
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+from bisect import bisect_right
+from collections import deque
+
+# --- セッションごとのログを「メモリ上のホット領域＋ディスク上のセグメント」で保持する ---
+# 長時間配信でもメモリ使用量を予算内に抑えつつ、イテレータ経由で全履歴を参照できる
+SEGMENT_DIR = os.path.join(tempfile.gettempdir(), "srlog_segments")
+
+DEFAULT_MEMORY_BUDGET_BYTES = 4 * 1024 * 1024
+# 重複排除などで参照する直近分は、予算に関わらず最低この件数をメモリに残す
+MIN_HOT_ENTRIES = 1000
+# メモリ上のチャンク1つあたりの件数（退避・遅延挿入の単位）
+CHUNK_SIZE = 256
+# 1件あたりの辞書・文字列オブジェクトのおおよそのオーバーヘッド
+_ENTRY_OVERHEAD_BYTES = 240
+
+
+def _estimate_size(entry):
+    return _ENTRY_OVERHEAD_BYTES + sum(len(str(k)) + len(str(v)) for k, v in entry.items())
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class EventLog:
+    """
+    created_at 順に並んだイベントログ。反復は新しい順（従来のリストと同じ並び）。
+    メモリ上はソート済みチャンクの deque で持ち、時間順の追加は O(1)、順不同で届いた分は該当チャンクへ挿入する。
+    メモリ上の件数が予算を超えると、古いチャンクからセグメントファイル (JSON Lines) へ退避する。
+    退避済みの分より古いイベントが遅れて届いた場合は、別のソート済みリストに持ち、反復時に合流させる。
+    """
+
+    def __init__(self, name, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES, key="created_at"):
+        self.name = name
+        self.memory_budget_bytes = memory_budget_bytes
+        self.key = key
+        self._chunks = deque()    # 各チャンクは古い → 新しい の順のリスト
+        self._chunk_bytes = deque()
+        self._chunk_first_keys = deque()
+        self._hot_count = 0
+        self._hot_bytes = 0
+        self._segments = []       # [(offset, count)] 退避した順 = 古い順
+        self._spilled_count = 0
+        self._segment_path = None
+        self._spilled_last_key = None  # 退避済みの分で最も新しいキー
+        self._late = []           # 退避済みの分より古い遅延イベント（古い → 新しい の順）
+        self.version = 0          # 追加・変更・クリアのたびに増える（集計結果のキャッシュ判定用）
+        self.added_bytes = 0      # 追加したエントリーの推定サイズの累計（退避・クリアでは減らない。自動保存の判定用）
+        self._lock = threading.RLock()
+
+    # --- 追加 ---
+    def add(self, entry):
+        with self._lock:
+            k = self._sort_key(entry)
+            size = _estimate_size(entry)
+            chunks = self._chunks
+            if not chunks or (k >= self._sort_key(chunks[-1][-1]) and len(chunks[-1]) >= CHUNK_SIZE):
+                # 新しいチャンクを開始
+                chunks.append([entry])
+                self._chunk_bytes.append(size)
+                self._chunk_first_keys.append(k)
+            elif k >= self._sort_key(chunks[-1][-1]):
+                # 時間順の追加（通常ケース）: 末尾チャンクへ O(1)
+                chunks[-1].append(entry)
+                self._chunk_bytes[-1] += size
+            else:
+                self._merge_late(entry, k, size)
+            self._hot_count += 1
+            self._hot_bytes += size
+            self.added_bytes += size
+            self.version += 1
+            self._enforce_budget()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def touch(self):
+        """追加済みのエントリーをその場で書き換えた時に呼ぶ（無償ギフトの連打の合算など）"""
+        with self._lock:
+            self.version += 1
+
+    # --- 参照 ---
+    def __len__(self):
+        return self._hot_count + self._spilled_count
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        """全履歴を新しい順に返す（メモリ上 → ディスク上の順）"""
+        with self._lock:
+            chunks = list(self._chunks)
+            segments = list(self._segments)
+            path = self._segment_path
+            late = self._late[:]
+        entries = self._iter_ordered(chunks, segments, path)
+        if late:
+            entries = heapq.merge(entries, reversed(late), key=self._sort_key, reverse=True)
+        yield from entries
+
+    def _iter_ordered(self, chunks, segments, path):
+        for chunk in reversed(chunks):
+            yield from reversed(chunk[:])
+        for offset, count in reversed(segments):
+            yield from reversed(self._read_segment(path, offset, count))
+
+    def hot(self):
+        """メモリ上にある直近分のみを新しい順で返す"""
+        with self._lock:
+            return [entry for chunk in reversed(self._chunks) for entry in reversed(chunk)]
+
+    @property
+    def memory_bytes(self):
+        return self._hot_bytes
+
+    @property
+    def spilled_count(self):
+        return self._spilled_count
+
+    def clear(self):
+        with self._lock:
+            self._chunks, self._chunk_bytes, self._chunk_first_keys = deque(), deque(), deque()
+            self._hot_count, self._hot_bytes = 0, 0
+            self._segments, self._spilled_count = [], 0
+            self._spilled_last_key, self._late = None, []
+            self.version += 1
+            if self._segment_path:
+                _remove_file(self._segment_path)
+                self._segment_path = None
+
+    # --- 内部処理 ---
+    def _sort_key(self, entry):
+        return entry.get(self.key) or 0
+
+    def _merge_late(self, entry, k, size):
+        """順不同で届いたイベントを、該当するチャンクへ順序を保って挿入する"""
+        if self._spilled_last_key is not None and k < self._spilled_last_key:
+            # 退避済みの分より古い: セグメントは書き換えず、別のリストへ入れて反復時に合流させる
+            keys = [self._sort_key(e) for e in self._late]
+            self._late.insert(bisect_right(keys, k), entry)
+            return
+        # 遅延は直近のことが多いので末尾側から探す
+        i = len(self._chunks) - 1
+        while i > 0 and self._chunk_first_keys[i] > k:
+            i -= 1
+        chunk = self._chunks[i]
+        keys = [self._sort_key(e) for e in chunk]
+        chunk.insert(bisect_right(keys, k), entry)
+        self._chunk_first_keys[i] = self._sort_key(chunk[0])
+        self._chunk_bytes[i] += size
+        if len(chunk) >= CHUNK_SIZE * 2:
+            self._split_chunk(i)
+
+    def _split_chunk(self, i):
+        chunk = self._chunks[i]
+        head, tail = chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]
+        tail_bytes = sum(_estimate_size(e) for e in tail)
+        self._chunks[i] = head
+        self._chunk_bytes[i] -= tail_bytes
+        self._chunks.insert(i + 1, tail)
+        self._chunk_bytes.insert(i + 1, tail_bytes)
+        self._chunk_first_keys.insert(i + 1, self._sort_key(tail[0]))
+
+    def _enforce_budget(self):
+        if self._hot_bytes <= self.memory_budget_bytes or self._hot_count <= MIN_HOT_ENTRIES:
+            return
+        # 予算の半分まで古いチャンクから一気に退避して、退避の頻度を抑える
+        target = self.memory_budget_bytes // 2
+        while (
+            len(self._chunks) > 1
+            and self._hot_bytes > target
+            and self._hot_count - len(self._chunks[0]) >= MIN_HOT_ENTRIES
+        ):
+            self._spill_oldest_chunk()
+
+    def _spill_oldest_chunk(self):
+        if self._segment_path is None:
+            os.makedirs(SEGMENT_DIR, exist_ok=True)
+            self._segment_path = os.path.join(SEGMENT_DIR, f"{self.name}_{uuid.uuid4().hex}.jsonl")
+            # セッション終了で EventLog が破棄されたらファイルも消す
+            weakref.finalize(self, _remove_file, self._segment_path)
+        chunk = self._chunks.popleft()
+        freed = self._chunk_bytes.popleft()
+        self._chunk_first_keys.popleft()
+        with open(self._segment_path, "ab") as f:
+            offset = f.tell()
+            f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in chunk).encode("utf-8"))
+        self._segments.append((offset, len(chunk)))
+        self._spilled_last_key = self._sort_key(chunk[-1])
+        self._spilled_count += len(chunk)
+        self._hot_count -= len(chunk)
+        self._hot_bytes -= freed
+
+    @staticmethod
+    def _read_segment(path, offset, count):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return [json.loads(f.readline()) for _ in range(count)]
@@ -0,0 +1,214 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from gift_tables import build_user_ranking
+
+# --- 重い表の作成・CSV 出力をワーカープロセスで実行する ---
+# Streamlit は全セッションのスクリプトを1プロセスのスレッドで動かすため、大きなルームの DataFrame 集計や to_csv が
+# GIL を握っている間は他のセッションの画面更新が止まる。ログは必要な列だけのリスト（列指向）に詰めてワーカーへ渡し、
+# 結果を待つ間このプロセスは GIL を手放す。タブ用の結果はログの version ごとにキャッシュする
+# SRLOG_EXPORT_WORKERS=0 でワーカーを使わずにこのプロセスで実行する
+EXPORT_WORKERS = int(os.environ.get("SRLOG_EXPORT_WORKERS", "2"))
+JST_TZ = "Asia/Tokyo"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# ログごとにワーカーへ渡す列と、値がない場合の既定値
+PACK_COLUMNS = {
+    "comment": ("created_at", "user_id", "name", "comment"),
+    "gift": ("created_at", "user_id", "name", "gift_name", "num", "point", "line_pt"),
+    "free_gift": ("created_at", "last_created_at", "user_id", "name", "gift_name", "num", "point"),
+    "system_msg": ("created_at", "message", "user_id"),
+}
+_DEFAULTS = {"created_at": 0, "user_id": "", "name": "", "comment": "", "gift_name": "", "message": "",
+             "num": 0, "point": 0, "line_pt": 0}
+
+GIFT_TABLE_COLUMNS = ['ギフト時間', 'ユーザー名', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']
+GIFT_CSV_COLUMNS = ['ギフト時間', 'ユーザー名', 'ユーザーID', 'ギフト名', '個数', 'ポイント', '合計Pt（※単純合計値）']
+GIFT_SUMMARY_COLUMNS = ['最新ギフト時間', 'ユーザー名', 'ギフト名', '合計個数', 'ポイント', '合計Pt（※単純合計値）']
+
+
+def pack(kind, entries):
+    """ログ (EventLog など) を {列名: 値のリスト} に詰める。並びはログの反復順（新しい順）のまま"""
+    columns = PACK_COLUMNS[kind]
+    packed = {column: [] for column in columns}
+    appends = [(packed[column].append, column, _DEFAULTS.get(column)) for column in columns]
+    for entry in entries:
+        for append, column, default in appends:
+            value = entry.get(column)
+            append(default if value is None else value)
+    if "last_created_at" in packed:
+        packed["last_created_at"] = [last or created for last, created in zip(packed["last_created_at"], packed["created_at"])]
+    return packed
+
+
+# --- ワーカープロセス ---
+_executor = None
+_executor_lock = threading.Lock()
+worker_main_files = set()  # 起動したワーカーが読み込んだメインモジュール（空であるべき。benchmarks/export.py で確認する）
+
+
+@contextlib.contextmanager
+def _without_main_module():
+    """
+    spawn のワーカーは親の __main__ のファイルを __mp_main__ として読み込み直す。streamlit run では __main__ が app.py のため、
+    ワーカーを起動する間だけ __main__ を __file__ のない空のモジュールに差し替え、ワーカーが app.py を読み込まないようにする
+    """
+    main = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def _loaded_main():
+    """ワーカーで実行: 起動時に読み込まれたメインモジュールのファイル（読み込まれていなければ None）"""
+    return getattr(sys.modules.get("__mp_main__"), "__file__", None)
+
+
+def _pool():
+    global _executor
+    if EXPORT_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # Streamlit のスレッドを抱えたプロセスを fork しないよう spawn で起動する。
+            # ワーカーは submit の時に足りない分だけ起動されるため、__main__ を差し替えている間に全て起動しておく
+            with _without_main_module():
+                _executor = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                started = [_executor.submit(_loaded_main) for _ in range(EXPORT_WORKERS)]
+            try:
+                loaded = {future.result() for future in started} - {None}
+            except BrokenProcessPool:
+                _executor = None
+                return None
+            if loaded:
+                print(f"export_jobs: ワーカーがメインモジュールを読み込みました: {', '.join(sorted(loaded))}")
+            worker_main_files.update(loaded)
+        return _executor
+
+
+def run(fn, *args):
+    """fn(*args) をワーカープロセスで実行して結果を返す（ワーカーが使えなければこのプロセスで実行する）"""
+    global _executor
+    pool = _pool()
+    if pool is None:
+        return fn(*args)
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        with _executor_lock:
+            if _executor is pool:
+                _executor = None
+        return fn(*args)
+
+
+def cached(cache, name, version, fn, make_args):
+    """cache ({name: (version, 結果)}) に同じ version の結果があればそれを、なければ run(fn, *make_args()) の結果を返す"""
+    hit = cache.get(name)
+    if hit is not None and hit[0] == version:
+        return hit[1]
+    result = run(fn, *make_args())
+    cache[name] = (version, result)
+    return result
+
+
+# --- 以下はワーカープロセスで実行する（引数・戻り値は pickle できるもののみ） ---
+def _jst_text(seconds):
+    return pd.to_datetime(seconds, unit='s').dt.tz_localize('UTC').dt.tz_convert(JST_TZ).dt.strftime(TIME_FORMAT)
+
+
+def _to_csv(df):
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding='utf-8-sig')
+    return buf.getvalue()
+
+
+def _comments_df(packed, exclude_keywords):
+    df = pd.DataFrame(packed, columns=PACK_COLUMNS["comment"])
+    if exclude_keywords and len(df):
+        pattern = "|".join(re.escape(keyword) for keyword in exclude_keywords)
+        is_system = df['name'].astype(str).str.contains(pattern) | df['comment'].astype(str).str.contains(pattern)
+        df = df[~is_system]
+    df['コメント時間'] = _jst_text(df['created_at'])
+    return df.rename(columns={'name': 'ユーザー名', 'comment': 'コメント内容', 'user_id': 'ユーザーID'})
+
+
+def log_csv(kind, packed, exclude_keywords=()):
+    """FTP 保存用の CSV (utf-8-sig のバイト列)。comment は exclude_keywords を含む運営コメントを除く。対象がなければ None"""
+    if kind == "comment":
+        df = _comments_df(packed, exclude_keywords)
+        columns = ['コメント時間', 'ユーザー名', 'コメント内容', 'ユーザーID']
+    elif kind in ("gift", "free_gift"):
+        df = pd.DataFrame(packed, columns=PACK_COLUMNS[kind])
+        df['ギフト時間'] = _jst_text(df['created_at'])
+        df = df.rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '個数', 'point': 'ポイント', 'user_id': 'ユーザーID'})
+        columns = ['ギフト時間', 'ユーザー名', 'ギフト名', '個数', 'ポイント', 'ユーザーID']
+    else:
+        df = pd.DataFrame(packed, columns=PACK_COLUMNS[kind])
+        df['時間'] = _jst_text(df['created_at'])
+        df = df.rename(columns={'message': 'メッセージ', 'user_id': 'ユーザーID'})
+        columns = ['時間', 'メッセージ', 'ユーザーID']
+    if not len(df):
+        return None
+    return _to_csv(df[columns])
+
+
+def comment_tab(packed, exclude_keywords):
+    """コメントタブの一覧表とダウンロード用 CSV。コメントがなければ None"""
+    df = _comments_df(packed, exclude_keywords)
+    if not len(df):
+        return None
+    return {
+        "table": df[['コメント時間', 'ユーザー名', 'コメント内容']].reset_index(drop=True),
+        "csv": _to_csv(df[['コメント時間', 'ユーザー名', 'ユーザーID', 'コメント内容']]),
+    }
+
+
+def _gift_tables(raw, time_col, latest_names):
+    """ギフト系タブの一覧表・CSV・ギフト単位合算・ユーザー単位集計。raw は created_at, user_id, name, gift_name, num, point, time_col 列を持つ"""
+    disp = raw.sort_values('created_at', ascending=False, kind='mergesort')
+    disp = disp.assign(**{
+        'ギフト時間': _jst_text(disp['created_at']),
+        '合計Pt（※単純合計値）': (pd.to_numeric(disp['num']) * pd.to_numeric(disp['point'])).astype(int),
+    }).rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '個数', 'point': 'ポイント', 'user_id': 'ユーザーID'})
+
+    summary = raw.groupby(['user_id', 'gift_name', 'point'], as_index=False).agg({'num': 'sum', time_col: 'max', 'name': 'last'})
+    summary['合計Pt（※単純合計値）'] = (summary['num'] * pd.to_numeric(summary['point'])).astype(int)
+    summary['最新ギフト時間'] = _jst_text(summary[time_col])
+    summary = summary.rename(columns={'name': 'ユーザー名', 'gift_name': 'ギフト名', 'num': '合計個数', 'point': 'ポイント'}) \
+        .sort_values('最新ギフト時間', ascending=False)
+
+    return {
+        "table": disp[GIFT_TABLE_COLUMNS].reset_index(drop=True),
+        "csv": _to_csv(disp[GIFT_CSV_COLUMNS]),
+        "summary": summary[GIFT_SUMMARY_COLUMNS].reset_index(drop=True),
+        "ranking": build_user_ranking(raw, latest_names=latest_names),
+    }
+
+
+def gift_tab(kind, packed, latest_names):
+    """スペシャルギフト (gift) / 無償ギフト (free_gift) タブの表。合算集計の最新時刻は無償ギフトでは連打の最後の時刻を使う"""
+    raw = pd.DataFrame(packed, columns=PACK_COLUMNS[kind])
+    return _gift_tables(raw, 'last_created_at' if kind == "free_gift" else 'created_at', latest_names)
+
+
+def combined_tab(gift_packed, free_packed, latest_names):
+    """スペシャル＆無償の統合タブの表。合算集計の最新時刻は、無償ギフトは gift_tab と同じく連打の最後の時刻を使う"""
+    columns = ['created_at', 'last_created_at', 'name', 'user_id', 'gift_name', 'num', 'point']
+    gift = pd.DataFrame(gift_packed, columns=PACK_COLUMNS["gift"])
+    raw = pd.concat([
+        gift.assign(last_created_at=gift['created_at'])[columns],
+        pd.DataFrame(free_packed, columns=PACK_COLUMNS["free_gift"])[columns],
+    ], ignore_index=True)
+    return _gift_tables(raw, 'last_created_at', latest_names)
@@ -0,0 +1,90 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+# --- 配信サーバーから受け取った生フレームの記録と再生 ---
+# 記録ファイルは gzip 圧縮のテキストで、1行目がヘッダー、2行目以降が
+#   <記録開始からの経過ミリ秒 (time.monotonic 基準)>\t<フレーム (JSON 文字列)>
+# の形式。再生時は同じ on_message へ 1倍速・N倍速・最大速度で流し直す
+RECORDING_FORMAT = "srlog-frames/1"
+# SRLOG_RECORD_DIR を指定すると、全受信機が受信したフレームをこのディレクトリへ記録する
+RECORD_DIR = os.environ.get("SRLOG_RECORD_DIR", "")
+
+
+def recording_path(record_dir, room_id):
+    return os.path.join(record_dir, f"room{room_id}_{time.strftime('%Y%m%d_%H%M%S')}.frames.gz")
+
+
+class FrameRecorder:
+    """受信スレッドから write(frame) を呼ぶ。close() まで gzip ストリームへ追記する"""
+
+    def __init__(self, path, room_id=None):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self.frames = 0
+        header = {"format": RECORDING_FORMAT, "room_id": str(room_id) if room_id is not None else None,
+                  "started_at": time.time()}
+        self._file.write(json.dumps(header) + "\n")
+
+    def write(self, frame, offset_sec=None):
+        """offset_sec を省略すると記録開始からの経過時間を使う（合成データを作る場合だけ指定する）"""
+        if offset_sec is None:
+            offset_sec = time.monotonic() - self._t0
+        offset_ms = int(offset_sec * 1000)
+        line = f"{offset_ms}\t{json.dumps(frame, ensure_ascii=False)}\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self.frames += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_header(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.loads(f.readline())
+
+
+def read_frames(path):
+    """(記録開始からの経過秒, フレーム) を記録順に返す"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != RECORDING_FORMAT:
+            raise ValueError(f"unknown recording format: {header.get('format')}")
+        for line in f:
+            offset_ms, _, frame = line.rstrip("\n").partition("\t")
+            yield int(offset_ms) / 1000, json.loads(frame)
+
+
+def replay(path, on_message, speed=1.0, stop_event=None):
+    """
+    記録ファイルのフレームを on_message(None, frame) へ流す。
+    speed=1.0 で記録時と同じ間隔、speed=N で N 倍速、speed<=0 で待たずに最大速度。
+    stop_event がセットされたら途中で止める。流したフレーム数を返す。
+    """
+    start = time.monotonic()
+    sent = 0
+    for offset_sec, frame in read_frames(path):
+        if stop_event is not None and stop_event.is_set():
+            break
+        if speed > 0:
+            delay = offset_sec / speed - (time.monotonic() - start)
+            if delay > 0:
+                if stop_event is not None:
+                    if stop_event.wait(delay):
+                        break
+                else:
+                    time.sleep(delay)
+        on_message(None, frame)
+        sent += 1
+    return sent
@@ -1,10 +1,131 @@
-import websocket
 import json
+import os
+import tempfile
 import threading
+import uuid
 import requests
 import queue
+import socket
 import time
+from collections import deque
 import streamlit as st
+from perf_metrics import set_gauge, count
+from frame_recording import RECORD_DIR, FrameRecorder, recording_path, replay
+from system_messages import classify_system_message
+
+# --- 受信キューの上限と、あふれた時の方針 ---
+# drop_oldest: 古いものから捨てる / coalesce: 同一ユーザー・同一ギフトの待機中フレームへ個数を合算（できなければ古いものを捨てる）
+# spill: あふれた分をディスク上のジャーナルへ退避し、取り出し時に順番どおり読み戻す
+RECEIVER_QUEUE_MAXSIZE = int(os.environ.get("SRLOG_RECEIVER_QUEUE_MAX", "20000"))
+RECEIVER_OVERFLOW_POLICY = os.environ.get("SRLOG_RECEIVER_OVERFLOW", "spill")
+# この時間キューが取り出されない受信機は、セッションが無くなったとみなして停止する
+RECEIVER_IDLE_TIMEOUT_SEC = int(os.environ.get("SRLOG_RECEIVER_IDLE_TIMEOUT_SEC", "1800"))
+# 負荷試験などでローカルの代替サーバーを使う場合は環境変数で接続先を差し替える
+SHOWROOM_API_BASE = os.environ.get("SRLOG_SHOWROOM_API_BASE", "https://www.showroom-live.com/api")
+BROADCAST_WS_URL = os.environ.get("SRLOG_BROADCAST_WS_URL", "wss://{host}:443/")
+# 配信中なのにこの時間フレームが届かない受信機は、配信が再開されてキーが変わった可能性があるため live_info を確認し直す
+BROADCAST_SILENCE_SEC = float(os.environ.get("SRLOG_BROADCAST_SILENCE_SEC", "120"))
+RECEIVER_JOURNAL_DIR = os.path.join(tempfile.gettempdir(), "srlog_journal")
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "spill")
+
+
+class BoundedEventQueue:
+    """queue.Queue 互換（put / get_nowait / empty / qsize）の上限付きキュー"""
+
+    def __init__(self, maxsize=RECEIVER_QUEUE_MAXSIZE, policy=RECEIVER_OVERFLOW_POLICY, name="queue"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self._items = deque()
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.coalesced = 0
+        self.spilled = 0
+        # spill 用ジャーナル（書き込み位置と読み出し位置）
+        self._journal_path = None
+        self._journal_read_offset = 0
+        self._journal_pending = 0
+
+    def put(self, item):
+        with self._lock:
+            if self._journal_pending:
+                # 退避中は順番を保つため、新しいものもジャーナルへ
+                self._spill(item)
+                return
+            if len(self._items) < self.maxsize:
+                self._items.append(item)
+                return
+            if self.policy == "spill":
+                self._spill(item)
+            elif self.policy == "coalesce" and self._coalesce(item):
+                self.coalesced += 1
+            else:
+                self._items.popleft()
+                self._items.append(item)
+                self.dropped += 1
+
+    def get_nowait(self):
+        with self._lock:
+            if not self._items and self._journal_pending:
+                self._load_from_journal()
+            if not self._items:
+                raise queue.Empty
+            return self._items.popleft()
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def qsize(self):
+        return len(self._items) + self._journal_pending
+
+    def close(self):
+        with self._lock:
+            self._items.clear()
+            if self._journal_path:
+                try:
+                    os.remove(self._journal_path)
+                except OSError:
+                    pass
+                self._journal_path = None
+            self._journal_pending = 0
+
+    def _coalesce(self, item):
+        """待機中の同じ (u, g) の無償ギフトへ個数を合算する（末尾から近いものだけ探す）"""
+        if str(item.get("t")) != "2":
+            return False
+        for i, queued in enumerate(reversed(self._items)):
+            if i >= 500:
+                break
+            if str(queued.get("t")) == "2" and queued.get("u") == item.get("u") and queued.get("g") == item.get("g"):
+                queued["n"] = queued.get("n", 1) + item.get("n", 1)
+                return True
+        return False
+
+    def _spill(self, item):
+        if self._journal_path is None:
+            os.makedirs(RECEIVER_JOURNAL_DIR, exist_ok=True)
+            self._journal_path = os.path.join(RECEIVER_JOURNAL_DIR, f"{self.name}_{uuid.uuid4().hex}.jsonl")
+            self._journal_read_offset = 0
+        with open(self._journal_path, "ab") as f:
+            f.write((json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._journal_pending += 1
+        self.spilled += 1
+
+    def _load_from_journal(self, batch=1000):
+        with open(self._journal_path, "rb") as f:
+            f.seek(self._journal_read_offset)
+            for _ in range(min(batch, self._journal_pending)):
+                self._items.append(json.loads(f.readline()))
+                self._journal_pending -= 1
+            self._journal_read_offset = f.tell()
+        if not self._journal_pending:
+            # 読み切ったらファイルを作り直す
+            os.remove(self._journal_path)
+            self._journal_path = None
+            self._journal_read_offset = 0
+
 
 # --- 修正の要：グローバルな gift_queue は使わず、セッションごとにキューを管理する ---
 # 各ブラウザタブのスレッドを管理するリスト
@@ -12,17 +133,55 @@ active_receivers = []
 receivers_lock = threading.Lock()
 
 class FreeGiftReceiver:
-    def __init__(self, room_id, host, key):
+    def __init__(self, room_id, host, key, record_path=None, replay_path=None, replay_speed=1.0):
         self.room_id = room_id
         self.host = host
         self.key = key
         self.ws = None
         self.thread = None
         self.is_running = False
-        # ★重要：このタブ専用のキューを作成
-        self.my_queue = queue.Queue()
+        # --- 生フレームの記録 (record_path) / 記録ファイルからの再生 (replay_path) ---
+        # SRLOG_RECORD_DIR が設定されていれば、指定がなくても記録する（再生時は記録しない）
+        if record_path is None and RECORD_DIR and not replay_path:
+            record_path = recording_path(RECORD_DIR, room_id)
+        self.record_path = record_path
+        self.recorder = None
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
+        self._stop_event = threading.Event()
+        # ★重要：このタブ専用のキューを作成（上限付き）
+        self.my_queue = BoundedEventQueue(name=f"room{room_id}")
+        # --- 受信状態のメトリクス ---
+        self.frames_total = 0
+        self.parse_errors = 0
+        self.reconnect_count = 0
+        self.connect_count = 0
+        self.last_message_at = None
+        self.last_error = None
+        self.last_drained_at = time.time()
+        self.reaped = False
+        self._frame_seconds = deque(maxlen=60)  # [(秒, フレーム数)] 直近60秒分
+        # --- 配信回の切り替わり（配信の再開で bcsvr_key が変わる）への追従 ---
+        self.live_session = None                # 購読中の配信回 (live_id / started_at)。最初の確認時に記録する
+        self.subscribed_at = time.time()        # 現在のキーで受信を始めた時刻
+        self.live_info_checked_at = time.time()
+        self.rekey_count = 0
+        self.last_rekey_latency_sec = None      # 切り替えを決めてから新しいキーで SUB するまで
+        self.last_gap_sec = None                # 直近の切り替えで受信できていなかった可能性のある区間の長さ
+        self._rekey_started_at = None
+        self._reconnect_now = threading.Event()
 
     def on_message(self, ws, message):
+        if self.recorder is not None:
+            self.recorder.write(message)
+        now = time.time()
+        self.frames_total += 1
+        self.last_message_at = now
+        sec = int(now)
+        if self._frame_seconds and self._frame_seconds[-1][0] == sec:
+            self._frame_seconds[-1][1] += 1
+        else:
+            self._frame_seconds.append([sec, 1])
         if message.startswith("MSG"):
             try:
                 parts = message.split("\t")
@@ -42,29 +201,83 @@ class FreeGiftReceiver:
                             data["m"] = raw_m.encode('latin-1').decode('utf-8')
                         except:
                             pass
+                        # 種別・訪問回数・ファンレベルはここで1回だけ取り出す
+                        data.update(classify_system_message(data.get("m", "")))
                     
                     # 以前のコードと同じく、データを専用の箱に入れる
                     self.my_queue.put(data)
 
             except Exception as e:
+                self.parse_errors += 1
+                self.last_error = f"parse: {e}"
                 print(f"WebSocket Message Error: {e}")
 
     def on_error(self, ws, error):
+        self.last_error = str(error)
         print(f"WebSocket Error: {error}")
 
     def on_close(self, ws, close_status_code, close_msg):
         print("WebSocket Closed")
 
     def on_open(self, ws):
+        self.connect_count += 1
+        if self.connect_count > 1:
+            self.reconnect_count += 1
         ws.send(f"SUB\t{self.key}")
         print(f"WebSocket Connected: Room {self.room_id}")
+        if self._rekey_started_at is not None:
+            self._resubscribed()
+
+    def rekey(self, host, key):
+        """
+        配信の再開で接続先 (bcsvr_host / bcsvr_key) が変わった時に購読を切り替える。
+        同じホストに接続中ならその接続のまま新しいキーで SUB し、そうでなければ待たずに接続し直す
+        """
+        same_host = host == self.host
+        self.host, self.key = host, key
+        self.rekey_count += 1
+        self.subscribed_at = time.time()
+        if self.replay_path or not self.is_running:
+            return
+        self._rekey_started_at = time.time()
+        ws = self.ws
+        if same_host and ws is not None and ws.sock is not None and ws.sock.connected:
+            try:
+                ws.send(f"SUB\t{key}")
+                self._resubscribed()
+                return
+            except Exception as e:
+                self.last_error = f"rekey: {e}"
+        self._reconnect_now.set()
+        if ws is not None:
+            # 無受信の接続は close() だけでは受信待ちが ping_timeout まで続くため、先にソケットを閉じて待ちを起こす
+            try:
+                ws.sock.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            ws.close()
+
+    def _resubscribed(self):
+        self.last_rekey_latency_sec = time.time() - self._rekey_started_at
+        self._rekey_started_at = None
+        set_gauge("srlog_receiver_rekey_latency_seconds", self.last_rekey_latency_sec, room=str(self.room_id))
+        print(f"WebSocket Re-subscribed ({self.last_rekey_latency_sec:.2f}s): Room {self.room_id}")
 
     def run(self):
-        ws_url = f"wss://{self.host}:443/"
+        if self.replay_path:
+            # 記録ファイルを受信時と同じ on_message へ流す（WebSocket には接続しない）
+            self.connect_count += 1
+            try:
+                replay(self.replay_path, self.on_message, self.replay_speed, self._stop_event)
+            except Exception as e:
+                self.last_error = f"replay: {e}"
+                print(f"Replay Error: {e}")
+            return
+        import websocket  # 受信スレッド開始時にだけ読み込む（アプリの初回表示を軽くするため）
         while self.is_running:
             try:
                 self.ws = websocket.WebSocketApp(
-                    ws_url,
+                    BROADCAST_WS_URL.format(host=self.host),  # 購読の切り替え (rekey) で接続先が変わることがある
                     on_message=self.on_message,
                     on_error=self.on_error,
                     on_close=self.on_close,
@@ -72,25 +285,129 @@ class FreeGiftReceiver:
                 )
                 self.ws.run_forever(ping_interval=30, ping_timeout=10)
             except Exception as e:
+                self.last_error = str(e)
                 print(f"WebSocket Run Error: {e}")
             
             if self.is_running:
-                time.sleep(5)
+                # 購読の切り替え (rekey) で閉じた場合は待たずに接続し直す
+                self._reconnect_now.wait(5)
+                self._reconnect_now.clear()
 
     def start(self):
         if not self.is_running:
             self.is_running = True
+            self.reaped = False
+            self.last_drained_at = time.time()
+            self._stop_event.clear()
+            if self.record_path and self.recorder is None:
+                self.recorder = FrameRecorder(self.record_path, room_id=self.room_id)
             with receivers_lock:
                 active_receivers.append(self)
+            _ensure_reaper()
             self.thread = threading.Thread(target=self.run, daemon=True)
             self.thread.start()
 
     def stop(self):
         self.is_running = False
+        self._stop_event.set()
+        self._reconnect_now.set()
         if self.ws:
             self.ws.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
         with receivers_lock:
-            if self: active_receivers.remove(self)
+            if self in active_receivers:
+                active_receivers.remove(self)
+
+    def mark_drained(self):
+        self.last_drained_at = time.time()
+
+    def frames_per_sec(self, window_sec=10):
+        """直近 window_sec 秒（現在の秒を除く）の平均受信フレーム数/秒"""
+        now_sec = int(time.time())
+        total = sum(n for sec, n in list(self._frame_seconds) if now_sec - window_sec <= sec < now_sec)
+        return total / window_sec
+
+    def health(self):
+        now = time.time()
+        return {
+            "room_id": str(self.room_id),
+            "running": self.is_running,
+            "reaped": self.reaped,
+            "frames_total": self.frames_total,
+            "frames_per_sec": round(self.frames_per_sec(), 2),
+            "queue_depth": self.my_queue.qsize(),
+            "queue_dropped": self.my_queue.dropped,
+            "queue_coalesced": self.my_queue.coalesced,
+            "queue_spilled": self.my_queue.spilled,
+            "reconnect_count": self.reconnect_count,
+            "rekey_count": self.rekey_count,
+            "last_rekey_latency_sec": round(self.last_rekey_latency_sec, 2) if self.last_rekey_latency_sec is not None else None,
+            "last_gap_sec": round(self.last_gap_sec, 1) if self.last_gap_sec is not None else None,
+            "parse_errors": self.parse_errors,
+            "recorded_frames": self.recorder.frames if self.recorder is not None else None,
+            "last_message_age_sec": round(now - self.last_message_at, 1) if self.last_message_at else None,
+            "idle_sec": round(now - self.last_drained_at, 1),
+            "last_error": self.last_error,
+        }
+
+
+def receivers_health():
+    """起動中の全受信機の状態（デバッグパネル・メトリクス用）"""
+    with receivers_lock:
+        receivers = list(active_receivers)
+    return [r.health() for r in receivers]
+
+
+def publish_receiver_metrics():
+    for h in receivers_health():
+        room = h["room_id"]
+        set_gauge("srlog_receiver_queue_depth", h["queue_depth"], room=room)
+        set_gauge("srlog_receiver_frames_per_second", h["frames_per_sec"], room=room)
+        set_gauge("srlog_receiver_frames_total", h["frames_total"], room=room)
+        set_gauge("srlog_receiver_reconnects_total", h["reconnect_count"], room=room)
+        set_gauge("srlog_receiver_parse_errors_total", h["parse_errors"], room=room)
+        set_gauge("srlog_receiver_queue_dropped_total", h["queue_dropped"], room=room)
+        if h["last_message_age_sec"] is not None:
+            set_gauge("srlog_receiver_last_message_age_seconds", h["last_message_age_sec"], room=room)
+
+
+# --- セッションが無くなった受信機の自動停止（プロセスで1つの監視スレッド） ---
+_reaper_thread = None
+_reaper_lock = threading.Lock()
+
+
+def reap_idle_receivers(timeout_sec=RECEIVER_IDLE_TIMEOUT_SEC):
+    """timeout_sec 以上キューが取り出されていない受信機を停止し、停止した数を返す"""
+    now = time.time()
+    with receivers_lock:
+        idle = [r for r in active_receivers if now - r.last_drained_at > timeout_sec]
+    for receiver in idle:
+        print(f"WebSocket Reaped (idle {now - receiver.last_drained_at:.0f}s): Room {receiver.room_id}")
+        receiver.reaped = True
+        receiver.stop()
+        receiver.my_queue.close()
+        count("srlog_receiver_reaped_total", room=str(receiver.room_id))
+    return len(idle)
+
+
+def _reaper_loop(interval_sec=30):
+    while True:
+        time.sleep(interval_sec)
+        try:
+            reap_idle_receivers()
+            publish_receiver_metrics()
+        except Exception as e:
+            print(f"Receiver Reaper Error: {e}")
+
+
+def _ensure_reaper():
+    global _reaper_thread
+    with _reaper_lock:
+        if _reaper_thread is None:
+            _reaper_thread = threading.Thread(target=_reaper_loop, daemon=True)
+            _reaper_thread.start()
 
 # --- 本体側の「gift_queue」という名前に対応するためのダミーオブジェクト ---
 # 本体側が「from free_gift_handler import gift_queue」していてもエラーにならないようにします
@@ -99,6 +416,8 @@ class QueueProxy:
         # 現在実行中のスレッド（セッション）に紐づくレシーバーのキューを確認
         receiver = st.session_state.get("ws_receiver")
         if receiver and hasattr(receiver, 'my_queue'):
+            # 取り出しに来ている＝セッションが生きている
+            receiver.mark_drained()
             return receiver.my_queue.empty()
         return True
 
@@ -111,29 +430,79 @@ class QueueProxy:
 # 本体側が「gift_queue」としてインポートして使うための実体
 gift_queue = QueueProxy()
 
-# --- 以下の関数は元のロジックと一文字一句変えていません ---
+# --- SHOWROOM API の呼び出しと配信回の確認 ---
+# get_streaming_server_info は配信の再開（bcsvr_key の変更）を検知できるよう live_id も返す
 
 def get_streaming_server_info(room_id):
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
     }
     try:
-        url = f"https://www.showroom-live.com/api/live/live_info?room_id={room_id}"
+        url = f"{SHOWROOM_API_BASE}/live/live_info?room_id={room_id}"
         res = requests.get(url, headers=headers, timeout=5).json()
         host = res.get("bcsvr_host")
         key = res.get("bcsvr_key")
         if host and key:
-            return {"host": host, "key": key}
+            return {"host": host, "key": key, "live_id": res.get("live_id")}
     except Exception as e:
         print(f"API Error (live_info): {e}")
     return None
 
+def live_session_id(onlive):
+    """onlives の1件から配信回の識別子（live_id、なければ started_at）を返す。取れなければ None"""
+    if not isinstance(onlive, dict):
+        return None
+    for info in (onlive, onlive.get("live_info")):
+        if isinstance(info, dict) and (info.get("live_id") or info.get("started_at")):
+            return info.get("live_id") or info.get("started_at")
+    return None
+
+
+def check_broadcast_session(receiver, onlive, now=None):
+    """
+    配信中のルームの受信機について、配信回の切り替わりを確認する。onlives の live_id / started_at が変わった、
+    または BROADCAST_SILENCE_SEC 以上フレームが届いていない場合に live_info を取り直し、キーが変わっていれば
+    receiver.rekey() で購読を切り替える。切り替えた場合は、無償ギフト・システムMSG を受信できていなかった可能性の
+    ある区間 (開始, 終了)（UNIX 秒）を返す。それ以外は None
+    """
+    now = now or time.time()
+    session = live_session_id(onlive)
+    if receiver.live_session is None:
+        receiver.live_session = session
+        return None
+    rotated = session is not None and session != receiver.live_session
+    silent = now - max(receiver.last_message_at or 0, receiver.subscribed_at) >= BROADCAST_SILENCE_SEC \
+        and now - receiver.live_info_checked_at >= BROADCAST_SILENCE_SEC
+    if not rotated and not silent:
+        return None
+
+    room = str(receiver.room_id)
+    receiver.live_info_checked_at = now
+    count("srlog_live_info_checks_total", room=room, reason="session" if rotated else "silence")
+    info = get_streaming_server_info(receiver.room_id)
+    if info is None:
+        return None
+    if session is not None:
+        receiver.live_session = session
+    if info["host"] == receiver.host and info["key"] == receiver.key:
+        return None
+
+    # 新しい配信回の開始時刻が分かればそこから、分からなければ最後にフレームが届いた時刻からを欠落区間とする
+    started_at = onlive.get("started_at") if rotated and isinstance(onlive, dict) else None
+    gap_start = min(now, started_at or receiver.last_message_at or receiver.subscribed_at)
+    receiver.last_gap_sec = now - gap_start
+    receiver.rekey(info["host"], info["key"])
+    count("srlog_receiver_rekeys_total", room=room, reason="session" if rotated else "silence")
+    set_gauge("srlog_receiver_missed_window_seconds", receiver.last_gap_sec, room=room)
+    return gap_start, now
+
+
 def update_free_gift_master(room_id):
     headers = {
         "User-Agent": "Mozilla/5.0",
     }
     try:
-        url = f"https://www.showroom-live.com/api/live/gift_list?room_id={room_id}"
+        url = f"{SHOWROOM_API_BASE}/live/gift_list?room_id={room_id}"
         res = requests.get(url, headers=headers, timeout=5).json()
         master = {}
         for cat_key in res.keys():
@@ -152,4 +521,55 @@ def update_free_gift_master(room_id):
     except Exception as e:
         print(f"API Error (gift_list): {e}")
         if "free_gift_master" not in st.session_state:
-            st.session_state.free_gift_master = {}
\ No newline at end of file
+            st.session_state.free_gift_master = {}
+
+# --- 無償ギフトの連打をまとめる（同一ユーザー・同一ギフトを短時間で合算） ---
+class FreeGiftCoalescer:
+    """
+    (user_id, gift_id) が同じで window_sec 以内に届いた無償ギフトを1件にまとめ、num を合算する。
+    created_at は最初の受信時刻のまま、last_created_at に最後の受信時刻を記録する。
+    window_sec が 0 以下なら合算せずそのまま追加する。
+    """
+
+    def __init__(self, window_sec=10, max_merge_distance=1000):
+        self.window_sec = window_sec
+        # 合算先がログのメモリ上に残っていると見なせる距離（これより古い行には合算しない）
+        self.max_merge_distance = max_merge_distance
+        self._open = {}  # {(user_id, gift_id): (entry, ログ件数 at 追加時)}
+
+    def add(self, entry, log):
+        """entry を log (EventLog) に追加する。合算した場合は True を返す"""
+        ts = entry.get("created_at", 0)
+        entry.setdefault("last_created_at", ts)
+        if self.window_sec <= 0:
+            log.add(entry)
+            return False
+
+        key = (entry.get("user_id"), entry.get("gift_id"))
+        opened = self._open.get(key)
+        if opened:
+            target, seq = opened
+            if (
+                0 <= ts - target["last_created_at"] <= self.window_sec
+                and len(log) - seq < self.max_merge_distance
+            ):
+                target["num"] = target.get("num", 0) + entry.get("num", 0)
+                target["last_created_at"] = ts
+                log.touch()
+                return True
+
+        log.add(entry)
+        # 追加順（= seq 順）を保つため、既存のキーは一度取り除いてから末尾へ入れ直す
+        self._open.pop(key, None)
+        self._open[key] = (entry, len(log))
+        self._expire(ts, len(log))
+        return False
+
+    def _expire(self, now, log_len):
+        """古い順に、合算対象になり得なくなったものを先頭から取り除く（追加1回あたり償却 O(1)）"""
+        while self._open:
+            key = next(iter(self._open))
+            target, seq = self._open[key]
+            if log_len - seq < self.max_merge_distance and now - target["last_created_at"] <= self.window_sec:
+                break
+            del self._open[key]
\ No newline at end of file
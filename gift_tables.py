@@ -0,0 +1,35 @@
+import pandas as pd
+
+# --- ギフト系タブの「👤 ユーザー単位で集計 (総貢献Pt順)」表の共通ビルダー ---
+# スペシャルギフト・無償ギフト・統合の3タブで同じ表を作るため、列名だけ変えて使う
+USER_RANKING_COLUMNS = ['ユーザー名', 'ギフト名', '合計個数', 'ポイント', 'ギフト単位Pt', '総貢献Pt（※単純合計値）']
+
+
+def build_user_ranking(df, name_col='name', gift_col='gift_name', latest_names=None):
+    """
+    ギフトログの DataFrame（created_at, user_id, name_col, gift_col, num, point 列）から、
+    ユーザー × ギフト単位の行を総貢献Pt順に並べた表示用 DataFrame を作る。
+    ユーザー名と総貢献Ptは各ユーザーの先頭行にだけ表示し、2行目以降は空欄にする。
+    latest_names ({user_id: 名前}、UserIndex.names()) を渡すとその名前を使い、渡さなければ df から求める。
+    """
+    work = df[['created_at', 'user_id', name_col, gift_col, 'num', 'point']].copy()
+    work['line_pt'] = pd.to_numeric(work['num']) * pd.to_numeric(work['point'])
+    if latest_names is None:
+        latest_names = work.sort_values('created_at').groupby('user_id')[name_col].last()
+
+    agg = work.groupby(['user_id', gift_col, 'point'], as_index=False).agg({'num': 'sum', 'line_pt': 'sum'})
+    agg['総Pt'] = agg.groupby('user_id')['line_pt'].transform('sum')
+    agg = agg.sort_values(['総Pt', 'user_id', 'line_pt'], ascending=[False, True, False], kind='mergesort')
+
+    # 直前の行とユーザーが変わった行＝そのユーザーの先頭行
+    is_first = agg['user_id'].ne(agg['user_id'].shift()).to_numpy()
+    names = agg['user_id'].map(latest_names).fillna('').astype(object)
+    totals = agg['総Pt'].astype(int).astype(object)
+    return pd.DataFrame({
+        'ユーザー名': names.where(is_first, '').to_numpy(),
+        'ギフト名': agg[gift_col].to_numpy(),
+        '合計個数': agg['num'].to_numpy(),
+        'ポイント': agg['point'].to_numpy(),
+        'ギフト単位Pt': agg['line_pt'].astype(int).to_numpy(),
+        '総貢献Pt（※単純合計値）': totals.where(is_first, '').to_numpy(),
+    }, columns=USER_RANKING_COLUMNS)
@@ -0,0 +1,148 @@
+import datetime
+import html
+import os
+import threading
+from collections import OrderedDict
+
+from system_messages import classified, highlight_color
+
+# --- ダッシュボード（コメント・スペシャルギフト・無償ギフト・システムMSG）の1行分の HTML ---
+# イベントの HTML は一度作れば変わらないので、イベントのキーごとに作った文字列を使い回す。
+# 各カラムはこの断片を連結して1回の st.markdown で描画する（行ごとに要素を作らない）。
+# ユーザー名・コメント・ギフト名などの利用者が入力し得る文字列は必ず html.escape してから埋め込む
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+DEFAULT_AVATAR = "https://static.showroom-live.com/image/avatar/default_avatar.png"
+# プロセス全体で保持する断片の上限（同じルームを見ている複数セッションで共有する。超えたら古いものから捨てる）
+FRAGMENT_CACHE_MAX = int(os.environ.get("SRLOG_FRAGMENT_CACHE_MAX", "100000"))
+
+_HR = '<hr style="border: none; border-top: 1px solid #eee; margin: 8px 0;">'
+
+
+class FragmentCache:
+    def __init__(self, maxsize=FRAGMENT_CACHE_MAX):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, build):
+        """key の断片を返す。なければ build() で作って保存する"""
+        with self._lock:
+            fragment = self._items.get(key)
+            if fragment is not None:
+                self._items.move_to_end(key)
+                return fragment
+        fragment = build()
+        with self._lock:
+            self._items[key] = fragment
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_cache = FragmentCache()
+
+
+def _e(value):
+    return html.escape(str(value if value is not None else ""))
+
+
+def _time(entry):
+    return datetime.datetime.fromtimestamp(entry.get('created_at', 0), JST).strftime("%H:%M:%S")
+
+
+def _avatar_url(entry):
+    avatar_id = entry.get('avatar_id', None)
+    return f"https://static.showroom-live.com/image/avatar/{avatar_id}.png" if avatar_id else DEFAULT_AVATAR
+
+
+def _gift_highlight_class(total_point):
+    if total_point >= 300000: return "highlight-300000"
+    if total_point >= 100000: return "highlight-100000"
+    if total_point >= 60000: return "highlight-60000"
+    if total_point >= 30000: return "highlight-30000"
+    if total_point >= 10000: return "highlight-10000"
+    return ""
+
+
+def _comment_html(entry):
+    return (
+        '<div class="comment-item"><div class="comment-item-row">'
+        f'<img src="{_e(entry.get("avatar_url", ""))}" class="comment-avatar" />'
+        '<div class="comment-content">'
+        f'<div class="comment-time">{_time(entry)}</div>'
+        f'<div class="comment-user">{_e(entry.get("name", "匿名ユーザー"))}</div>'
+        f'<div class="comment-text">{_e(entry.get("comment", ""))}</div>'
+        f'</div></div></div>{_HR}'
+    )
+
+
+def _gift_html(entry):
+    gift_name = entry.get('gift_name') or "未知のギフト"
+    gift_count = entry.get('num', 0)
+    total_point = entry.get('line_pt', entry.get('point', 0) * gift_count)
+    return (
+        f'<div class="gift-item {_gift_highlight_class(total_point)}"><div class="gift-item-row">'
+        f'<img src="{_e(_avatar_url(entry))}" class="gift-avatar" />'
+        '<div class="gift-content">'
+        f'<div class="gift-time">{_time(entry)}</div>'
+        f'<div class="gift-user">{_e(entry.get("name", "匿名ユーザー"))}</div>'
+        '<div class="gift-info-row">'
+        f'<img src="{_e(entry.get("image", ""))}" class="gift-image" title="{_e(gift_name)}" />'
+        f'<span>×{_e(gift_count)}</span></div>'
+        f'<div style="font-size: 0.9em; color: #555;">{_e(total_point)} pt</div>'
+        f'</div></div></div>{_HR}'
+    )
+
+
+def _free_gift_html(entry):
+    # デザインはスペシャルギフトと統一（ポイントは単価を表示）
+    return (
+        '<div class="gift-item"><div class="gift-item-row">'
+        f'<img src="{_e(_avatar_url(entry))}" class="gift-avatar" />'
+        '<div class="gift-content">'
+        f'<div class="gift-time">{_time(entry)}</div>'
+        f'<div class="gift-user">{_e(entry.get("name", "匿名ユーザー"))}</div>'
+        '<div class="gift-info-row">'
+        f'<img src="{_e(entry.get("image", ""))}" class="gift-image" />'
+        f'<span>×{_e(entry.get("num", 0))}</span></div>'
+        f'<div>{_e(entry.get("point", 1))} pt</div>'
+        f'</div></div></div>{_HR}'
+    )
+
+
+def _system_msg_html(entry):
+    bg_color = highlight_color(classified(entry))
+    return (
+        f'<div class="comment-item" style="background-color: {bg_color}; padding: 0px 8px 4px 8px; margin-bottom: 2px;">'
+        f'<div class="comment-time">{_time(entry)}</div>'
+        '<div style="color: #FF6C1A; font-weight: bold; font-size: 0.9em; line-height: 1.5; margin-top: 2px;">'
+        f'{_e(entry.get("message", ""))}</div></div>{_HR}'
+    )
+
+
+# (キーの作り方, 断片の作り方)。無償ギフトは連打の合算で num が増えるので num もキーに含める
+# 有償ギフトはギフトリストの取り直しでポイントが後から付くことがあるので line_pt もキーに含める
+_KINDS = {
+    "comment": (lambda e: (e.get('created_at'), e.get('user_id'), e.get('comment')), _comment_html),
+    "gift": (lambda e: (e.get('created_at'), e.get('user_id'), e.get('gift_id'), e.get('num'), e.get('line_pt')), _gift_html),
+    "free_gift": (lambda e: (e.get('created_at'), e.get('user_id'), e.get('gift_id'), e.get('num')), _free_gift_html),
+    "system_msg": (lambda e: (e.get('created_at'), e.get('user_id'), e.get('message')), _system_msg_html),
+}
+
+
+def fragment(kind, entry):
+    """kind ("comment" / "gift" / "free_gift" / "system_msg") のイベント1件の HTML"""
+    make_key, build = _KINDS[kind]
+    return _cache.get((kind,) + make_key(entry), lambda: build(entry))
+
+
+def render_feed(kind, entries):
+    """entries の断片を連結した HTML（1回の st.markdown で描画する）"""
+    return "".join(fragment(kind, entry) for entry in entries)
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+# --- 配信終了後のログをローカルに蓄積する SQLite アーカイブ ---
+# FTP 上の CSV は配信ごとにバラバラなので、横断的な集計はこちらで行う
+# 負荷試験などで本番のアーカイブへ書き込まないよう、環境変数で保存先を差し替えられる
+ARCHIVE_DB_PATH = os.environ.get(
+    "SRLOG_ARCHIVE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "srlog_archive.sqlite3")
+)
+
+_write_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    stream_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id     INTEGER NOT NULL,
+    started_at  INTEGER NOT NULL,
+    ended_at    INTEGER NOT NULL,
+    archived_at INTEGER NOT NULL,
+    UNIQUE (room_id, started_at)
+);
+CREATE INDEX IF NOT EXISTS idx_streams_room_started ON streams (room_id, started_at);
+
+CREATE TABLE IF NOT EXISTS comments (
+    stream_id  INTEGER NOT NULL REFERENCES streams (stream_id) ON DELETE CASCADE,
+    room_id    INTEGER NOT NULL,
+    user_id    INTEGER,
+    name       TEXT,
+    comment    TEXT,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_comments_room_created ON comments (room_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_comments_room_user ON comments (room_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_comments_stream ON comments (stream_id);
+
+CREATE TABLE IF NOT EXISTS gifts (
+    stream_id  INTEGER NOT NULL REFERENCES streams (stream_id) ON DELETE CASCADE,
+    room_id    INTEGER NOT NULL,
+    user_id    INTEGER,
+    name       TEXT,
+    gift_id    TEXT,
+    gift_name  TEXT,
+    num        INTEGER NOT NULL DEFAULT 0,
+    point      INTEGER NOT NULL DEFAULT 0,
+    is_free    INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_gifts_room_created ON gifts (room_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_gifts_room_user ON gifts (room_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_gifts_stream ON gifts (stream_id);
+
+CREATE TABLE IF NOT EXISTS system_msgs (
+    stream_id  INTEGER NOT NULL REFERENCES streams (stream_id) ON DELETE CASCADE,
+    room_id    INTEGER NOT NULL,
+    user_id    INTEGER,
+    message    TEXT,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_system_msgs_room_created ON system_msgs (room_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_system_msgs_room_user ON system_msgs (room_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_system_msgs_stream ON system_msgs (stream_id);
+"""
+
+
+def _connect(db_path=None):
+    conn = sqlite3.connect(db_path or ARCHIVE_DB_PATH, timeout=30)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _to_int(value, default=None):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def archive_stream(room_id, comment_log, gift_log, free_gift_log, system_msg_log, gift_list_map=None, db_path=None):
+    """
+    1配信分のログをアーカイブに書き込み、stream_id を返す。
+    同じ配信 (room_id + 開始時刻) を再度書き込んだ場合は置き換えるため、何度呼んでも重複しない。
+    """
+    gift_list_map = gift_list_map or {}
+    all_times = [
+        _to_int(log.get("created_at"), 0)
+        for logs in (comment_log, gift_log, free_gift_log, system_msg_log)
+        for log in logs
+    ]
+    all_times = [t for t in all_times if t]
+    if not all_times:
+        return None
+    room_id = int(room_id)
+    started_at, ended_at = min(all_times), max(all_times)
+
+    comment_rows = [
+        (room_id, _to_int(log.get("user_id")), log.get("name", ""), log.get("comment", ""), _to_int(log.get("created_at"), 0))
+        for log in comment_log
+    ]
+    gift_rows = []
+    for log in gift_log:
+        gift_info = gift_list_map.get(str(log.get("gift_id")), {})
+        gift_rows.append((
+            room_id, _to_int(log.get("user_id")), log.get("name", ""), str(log.get("gift_id")),
+            log.get("gift_name", gift_info.get("name", "")), _to_int(log.get("num"), 0),
+            _to_int(log.get("point", gift_info.get("point")), 0), 0,
+            _to_int(log.get("created_at"), 0),
+        ))
+    for log in free_gift_log:
+        gift_rows.append((
+            room_id, _to_int(log.get("user_id")), log.get("name", ""), str(log.get("gift_id")),
+            log.get("gift_name", ""), _to_int(log.get("num"), 0), _to_int(log.get("point"), 0), 1,
+            _to_int(log.get("created_at"), 0),
+        ))
+    system_rows = [
+        (room_id, _to_int(log.get("user_id")), log.get("message", ""), _to_int(log.get("created_at"), 0))
+        for log in system_msg_log
+    ]
+
+    with _write_lock, closing(_connect(db_path)) as conn, conn:
+        # 同一配信の再アーカイブは古い行を CASCADE で消してから入れ直す
+        conn.execute("DELETE FROM streams WHERE room_id = ? AND started_at = ?", (room_id, started_at))
+        cur = conn.execute(
+            "INSERT INTO streams (room_id, started_at, ended_at, archived_at) VALUES (?, ?, ?, ?)",
+            (room_id, started_at, ended_at, int(time.time())),
+        )
+        stream_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO comments (stream_id, room_id, user_id, name, comment, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(stream_id,) + row for row in comment_rows],
+        )
+        conn.executemany(
+            "INSERT INTO gifts (stream_id, room_id, user_id, name, gift_id, gift_name, num, point, is_free, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(stream_id,) + row for row in gift_rows],
+        )
+        conn.executemany(
+            "INSERT INTO system_msgs (stream_id, room_id, user_id, message, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(stream_id,) + row for row in system_rows],
+        )
+    return stream_id
+
+
+# --- ▼ 参照用クエリ ▼ ---
+
+def _recent_stream_ids_sql(limit_param="?"):
+    return f"SELECT stream_id FROM streams WHERE room_id = ? ORDER BY started_at DESC LIMIT {limit_param}"
+
+
+def top_gifters(room_id, last_n_streams=30, limit=20, include_free=False, db_path=None):
+    """直近 last_n_streams 配信のギフト貢献Pt上位ユーザーを返す（最新のユーザー名付き）"""
+    free_filter = "" if include_free else "AND g.is_free = 0"
+    sql = f"""
+        WITH recent AS ({_recent_stream_ids_sql()}),
+        totals AS (
+            SELECT g.user_id, SUM(g.num * g.point) AS total_pt, SUM(g.num) AS total_num,
+                   COUNT(DISTINCT g.stream_id) AS stream_count, MAX(g.created_at) AS last_at
+            FROM gifts g
+            WHERE g.room_id = ? AND g.stream_id IN (SELECT stream_id FROM recent) {free_filter}
+            GROUP BY g.user_id
+        )
+        SELECT t.user_id,
+               (SELECT g2.name FROM gifts g2
+                 WHERE g2.room_id = ? AND g2.user_id = t.user_id
+                 ORDER BY g2.created_at DESC LIMIT 1) AS name,
+               t.total_pt, t.total_num, t.stream_count
+        FROM totals t
+        ORDER BY t.total_pt DESC, t.last_at DESC
+        LIMIT ?
+    """
+    room_id = int(room_id)
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(sql, (room_id, int(last_n_streams), room_id, room_id, int(limit))).fetchall()
+    return [
+        {"user_id": r[0], "name": r[1], "total_point": r[2], "total_num": r[3], "stream_count": r[4]}
+        for r in rows
+    ]
+
+
+def first_seen(user_id, room_id=None, db_path=None):
+    """ユーザーが最初に記録された時刻 (UNIX秒) を返す。room_id 指定時はそのルーム内に限定。記録がなければ None"""
+    user_id = int(user_id)
+    room_filter = "AND room_id = ?" if room_id is not None else ""
+    params = (user_id, int(room_id)) if room_id is not None else (user_id,)
+    with closing(_connect(db_path)) as conn:
+        firsts = [
+            conn.execute(f"SELECT MIN(created_at) FROM {table} WHERE user_id = ? {room_filter}", params).fetchone()[0]
+            for table in ("comments", "gifts", "system_msgs")
+        ]
+    firsts = [t for t in firsts if t is not None]
+    return min(firsts) if firsts else None
+
+
+def comment_counts_per_stream(room_id, last_n_streams=30, db_path=None):
+    """直近 last_n_streams 配信それぞれのコメント件数・コメントしたユーザー数を新しい順で返す"""
+    sql = """
+        SELECT s.stream_id, s.started_at, s.ended_at,
+               COUNT(c.created_at) AS comment_count,
+               COUNT(DISTINCT c.user_id) AS commenter_count
+        FROM streams s
+        LEFT JOIN comments c ON c.stream_id = s.stream_id
+        WHERE s.room_id = ?
+        GROUP BY s.stream_id
+        ORDER BY s.started_at DESC
+        LIMIT ?
+    """
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(sql, (int(room_id), int(last_n_streams))).fetchall()
+    return [
+        {"stream_id": r[0], "started_at": r[1], "ended_at": r[2], "comment_count": r[3], "commenter_count": r[4]}
+        for r in rows
+    ]
+
+
+def stream_comments(stream_id, db_path=None):
+    """1配信分のコメントを時刻順で返す（コメント検索の索引作成用）"""
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT created_at, user_id, name, comment FROM comments WHERE stream_id = ? ORDER BY created_at, rowid",
+            (int(stream_id),),
+        ).fetchall()
+    return [{"created_at": r[0], "user_id": r[1], "name": r[2], "comment": r[3]} for r in rows]
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 再実行（リフレッシュ）1回ごとの処理時間と、取り込みイベント数の計測 ---
+# 各段階 (API呼び出し・キュー取り出し・自動保存・タブ構築・ダッシュボード列) の所要時間を
+#   1) 現在の再実行のトレース（画面のデバッグパネル用）
+#   2) プロセス全体の集計（Prometheus テキスト形式 /metrics 用）
+#   3) 構造化ログ（再実行ごとに1行の JSON）
+# に記録する
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("srlog.perf")
+# SRLOG_PERF_LOG にファイルパスを指定すると、再実行ごとの計測結果を JSON Lines で追記する
+PERF_LOG_PATH = os.environ.get("SRLOG_PERF_LOG", "")
+if PERF_LOG_PATH and not logger.handlers:
+    _handler = logging.FileHandler(PERF_LOG_PATH, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_local = threading.local()
+_lock = threading.Lock()
+_stage_stats = {}   # {stage: [count, sum, max, [bucket counts...]]}
+_counters = {}      # {(name, labels tuple): value}
+_gauges = {}        # {(name, labels tuple): value}
+
+
+class RunTrace:
+    """1回の再実行で計測した段階ごとの所要時間"""
+
+    def __init__(self, label=""):
+        self.label = label
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = []    # [(stage, seconds)] 計測順
+        self.counts = {}    # {(name, labels tuple): value} この再実行分
+        self.total_sec = None
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    def to_record(self):
+        return {
+            "ts": round(self.started_at, 3),
+            "run": self.label,
+            "total_ms": round((self.total_sec if self.total_sec is not None else self.elapsed()) * 1000, 2),
+            "stages": [{"stage": s, "ms": round(sec * 1000, 2)} for s, sec in self.stages],
+            "counts": {_format_key(k): v for k, v in self.counts.items()},
+        }
+
+
+def _format_key(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def begin_run(label=""):
+    """スクリプトの再実行の先頭で呼び、このスレッドの計測を開始する"""
+    trace = RunTrace(label)
+    _local.trace = trace
+    return trace
+
+
+def current_run():
+    return getattr(_local, "trace", None)
+
+
+def end_run():
+    """再実行の最後で呼び、合計時間を記録して構造化ログへ出力する"""
+    trace = current_run()
+    if trace is None:
+        return None
+    trace.total_sec = trace.elapsed()
+    _record_stage("run.total", trace.total_sec)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(trace.to_record(), ensure_ascii=False))
+    _local.trace = None
+    return trace
+
+
+def _record_stage(stage, seconds):
+    with _lock:
+        stats = _stage_stats.get(stage)
+        if stats is None:
+            stats = [0, 0.0, 0.0, [0] * len(STAGE_BUCKETS)]
+            _stage_stats[stage] = stats
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        for i, le in enumerate(STAGE_BUCKETS):
+            if seconds <= le:
+                stats[3][i] += 1
+
+
+@contextmanager
+def stage(name):
+    """with stage("api.comment_log"): ... の形で段階の所要時間を計測する"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        trace = current_run()
+        if trace is not None:
+            trace.stages.append((name, seconds))
+        _record_stage(name, seconds)
+
+
+def timed(name):
+    """関数全体を1つの段階として計測するデコレーター"""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    """イベント数などのカウンターを加算する（例: count("srlog_events_total", 3, log="comment", outcome="ingested")）"""
+    if not value:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    trace = current_run()
+    if trace is not None:
+        trace.counts[key] = trace.counts.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+
+def snapshot():
+    """プロセス全体の集計のコピーを返す（デバッグパネル用）"""
+    with _lock:
+        stages = {
+            s: {"count": v[0], "sum_sec": v[1], "max_sec": v[2], "avg_sec": v[1] / v[0] if v[0] else 0.0}
+            for s, v in _stage_stats.items()
+        }
+        counters = {_format_key(k): v for k, v in _counters.items()}
+        gauges = {_format_key(k): v for k, v in _gauges.items()}
+    return {"stages": stages, "counters": counters, "gauges": gauges}
+
+
+def render_prometheus():
+    """Prometheus テキスト形式 (version 0.0.4) で全メトリクスを出力する"""
+    lines = []
+    with _lock:
+        lines.append("# HELP srlog_stage_seconds Time spent in each stage of a dashboard rerun.")
+        lines.append("# TYPE srlog_stage_seconds histogram")
+        for s, (n, total, _, buckets) in sorted(_stage_stats.items()):
+            for le, c in zip(STAGE_BUCKETS, buckets):
+                lines.append(f'srlog_stage_seconds_bucket{{stage="{s}",le="{le}"}} {c}')
+            lines.append(f'srlog_stage_seconds_bucket{{stage="{s}",le="+Inf"}} {n}')
+            lines.append(f'srlog_stage_seconds_sum{{stage="{s}"}} {total:.6f}')
+            lines.append(f'srlog_stage_seconds_count{{stage="{s}"}} {n}')
+        for kind, table in (("counter", _counters), ("gauge", _gauges)):
+            names = sorted({k[0] for k in table})
+            for name in names:
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(table.items()):
+                    if key[0] == name:
+                        lines.append(f"{_format_key(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- /metrics エンドポイント（SRLOG_METRICS_PORT を設定した場合のみ、プロセスで1回だけ起動） ---
+METRICS_PORT = int(os.environ.get("SRLOG_METRICS_PORT", "0"))
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    """メトリクス用の HTTP サーバーを起動する（起動済み・port=0 の場合は何もしない）"""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            # http.server は起動時にだけ読み込む（初回表示を軽くするため）
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = render_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            try:
+                _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            except OSError as e:
+                print(f"Metrics Server Error: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+import requests
+
+from dedup_index import FingerprintSet, log_fingerprint
+from perf_metrics import count, set_gauge
+
+# --- ルーム単位のポーリングをプロセス全体で共有する ---
+# 同じルームを複数のセッション（ブラウザタブ）で開いても、コメント・有償ギフト・ギフトリスト・ファンリストの
+# API 取得はルームごとに1系統だけにする。取得・重複除去・ギフト情報の付与はここで1回だけ行い、
+# 各セッションは自分のカーソル（どこまで取り込んだか）から先の分を読み出して、自分のログ・索引へ取り込む。
+# 画面の状態（ログ・索引・フィルタ・保存状況など）は従来どおりセッションごとに持つ
+LOG_TYPES = ("comment", "gift")
+# 同じルームの取得を繰り返さない最短間隔（秒）。どのセッションの再実行でも、これより短い間隔では取りに行かない
+ROOM_FEED_POLL_INTERVAL_SEC = float(os.environ.get("SRLOG_ROOM_POLL_SEC", "8"))
+# 読み出し用に保持する直近の件数（ログごと）。これより遅れたセッションは古い分を取りこぼす
+ROOM_FEED_RETAIN = 5000
+# どのセッションからも参照されなくなったフィードを破棄するまでの時間（秒）
+ROOM_FEED_IDLE_SEC = 600
+# ギフトリストにないギフトIDが届いた時に、リストを取り直す最短間隔（秒）。
+# 初めて見る ID が届いた時はこの間隔を待たずに取り直す。取り直しても見つからない ID は、この間隔で取り直し続ける
+GIFT_LIST_REFETCH_INTERVAL_SEC = 60
+
+
+def enrich_gift_entry(log, gift_list_map):
+    """
+    有償ギフト1件にギフト名 (gift_name)・単価 (point)・行ポイント (line_pt = point × num) を付ける。
+    ギフトリストにまだない ID は gift_unresolved=True の印を付けて 0 pt にしておき、リストを取り直した後に
+    もう一度呼んで付け直す（印は値を書き終えてから外す）
+    """
+    gift_info = gift_list_map.get(str(log.get('gift_id')))
+    if gift_info is None:
+        log['gift_unresolved'] = True
+        gift_info = {}
+    log['gift_name'] = gift_info.get('name', '')
+    log['point'] = gift_info.get('point', 0)
+    try:
+        log['line_pt'] = log['point'] * int(log.get('num', 0))
+    except (ValueError, TypeError):
+        log['line_pt'] = 0
+    if not log.get('image'):
+        log['image'] = gift_info.get('image', '')
+    if gift_info:
+        log.pop('gift_unresolved', None)
+    return log
+
+
+class RoomFeed:
+    """
+    1ルーム分の共有ポーリング結果。取得処理は呼び出し側から渡す:
+      fetch_log(log_type, room_id) -> APIの生ログのリスト（失敗時は requests の例外）
+      fetch_gift_list(room_id) -> {gift_id: {name, point, image, free}}（失敗時は None）
+      fetch_fan_list(room_id) -> (fan_list, total_fan_count)
+    """
+
+    def __init__(self, room_id, fetch_log, fetch_gift_list, fetch_fan_list, poll_interval_sec=ROOM_FEED_POLL_INTERVAL_SEC):
+        self.room_id = str(room_id)
+        self.fetch_log = fetch_log
+        self.fetch_gift_list = fetch_gift_list
+        self.fetch_fan_list = fetch_fan_list
+        self.poll_interval_sec = poll_interval_sec
+
+        self._logs = {log_type: deque() for log_type in LOG_TYPES}
+        self._base = dict.fromkeys(LOG_TYPES, 0)      # _logs[log_type][0] の通し番号
+        self._dedup = {log_type: FingerprintSet() for log_type in LOG_TYPES}
+        self.polled_at = dict.fromkeys(LOG_TYPES, 0)
+        self.errors = {}                               # {log_type: 直近の取得で起きたエラー}
+        self.gift_list_map = {}
+        self.gift_list_fetched_at = 0
+        self._unknown_gift_ids = set()                 # 取り直しのきっかけにした、リストにないギフトID
+        self.fan_list = []
+        self.total_fan_count = 0
+        self.fan_list_version = 0                      # ファンリストの内容が変わるたびに増える
+        self.fan_list_fetched_at = 0
+        self.last_access = time.time()
+        self._poll_lock = threading.Lock()             # 取得は同時に1つだけ
+        self._lock = threading.Lock()                  # _logs の読み書き
+
+    def poll(self, include_logs=True, fan_interval_sec=0):
+        """
+        前回の取得から poll_interval_sec 以上経っていれば API から取得する。
+        他のセッションが取得中なら待たずに戻る（取得済みの分だけを読み出す）。
+        """
+        self.last_access = time.time()
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            if not self.gift_list_map:
+                self._refresh_gift_list()
+            elif self._unknown_gift_ids and now - self.gift_list_fetched_at >= GIFT_LIST_REFETCH_INTERVAL_SEC:
+                # 前回の取り直しでも見つからなかった ID があれば、新しいギフトが届かなくても取り直す
+                self._refresh_gift_list()
+            if include_logs:
+                for log_type in LOG_TYPES:
+                    if now - self.polled_at[log_type] >= self.poll_interval_sec:
+                        self._poll_log(log_type)
+            if now - self.fan_list_fetched_at >= max(fan_interval_sec, self.poll_interval_sec):
+                count("srlog_upstream_requests_total", endpoint="fan_list")
+                fan_list, total_fan_count = self.fetch_fan_list(self.room_id)
+                if fan_list != self.fan_list or total_fan_count != self.total_fan_count:
+                    self.fan_list, self.total_fan_count = fan_list, total_fan_count
+                    self.fan_list_version += 1
+                self.fan_list_fetched_at = time.time()
+        finally:
+            self._poll_lock.release()
+
+    def request_poll(self):
+        """次の poll() で間隔を待たずにコメント・有償ギフトを取得させる（配信の再開を検知した時の取り直し用）"""
+        self.polled_at = dict.fromkeys(LOG_TYPES, 0)
+
+    def _refresh_gift_list(self):
+        count("srlog_upstream_requests_total", endpoint="gift_list")
+        self.gift_list_fetched_at = time.time()
+        gift_list_map = self.fetch_gift_list(self.room_id)
+        if gift_list_map is not None:
+            self.gift_list_map = gift_list_map
+            self._unknown_gift_ids -= gift_list_map.keys()
+
+    def _ensure_gift_list(self, gift_ids):
+        """
+        gift_ids に未知のIDがあればギフトリストを取り直す。初めて見る ID なら間隔を待たずに、
+        以前にも取り直した ID だけなら GIFT_LIST_REFETCH_INTERVAL_SEC に1回まで
+        （このフィードのリストが全セッションのギフト名・ポイントになるため、新しい ID は必ず一度は取り直す）
+        """
+        unknown = {gid for gid in gift_ids if gid not in self.gift_list_map}
+        if unknown - self._unknown_gift_ids or \
+                (unknown and time.time() - self.gift_list_fetched_at >= GIFT_LIST_REFETCH_INTERVAL_SEC):
+            self._unknown_gift_ids |= unknown
+            self._refresh_gift_list()
+        return self.gift_list_map
+
+    def _poll_log(self, log_type):
+        self.polled_at[log_type] = time.time()
+        count("srlog_upstream_requests_total", endpoint=f"{log_type}_log")
+        try:
+            new_log = self.fetch_log(log_type, self.room_id)
+        except requests.exceptions.RequestException as e:
+            self.errors[log_type] = e
+            return
+        self.errors.pop(log_type, None)
+
+        # 重複判定は (created_at, user_id, 内容) の指紋で、ポーリングをまたいで保持している集合に対して行う
+        seen = self._dedup[log_type]
+        fresh = [
+            log for log in sorted(new_log, key=lambda x: x.get('created_at', 0))
+            if seen.add(log_fingerprint(log_type, log))
+        ]
+        if log_type == "gift" and fresh:
+            # ギフト名・単価・行ポイントは取り込み時に1回だけ付ける（タブ・保存処理はこの値を読む）
+            gift_list_map = self._ensure_gift_list({str(log.get('gift_id')) for log in fresh})
+            for log in fresh:
+                enrich_gift_entry(log, gift_list_map)
+        count("srlog_events_total", len(new_log) - len(fresh), log=log_type, outcome="duplicate")
+
+        with self._lock:
+            log = self._logs[log_type]
+            log.extend(fresh)
+            while len(log) > ROOM_FEED_RETAIN:
+                log.popleft()
+                self._base[log_type] += 1
+
+    def read(self, log_type, cursor=None):
+        """
+        cursor（前回の戻り値）より後に取得した log_type のログを取得順に返す。
+        戻り値は (ログのリスト, 次回のカーソル, 保持範囲から外れて読めなかった件数)。
+        cursor=None（取り込み開始直後）は保持している分を全て返す。
+        """
+        self.last_access = time.time()
+        with self._lock:
+            log = self._logs[log_type]
+            base = self._base[log_type]
+            end = base + len(log)
+            if cursor is None:
+                cursor = base
+            missed = max(0, base - cursor)
+            entries = list(islice(log, max(cursor, base) - base, None))
+        return entries, end, missed
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_room_feed(room_id, fetch_log, fetch_gift_list, fetch_fan_list):
+    """ルームの共有フィードを返す（なければ作る）。しばらく参照されていないフィードはここで破棄する"""
+    key = str(room_id)
+    now = time.time()
+    with _feeds_lock:
+        for other_key, feed in list(_feeds.items()):
+            if other_key != key and now - feed.last_access > ROOM_FEED_IDLE_SEC:
+                del _feeds[other_key]
+        feed = _feeds.get(key)
+        if feed is None:
+            feed = RoomFeed(key, fetch_log, fetch_gift_list, fetch_fan_list)
+            _feeds[key] = feed
+        set_gauge("srlog_room_feeds", len(_feeds))
+        return feed
@@ -0,0 +1,59 @@
+import re
+
+# --- 複数ルーム同時トラッキング用：ルームごとの状態の保持と切り替え ---
+# 既存の処理は st.session_state の各キー（comment_log など）を直接参照するため、
+# 処理対象のルームの状態をそれらのキーへ「バインド」してから実行し、終わったら書き戻す
+ROOM_STATE_KEYS = (
+    "comment_log", "gift_log", "free_gift_log", "system_msg_log",
+    "gift_list_map", "fan_list", "total_fan_count", "fan_list_version", "free_gift_master",
+    "ws_receiver", "free_gift_coalescer", "time_series", "user_index", "comment_search", "feed_cursors", "unresolved_gifts", "export_cache",
+    "save_scheduler",
+)
+
+
+def parse_room_ids(text):
+    """カンマ・空白・改行区切りのルームID入力を、重複を除いた順序付きリストにする（数字以外は None を返す）"""
+    tokens = [t for t in re.split(r"[\s,、，]+", text or "") if t]
+    if not tokens or not all(t.isdigit() for t in tokens):
+        return None
+    return list(dict.fromkeys(tokens))
+
+
+def new_room_state(room_id, log_factory, coalescer, time_series, user_index, comment_search, save_scheduler):
+    return {
+        "room_id": str(room_id),
+        "comment_log": log_factory("comment_log"),
+        "gift_log": log_factory("gift_log"),
+        "free_gift_log": log_factory("free_gift_log"),
+        "system_msg_log": log_factory("system_msg_log"),
+        "gift_list_map": {},
+        "fan_list": [],
+        "total_fan_count": 0,
+        "fan_list_version": 0,
+        "free_gift_master": {},
+        "ws_receiver": None,
+        "free_gift_coalescer": coalescer,
+        "time_series": time_series,
+        "user_index": user_index,
+        "comment_search": comment_search,
+        "feed_cursors": {},
+        "unresolved_gifts": [],
+        "export_cache": {},
+        "save_scheduler": save_scheduler,
+    }
+
+
+def bind_room(session_state, rooms, room_id):
+    """ルームの状態をセッションのキーへ割り当て、以降の処理の対象ルームにする"""
+    state = rooms[str(room_id)]
+    for key in ROOM_STATE_KEYS:
+        session_state[key] = state[key]
+    session_state["room_id"] = state["room_id"]
+
+
+def store_room(session_state, rooms, room_id):
+    """処理中に差し替えられたキー（fan_list など）をルームの状態へ書き戻す"""
+    state = rooms[str(room_id)]
+    for key in ROOM_STATE_KEYS:
+        if key in session_state:
+            state[key] = session_state[key]
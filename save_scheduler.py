@@ -0,0 +1,71 @@
+import os
+import time
+
+# --- FTP 自動保存のスケジューラ（全4ログ共通） ---
+# 「前回の保存から N 秒」「M 件の追加・更新」「K バイトの追加」のいずれかに達したら、
+# 前回から変化のあったログをまとめて1回の保存（1回の FTP 接続）にする。
+# 保存（失敗を含む）の間隔は最短 SAVE_MIN_INTERVAL_SEC 秒空けるため、取り込みが集中しても保存は連発しない
+SAVE_KINDS = ("comment", "gift", "free_gift", "system_msg")
+SAVE_INTERVAL_SEC = float(os.environ.get("SRLOG_SAVE_INTERVAL_SEC", "300"))
+SAVE_MAX_EVENTS = int(os.environ.get("SRLOG_SAVE_EVENTS", "100"))
+SAVE_MAX_BYTES = int(os.environ.get("SRLOG_SAVE_KB", "256")) * 1024
+SAVE_MIN_INTERVAL_SEC = float(os.environ.get("SRLOG_SAVE_MIN_INTERVAL_SEC", "30"))
+
+
+class SaveScheduler:
+    """
+    1ルーム分の保存スケジュール。ログ (EventLog) の version と added_bytes を前回の保存時と比べる。
+    version は追加だけでなく無償ギフトの連打の合算でも増えるため、合算された分も「更新」として数える
+    """
+
+    def __init__(self, interval_sec=SAVE_INTERVAL_SEC, max_events=SAVE_MAX_EVENTS, max_bytes=SAVE_MAX_BYTES,
+                 min_interval_sec=SAVE_MIN_INTERVAL_SEC, clock=time.time):
+        self.interval_sec = interval_sec
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.min_interval_sec = min_interval_sec
+        self.clock = clock
+        self.saved = {}                    # {kind: (保存時の version, 保存時の added_bytes)}
+        self.saved_at = clock()            # 前回の保存（成功）の時刻。開始時は開始時刻
+        self.attempted_at = 0              # 前回の保存を試みた時刻（最短間隔の判定用）
+
+    def pending(self, logs):
+        """{kind: (前回の保存からの追加・更新件数, 追加バイト数)}。変化のないログは含まない"""
+        result = {}
+        for kind, log in logs.items():
+            version, added_bytes = self.saved.get(kind, (0, 0))
+            if log.version != version:
+                result[kind] = (max(0, log.version - version), max(0, log.added_bytes - added_bytes))
+        return result
+
+    def due(self, logs):
+        """
+        今保存すべきなら (保存するログの kind のリスト, 理由) を、そうでなければ ([], None) を返す。
+        理由は "events" / "bytes" / "interval" のいずれか
+        """
+        now = self.clock()
+        if now - self.attempted_at < self.min_interval_sec:
+            return [], None
+        pending = self.pending(logs)
+        if not pending:
+            return [], None
+        if any(events >= self.max_events for events, _ in pending.values()):
+            reason = "events"
+        elif sum(added for _, added in pending.values()) >= self.max_bytes:
+            reason = "bytes"
+        elif now - self.saved_at >= self.interval_sec:
+            reason = "interval"
+        else:
+            return [], None
+        return [kind for kind in SAVE_KINDS if kind in pending], reason
+
+    def snapshot(self, logs):
+        """保存するログの現在の (version, added_bytes)。CSV を作る直前に取り、保存に成功したら mark_saved() へ渡す"""
+        return {kind: (log.version, log.added_bytes) for kind, log in logs.items()}
+
+    def mark_attempted(self):
+        self.attempted_at = self.clock()
+
+    def mark_saved(self, snapshot):
+        self.saved.update(snapshot)
+        self.saved_at = self.clock()
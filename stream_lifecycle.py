@@ -0,0 +1,62 @@
+import threading
+import time
+
+# --- 配信ライフサイクル: tracking → ended → finalized ---
+# 配信終了後の最終保存を「1回だけ」実行するための状態管理
+TRACKING = "tracking"
+ENDED = "ended"
+FINALIZED = "finalized"
+
+
+class StreamLifecycle:
+    def __init__(self, room_id):
+        self.room_id = str(room_id)
+        self.state = TRACKING
+        self.started_at = time.time()
+        self.ended_at = None
+        self.finalized_at = None
+        self._lock = threading.Lock()
+
+    def mark_ended(self):
+        """配信終了を検知した時に呼ぶ（tracking のときだけ ended に遷移）"""
+        with self._lock:
+            if self.state == TRACKING:
+                self.state = ENDED
+                self.ended_at = time.time()
+
+    def finalize(self, flush):
+        """
+        最終保存 flush() を一度だけ実行して finalized に遷移する。
+        既に finalized なら何もせず False を返す。flush() が例外を投げた場合は遷移せず、次回に再試行される。
+        """
+        with self._lock:
+            if self.state == FINALIZED:
+                return False
+            if self.state == TRACKING:
+                self.state = ENDED
+                self.ended_at = time.time()
+            flush()
+            self.state = FINALIZED
+            self.finalized_at = time.time()
+            return True
+
+    @property
+    def is_finalized(self):
+        return self.state == FINALIZED
+
+
+def get_stream_lifecycle(store, room_id):
+    """store (ルームID → StreamLifecycle の辞書) からルームのライフサイクルを取得、なければ作成する"""
+    key = str(room_id)
+    lifecycle = store.get(key)
+    if lifecycle is None:
+        lifecycle = StreamLifecycle(key)
+        store[key] = lifecycle
+    return lifecycle
+
+
+def reset_stream_lifecycle(store, room_id):
+    """トラッキング開始時に呼び、ルームのライフサイクルを tracking から作り直す"""
+    lifecycle = StreamLifecycle(room_id)
+    store[str(room_id)] = lifecycle
+    return lifecycle
@@ -0,0 +1,81 @@
+import re
+
+# --- システムメッセージ (t: 18) の分類 ---
+# 受信スレッドで1フレームにつき1回だけ分類し、種別・訪問回数・ファンレベルをイベントに持たせる
+# （表示の色分け・絞り込み・集計で本文の文字列検索を繰り返さないため）
+VISIT_NTH = "visit_nth"          # 〇〇回目の訪問
+FIRST_VISIT = "first_visit"      # 初訪問
+SECOND_VISIT = "second_visit"    # 2度目の訪問
+VISIT = "visit"                  # 上記以外の訪問
+FOLLOW = "follow"                # フォローしました
+FAN_LEVEL = "fan_level"          # ファンレベルが〇〇に
+MILESTONE = "milestone"          # 〇〇人になりました
+OTHER = "other"
+GAP = "gap"                      # 受信の欠落（配信の再開で受信先を切り替えた区間。アプリが記録する）
+
+VISIT_KINDS = (VISIT_NTH, FIRST_VISIT, SECOND_VISIT, VISIT)
+KIND_LABELS = {
+    VISIT_NTH: "〇回目の訪問",
+    FIRST_VISIT: "初訪問",
+    SECOND_VISIT: "2度目の訪問",
+    VISIT: "訪問",
+    FOLLOW: "フォロー",
+    FAN_LEVEL: "ファンレベル",
+    MILESTONE: "人数達成",
+    OTHER: "その他",
+    GAP: "受信の欠落",
+}
+
+_VISIT_NTH_RE = re.compile(r"(\d+)回目の訪問")
+_FAN_LEVEL_RE = re.compile(r"ファンレベルが(\d+)に")
+
+
+def classify_system_message(text):
+    """本文から {"kind", "visit_count", "fan_level"} を返す（該当しない項目は None）"""
+    text = text or ""
+    m = _VISIT_NTH_RE.search(text)
+    if m:
+        return {"kind": VISIT_NTH, "visit_count": int(m.group(1)), "fan_level": None}
+    if "回目の訪問" in text:
+        return {"kind": VISIT_NTH, "visit_count": None, "fan_level": None}
+    if "初訪問" in text:
+        return {"kind": FIRST_VISIT, "visit_count": 1, "fan_level": None}
+    if "2度目の訪問" in text:
+        return {"kind": SECOND_VISIT, "visit_count": 2, "fan_level": None}
+    if "フォローしました" in text:
+        return {"kind": FOLLOW, "visit_count": None, "fan_level": None}
+    m = _FAN_LEVEL_RE.search(text)
+    if m:
+        return {"kind": FAN_LEVEL, "visit_count": None, "fan_level": int(m.group(1))}
+    if "人になりました" in text:
+        return {"kind": MILESTONE, "visit_count": None, "fan_level": None}
+    if "訪問" in text:
+        return {"kind": VISIT, "visit_count": None, "fan_level": None}
+    return {"kind": OTHER, "visit_count": None, "fan_level": None}
+
+
+def classified(entry):
+    """分類済みでないログ（古い記録の再生など）はその場で分類して返す"""
+    if entry.get("kind"):
+        return entry
+    return dict(entry, **classify_system_message(entry.get("message", "")))
+
+
+def highlight_color(entry):
+    """ダッシュボードの背景色（以前の本文検索による色分けと同じ優先順位）"""
+    kind = entry.get("kind")
+    if kind == VISIT_NTH:
+        return "#ffebee"  # 薄い赤（お祝い感）
+    if kind == FIRST_VISIT:
+        return "#e3f2fd"  # 薄い青（フレッシュな印象）
+    if kind == SECOND_VISIT:
+        return "#f5f5f5"  # ごく薄いグレー
+    if kind == FOLLOW:
+        return "#e8f5e9"  # 薄い緑（新規アクション感）
+    if kind == MILESTONE or (kind == FAN_LEVEL and entry.get("fan_level") == 10):
+        return "#fff3cd"  # ゴールド（ファン化）
+    if kind == FAN_LEVEL and entry.get("fan_level") == 9:
+        return "#fff9e6"  # さらに薄いイエロー（リーチ）
+    if kind == GAP:
+        return "#eeeeee"  # グレー（取得できていない可能性のある区間）
+    return "transparent"
@@ -0,0 +1,101 @@
+import threading
+
+# --- 分単位の推移（コメント数・有償ギフトPt・無償ギフト数・訪問数）とギフト貢献ランキングの推移 ---
+# 取り込み時に record() で該当する1分バケットへ加算するだけにして、グラフは固定長のリングバッファから作る
+# （10秒ごとの更新で全ログを集計し直さないため）
+SERIES_KINDS = ("comments", "gift_points", "free_gifts", "visits")
+SERIES_LABELS = {
+    "comments": "コメント数/分",
+    "gift_points": "有償ギフトPt/分",
+    "free_gifts": "無償ギフト数/分",
+    "visits": "訪問数/分",
+}
+# リングバッファに保持する分数（これより古いバケットは上書きされる）
+TIME_SERIES_MINUTES = 360
+
+
+class MinuteSeries:
+    def __init__(self, minutes=TIME_SERIES_MINUTES):
+        self.minutes = minutes
+        self._counts = {kind: [0] * minutes for kind in SERIES_KINDS}
+        self._user_points = [None] * minutes   # スロットごとの {user_id: 有償ギフトPt}
+        self._slot_minute = [-1] * minutes     # スロットが表している分 (epoch秒 // 60)
+        self.latest_minute = None
+        self.user_totals = {}                  # {user_id: 配信全体の有償ギフトPt}
+        self.user_names = {}                   # {user_id: 最新のユーザー名}
+        self._lock = threading.Lock()
+
+    def _slot(self, minute):
+        """minute のスロット番号を返す。保持範囲より古い分なら None"""
+        if self.latest_minute is not None and minute <= self.latest_minute - self.minutes:
+            return None
+        i = minute % self.minutes
+        if self._slot_minute[i] != minute:
+            # 古い分のスロットを再利用する
+            self._slot_minute[i] = minute
+            for kind in SERIES_KINDS:
+                self._counts[kind][i] = 0
+            self._user_points[i] = None
+        return i
+
+    def record(self, kind, ts, value=1, user_id=None, name=None):
+        """ts (epoch秒) の1分バケットの kind に value を加算する。gift_points は user_id 単位でも集計する"""
+        if not value:
+            return
+        minute = int(ts) // 60
+        with self._lock:
+            if kind == "gift_points" and user_id is not None:
+                self.user_totals[user_id] = self.user_totals.get(user_id, 0) + value
+                if name:
+                    self.user_names[user_id] = name
+            i = self._slot(minute)
+            if i is None:
+                return
+            self._counts[kind][i] += value
+            if kind == "gift_points" and user_id is not None:
+                if self._user_points[i] is None:
+                    self._user_points[i] = {}
+                self._user_points[i][user_id] = self._user_points[i].get(user_id, 0) + value
+            if self.latest_minute is None or minute > self.latest_minute:
+                self.latest_minute = minute
+
+    def _window(self, last_minutes):
+        if self.latest_minute is None:
+            return []
+        n = min(last_minutes or self.minutes, self.minutes)
+        return range(self.latest_minute - n + 1, self.latest_minute + 1)
+
+    def rows(self, last_minutes=None):
+        """直近 last_minutes 分の [(分の開始 epoch秒, {kind: 値})]。イベントのない分は 0 で埋める"""
+        with self._lock:
+            out = []
+            for minute in self._window(last_minutes):
+                i = minute % self.minutes
+                if self._slot_minute[i] == minute:
+                    out.append((minute * 60, {kind: self._counts[kind][i] for kind in SERIES_KINDS}))
+                else:
+                    out.append((minute * 60, {kind: 0 for kind in SERIES_KINDS}))
+            return out
+
+    def leaderboard(self, top_n=5, last_minutes=None):
+        """
+        配信全体の有償ギフトPt上位 top_n ユーザーについて、各分の時点での累計Ptの推移を返す。
+        戻り値: (分の開始 epoch秒のリスト, [(user_id, ユーザー名, [累計Pt...])])
+        """
+        with self._lock:
+            top = sorted(self.user_totals.items(), key=lambda kv: kv[1], reverse=True)[:top_n]
+            window = list(self._window(last_minutes))
+            per_minute = []
+            for minute in window:
+                i = minute % self.minutes
+                per_minute.append(self._user_points[i] if self._slot_minute[i] == minute and self._user_points[i] else {})
+            series = []
+            for user_id, total in top:
+                # 表示範囲より前の分は開始値としてまとめる
+                running = total - sum(points.get(user_id, 0) for points in per_minute)
+                values = []
+                for points in per_minute:
+                    running += points.get(user_id, 0)
+                    values.append(running)
+                series.append((user_id, self.user_names.get(user_id, str(user_id)), values))
+            return [minute * 60 for minute in window], series
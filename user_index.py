@@ -0,0 +1,171 @@
+import sys
+import threading
+from collections import deque
+
+# --- ユーザー単位の索引（コメント・有償ギフト・無償ギフト・システムMSGを user_id で横断） ---
+# 取り込み時に record() で更新し、最新の名前・アバター・初回/最終の記録時刻・種類別の件数・ポイント合計と、
+# ユーザーごとの直近のイベント（タイムライン）を保持する。タイムラインは4つのログを走査せずにこの索引から作る。
+# タイムラインの行はログとは別に内容を持つため、推定サイズがメモリ予算を超えたら全ユーザーを通して古い行から捨てる
+EVENT_KINDS = ("comment", "gift", "free_gift", "system_msg")
+EVENT_LABELS = {"comment": "コメント", "gift": "スペシャルギフト", "free_gift": "無償ギフト", "system_msg": "システムMSG"}
+# 1ユーザーあたりに保持するタイムラインの件数（古いものから捨てる。件数・合計には影響しない）
+USER_TIMELINE_MAX = 500
+DEFAULT_MEMORY_BUDGET_BYTES = 4 * 1024 * 1024
+# タイムラインの1行（リスト・記録順の管理）のおおよそのオーバーヘッド
+_TIMELINE_ROW_BYTES = 160
+
+
+class UserRecord:
+    __slots__ = ("user_id", "name", "name_at", "avatar_id", "avatar_url", "first_seen", "last_seen",
+                 "counts", "gift_points", "free_gift_points", "timeline")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.name = ""
+        self.name_at = -1
+        self.avatar_id = None
+        self.avatar_url = None
+        self.first_seen = None
+        self.last_seen = None
+        self.counts = dict.fromkeys(EVENT_KINDS, 0)
+        self.gift_points = 0
+        self.free_gift_points = 0
+        # [created_at, kind, 内容, 個数] 記録順（無償ギフトの連打は直前の行へ個数を合算）
+        self.timeline = deque(maxlen=USER_TIMELINE_MAX)
+
+    def to_row(self):
+        return {
+            "user_id": self.user_id, "name": self.name,
+            "first_seen": self.first_seen, "last_seen": self.last_seen,
+            "comment_count": self.counts["comment"], "gift_count": self.counts["gift"],
+            "free_gift_count": self.counts["free_gift"], "system_msg_count": self.counts["system_msg"],
+            "gift_points": self.gift_points, "free_gift_points": self.free_gift_points,
+        }
+
+
+def _summary(kind, entry):
+    if kind == "comment":
+        return entry.get("comment", ""), 1
+    if kind in ("gift", "free_gift"):
+        return entry.get("gift_name", ""), entry.get("num", 1)
+    return entry.get("message", ""), 1
+
+
+class UserIndex:
+    def __init__(self, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES):
+        self.users = {}  # {user_id: UserRecord}
+        self.memory_budget_bytes = memory_budget_bytes
+        # タイムラインの全行を記録順に (UserRecord, 行, 推定サイズ) で持つ。USER_TIMELINE_MAX で既に捨てた行も
+        # ここから外れるまではサイズに数える
+        self._timeline_rows = deque()
+        self._timeline_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def memory_bytes(self):
+        """タイムラインの推定サイズ（メモリ予算と比べる値）"""
+        return self._timeline_bytes
+
+    def __len__(self):
+        return len(self.users)
+
+    def record(self, kind, entry, points=0, merged=False):
+        """
+        kind のイベント entry を索引に反映する。points は有償・無償ギフトのポイント（個数×単価）。
+        merged=True は無償ギフトの連打を合算した場合で、タイムラインの直前の行へ個数を足す。
+        """
+        user_id = entry.get("user_id")
+        if user_id is None:
+            return
+        ts = entry.get("created_at", 0)
+        with self._lock:
+            user = self.users.get(user_id)
+            if user is None:
+                user = UserRecord(user_id)
+                self.users[user_id] = user
+            name = entry.get("name")
+            if name and ts >= user.name_at:
+                user.name = name
+                user.name_at = ts
+            if entry.get("avatar_id"):
+                user.avatar_id = entry.get("avatar_id")
+            if entry.get("avatar_url"):
+                user.avatar_url = entry.get("avatar_url")
+            if user.first_seen is None or ts < user.first_seen:
+                user.first_seen = ts
+            if user.last_seen is None or ts > user.last_seen:
+                user.last_seen = ts
+            user.counts[kind] += 1
+            if kind == "gift":
+                user.gift_points += points
+            elif kind == "free_gift":
+                user.free_gift_points += points
+
+            text, num = _summary(kind, entry)
+            last = user.timeline[-1] if user.timeline else None
+            if merged and last is not None and last[1] == kind and last[2] == text:
+                last[3] += num
+            else:
+                row = [ts, kind, text, num]
+                size = _TIMELINE_ROW_BYTES + sys.getsizeof(text)
+                user.timeline.append(row)
+                self._timeline_rows.append((user, row, size))
+                self._timeline_bytes += size
+                if self._timeline_bytes > self.memory_budget_bytes:
+                    self._evict_timeline()
+
+    def _evict_timeline(self):
+        """タイムラインの推定サイズが予算の半分になるまで、全ユーザーを通して古い行から捨てる"""
+        target = self.memory_budget_bytes // 2
+        rows = self._timeline_rows
+        while rows and self._timeline_bytes > target:
+            user, row, size = rows.popleft()
+            # ユーザーごとの行も記録順なので、まだ残っていればそのユーザーの最も古い行
+            if user.timeline and user.timeline[0] is row:
+                user.timeline.popleft()
+            self._timeline_bytes -= size
+
+    def add_points(self, kind, user_id, points):
+        """記録済みのギフトのポイントを後から加算する（取り込み時にギフトリストになく、0 pt で記録した分）"""
+        with self._lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return
+            if kind == "gift":
+                user.gift_points += points
+            elif kind == "free_gift":
+                user.free_gift_points += points
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    def names(self):
+        """{user_id: 最新のユーザー名}（ランキング表の表示名用）"""
+        with self._lock:
+            return {user_id: user.name for user_id, user in self.users.items()}
+
+    def rows(self):
+        with self._lock:
+            return [user.to_row() for user in self.users.values()]
+
+    def find(self, query, limit=50):
+        """user_id の完全一致、またはユーザー名の部分一致で検索する"""
+        query = (query or "").strip()
+        if not query:
+            return []
+        with self._lock:
+            if query.isdigit():
+                for key in (int(query), query):
+                    if key in self.users:
+                        return [self.users[key]]
+            hits = [user for user in self.users.values() if query in user.name]
+        hits.sort(key=lambda user: user.last_seen or 0, reverse=True)
+        return hits[:limit]
+
+    def timeline(self, user_id):
+        """ユーザーの直近のイベント [(created_at, kind, 内容, 個数)] を新しい順で返す"""
+        with self._lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return []
+            return sorted((tuple(item) for item in user.timeline), key=lambda item: item[0], reverse=True)